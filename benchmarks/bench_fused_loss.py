@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault("RWKV_MY_TESTING", "x070")
+os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+os.environ.setdefault("RWKV_COMPILE_ON", "0")
+os.environ.setdefault("RWKV_WKV_BACKEND", "torch")
+
+from src.model import FusedHeadL2Loss, L2Wrap  # noqa: E402
+
+"""
+Head + cross-entropy + L2Wrap: full logits vs FusedHeadL2Loss (train.py --loss_chunk).
+
+python benchmarks/bench_fused_loss.py                                  # B16 T512 D768, vocab 370
+python benchmarks/bench_fused_loss.py --micro_bsz 192 --dtype bf16 --chunks 2048,8192,32768
+python benchmarks/bench_fused_loss.py --autocast bf16        # fp32 x / weight, half logits (--precision bf16)
+
+Runs forward + backward of the loss from the ln_out output for each setting,
+checks loss and gradients against the L2Wrap path, and reports time and memory:
+peak allocated on CUDA, and on CPU the bytes autograd keeps for the backward
+(the part that grows with the batch).
+"""
+
+
+def reference(x, weight, targets, chunk):
+    logits = x @ weight.t()
+    loss = F.cross_entropy(logits.view(-1, logits.size(-1)), targets.view(-1))
+    return L2Wrap.apply(loss, logits)
+
+
+def fused(x, weight, targets, chunk):
+    return FusedHeadL2Loss.apply(x, weight, targets, chunk)
+
+
+def run(fn, x, weight, targets, chunk, autocast=None):
+    """(loss, dx, dw, seconds, memory bytes)."""
+    x.grad = weight.grad = None
+    saved = {}
+
+    def pack(t):
+        saved[(t.data_ptr(), t.dtype, tuple(t.shape))] = t.numel() * t.element_size()
+        return t
+
+    if x.is_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    t0 = time.perf_counter()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t), \
+            torch.autocast(x.device.type, dtype=autocast or torch.bfloat16, enabled=autocast is not None):
+        loss = fn(x, weight, targets, chunk)
+    loss.backward()
+    if x.is_cuda:
+        torch.cuda.synchronize()
+    dt = time.perf_counter() - t0
+    mem = torch.cuda.max_memory_allocated() - base if x.is_cuda else sum(saved.values())
+    return loss.detach().float(), x.grad, weight.grad, dt, mem
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory-lean fused head + loss')
+    parser.add_argument('--micro_bsz', type=int, default=16)
+    parser.add_argument('--ctx_len', type=int, default=512)
+    parser.add_argument('--n_embd', type=int, default=768)
+    parser.add_argument('--vocab_size', type=int, default=370)
+    parser.add_argument('--chunks', default='1024,4096,16384')
+    parser.add_argument('--dtype', default='fp32', choices=['fp32', 'bf16'])
+    parser.add_argument('--autocast', default='', choices=['', 'bf16', 'fp16'], help='run both paths under autocast')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dtype = torch.bfloat16 if args.dtype == 'bf16' else torch.float32
+    autocast = {'': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}[args.autocast]
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(args.micro_bsz, args.ctx_len, args.n_embd, generator=g).to(device, dtype).requires_grad_()
+    weight = (torch.randn(args.vocab_size, args.n_embd, generator=g) * args.n_embd ** -0.5).to(device, dtype).requires_grad_()
+    targets = torch.randint(0, args.vocab_size, (args.micro_bsz, args.ctx_len), generator=g).to(device)
+    print(f"### B{args.micro_bsz} T{args.ctx_len} D{args.n_embd} vocab {args.vocab_size} {args.dtype}"
+          f"{' autocast ' + args.autocast if autocast else ''} on {device}, "
+          f"memory = {'peak allocated' if device == 'cuda' else 'saved for backward'}")
+
+    ref = None
+    settings = [('full logits', reference, 0)] + [(f'chunk {c}', fused, int(c)) for c in args.chunks.split(',')]
+    for name, fn, chunk in settings:
+        best = float('inf')
+        for _ in range(args.repeat):
+            loss, dx, dw, dt, mem = run(fn, x, weight, targets, chunk, autocast)
+            best = min(best, dt)
+        tokens = args.micro_bsz * args.ctx_len
+        line = f"  {name:>12} {best * 1000:9.1f} ms {tokens / best:12.0f} tok/s {mem / 2**20:9.1f} MiB"
+        if ref is None:
+            ref = (loss, dx.clone(), dw.clone())
+        else:
+            err = [(a.float() - b.float()).abs().max().item() / max(b.float().abs().max().item(), 1e-12)
+                   for a, b in zip((loss, dx, dw), ref)]
+            line += f"  rel err loss {err[0]:.1e} dx {err[1]:.1e} dw {err[2]:.1e}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
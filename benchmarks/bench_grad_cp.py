@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+import types
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+"""
+Activation checkpointing benchmark: throughput vs peak memory of train.py --grad_cp 2.
+
+python benchmarks/bench_grad_cp.py                                    # L6 D512, B2 T512
+python benchmarks/bench_grad_cp.py --n_layer 12 --n_embd 768 --micro_bsz 16 --settings none,block:1,block:3,ffn:1
+
+Each setting is --grad_cp_policy:--grad_cp_every ("none" = no checkpointing)
+and runs forward + backward of the training loss. Memory is the peak allocated
+during the steps on CUDA, on CPU the activations autograd keeps for the
+backward, not counting the inputs of checkpointed blocks (the CPU allocator
+hides the peak). The gradients are checked
+against "none".
+"""
+
+
+def build_model(args, setting):
+    os.environ.setdefault("RWKV_MY_TESTING", "x070")
+    os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+    os.environ.setdefault("RWKV_COMPILE_ON", "0")
+    from src.model import RWKV
+
+    policy, every = ("block", 1) if setting == "none" else setting.split(":")
+    margs = types.SimpleNamespace(n_embd=args.n_embd, n_layer=args.n_layer, vocab_size=args.vocab_size,
+                                  ctx_len=args.ctx_len, my_testing="x070", head_size=64, dim_att=args.n_embd,
+                                  dim_ffn=args.n_embd * 4, grad_cp=0 if setting == "none" else 2,
+                                  grad_cp_every=int(every), grad_cp_policy=policy)
+    torch.manual_seed(0)
+    model = RWKV(margs)
+    with torch.no_grad():
+        for p in model.parameters():  # zero-initialized outputs would make the blocks trivial
+            p.add_(torch.randn_like(p) * 0.02)
+    return model
+
+
+def run(args, setting, device, dtype):
+    """(seconds per step, memory bytes, gradient norms) of one setting."""
+    model = build_model(args, setting).to(device, dtype)
+    g = torch.Generator().manual_seed(1)
+    idx = torch.randint(0, args.vocab_size, (args.micro_bsz, args.ctx_len + 1), generator=g).to(device)
+    x, y = idx[:, :-1], idx[:, 1:]
+    saved = {}
+
+    def pack(t):
+        saved[(t.data_ptr(), t.dtype, tuple(t.shape))] = t.numel() * t.element_size()
+        return t
+
+    def step():
+        model.zero_grad(set_to_none=True)
+        saved.clear()
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            logits = model(x)
+            loss = F.cross_entropy(logits.reshape(-1, logits.size(-1)), y.reshape(-1))
+        loss.backward()
+
+    step()  # warmup (kernel build / allocator)
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    best = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        step()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - t0)
+    # checkpointed regions save through their own hooks, so `saved` is what stays alive until the backward
+    mem = torch.cuda.max_memory_allocated() - base if device == "cuda" else sum(saved.values())
+    grads = [p.grad.float().norm().item() for p in model.parameters() if p.grad is not None]
+    del model
+    return best, mem, grads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='torch.utils.checkpoint policies: throughput vs peak memory')
+    parser.add_argument('--n_layer', type=int, default=6)
+    parser.add_argument('--n_embd', type=int, default=512)
+    parser.add_argument('--vocab_size', type=int, default=370)
+    parser.add_argument('--micro_bsz', type=int, default=2)
+    parser.add_argument('--ctx_len', type=int, default=512)
+    parser.add_argument('--settings', default='none,block:1,block:2,block:3,ffn:1,ffn:2')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.bfloat16 if device == "cuda" else torch.float32
+    print(f"### L{args.n_layer} D{args.n_embd} B{args.micro_bsz} T{args.ctx_len} on {device}, forward + backward per step, "
+          f"memory = {'peak allocated' if device == 'cuda' else 'activations saved for backward'}")
+    ref = None
+    for setting in args.settings.split(','):
+        seconds, mem, grads = run(args, setting, device, dtype)
+        tokens = args.micro_bsz * args.ctx_len
+        line = f"  {setting:>10} {seconds * 1000:9.1f} ms {tokens / seconds:10.0f} tok/s {mem / 2**20:9.1f} MiB"
+        if ref is None:
+            ref = (seconds, mem, grads)
+        else:
+            err = max(abs(a - b) / max(abs(b), 1e-12) for a, b in zip(grads, ref[2]))
+            line += (f"  x{ref[0] / seconds:.2f} speed, x{mem / max(ref[1], 1):.2f} memory, "
+                     f"grad norm rel err {err:.1e}")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import time
+import types
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault("RWKV_MY_TESTING", "x070")
+os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+os.environ.setdefault("RWKV_COMPILE_ON", "0")
+os.environ.setdefault("RWKV_FLOAT_MODE", "fp32")
+
+import src.model  # noqa: E402
+from src.model import RWKV  # noqa: E402
+from src.trainer import resize_rows  # noqa: E402
+
+"""
+Weight init time (train.py --train_stage 1) for wide models.
+
+python benchmarks/bench_init.py                          # L12 D2048
+python benchmarks/bench_init.py --n_layer 32 --n_embd 4096
+
+Times the per-channel init vectors of RWKV_Tmix_x070 / RWKV_CMix_x070, the
+model construction, generate_init_weight and the load_model resize of the
+embedding, each against the per-element / per-tensor Python loops they
+replaced (kept below as references), and checks that the results agree.
+"""
+
+
+def legacy_vectors(C, N, layer_id, n_layer):
+    """The channel loops of RWKV_Tmix_x070.__init__ before vectorization."""
+    ratio_0_to_1 = layer_id / (n_layer - 1)
+    ddd = torch.ones(1, 1, C)
+    for i in range(C):
+        ddd[0, 0, i] = i / C
+    www = torch.zeros(C)
+    zigzag = torch.zeros(C)
+    linear = torch.zeros(C)
+    for n in range(C):
+        linear[n] = n / (C - 1) - 0.5
+        zigzag[n] = ((n % N) - ((N - 1) / 2)) / ((N - 1) / 2)
+        zigzag[n] = zigzag[n] * abs(zigzag[n])
+        www[n] = -6 + 6 * (n / (C - 1)) ** (1 + 1 * ratio_0_to_1**0.3)
+    return ddd, www, zigzag, linear
+
+
+def vectors(C, N, layer_id, n_layer):
+    ratio_0_to_1 = layer_id / (n_layer - 1)
+    ddd = (torch.arange(C, dtype=torch.float64) / C).float().view(1, 1, C)
+    n = torch.arange(C, dtype=torch.float64)
+    linear = (n / (C - 1) - 0.5).float()
+    zigzag = (((n % N) - ((N - 1) / 2)) / ((N - 1) / 2)).float()
+    zigzag = zigzag * zigzag.abs()
+    www = (-6 + 6 * (n / (C - 1)) ** (1 + 1 * ratio_0_to_1**0.3)).float()
+    return ddd, www, zigzag, linear
+
+
+def legacy_orthogonal(count, shape, gain, device="cpu"):
+    return [nn.init.orthogonal_(torch.empty(shape, device=device), gain=gain) for _ in range(count)]
+
+
+def legacy_resize(src, dd):
+    tmp = torch.empty(dd, *src.shape[1:])
+    ss = src.shape[0]
+    for i in range(dd):
+        pos = i / dd * ss
+        if pos >= ss - 1:
+            tmp[i] = src[ss - 1]
+        else:
+            p0 = int(math.floor(pos))
+            ii = pos - p0
+            tmp[i] = src[p0] * (1 - ii) + src[p0 + 1] * (ii)
+    return tmp
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        out = fn()
+    return time.perf_counter() - t0, out
+
+
+def report(name, t_old, t_new, err=None):
+    line = f"  {name:<28} {t_old * 1000:10.1f} ms -> {t_new * 1000:9.1f} ms  x{t_old / max(t_new, 1e-9):7.1f}"
+    if err is not None:
+        line += f"  max abs diff {err:.1e}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RWKV-7 weight init time')
+    parser.add_argument('--n_layer', type=int, default=12)
+    parser.add_argument('--n_embd', type=int, default=2048)
+    parser.add_argument('--vocab_size', type=int, default=370)
+    parser.add_argument('--resize_to', type=int, default=65536, help='rows of the resized embedding')
+    args = parser.parse_args()
+
+    C, N, L = args.n_embd, 64, args.n_layer
+    margs = types.SimpleNamespace(n_embd=C, n_layer=L, vocab_size=args.vocab_size, ctx_len=512, my_testing="x070",
+                                  head_size=N, dim_att=C, dim_ffn=C * 4, grad_cp=0, accelerator="cpu")
+    print(f"### L{L} D{C} vocab {args.vocab_size}, {torch.get_num_threads()} threads")
+
+    t_old, old = timed(lambda: [legacy_vectors(C, N, i, L) for i in range(L)])
+    t_new, new = timed(lambda: [vectors(C, N, i, L) for i in range(L)])
+    err = max((a - b).abs().max().item() for o, n in zip(old, new) for a, b in zip(o, n))
+    report("Tmix channel vectors", t_old, t_new, err)
+
+    t_model, model = timed(lambda: RWKV(margs))
+    print(f"  {'RWKV(args)':<28} {t_model * 1000:10.1f} ms")
+
+    # generate_init_weight with the per-tensor orthogonal_ and the state_dict() per name it had before
+    src.model._orthogonal, batched = legacy_orthogonal, src.model._orthogonal
+    t_sd, _ = timed(lambda: [model.state_dict()[n] for n in model.state_dict()])
+    t_old, _ = timed(model.generate_init_weight)
+    src.model._orthogonal = batched
+    t_new, mm = timed(model.generate_init_weight)
+    report("generate_init_weight", t_old + t_sd, t_new)
+    w = mm["blocks.0.att.receptance.weight"].float()
+    print(f"  {'':<28} orthogonality |W W^T / gain^2 - I| = {(w @ w.t() - torch.eye(C)).abs().max().item():.1e}")
+
+    emb = torch.randn(args.vocab_size, C)
+    t_old, old = timed(lambda: legacy_resize(emb, args.resize_to))
+    t_new, new = timed(lambda: resize_rows(emb, args.resize_to))
+    report(f"resize emb to {args.resize_to} rows", t_old, t_new, (old - new).abs().max().item())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'katago_data')))
+
+from sgf_parser import SGFParser, iter_games  # noqa: E402
+
+"""
+SGF parsing benchmark.
+
+python benchmarks/bench_sgf_parser.py                   # synthetic KataGo-like games
+python benchmarks/bench_sgf_parser.py --sgf_dir games/  # real files
+
+Compares the old SGF2jsonl.py approach (one regex over each file, one file per
+game) with the streaming parser on the same files and on a single multi-game
+file holding the same games.
+"""
+
+OLD_MOVE_RE = re.compile(r';[BW]\[([a-zA-Z]{2})\]')
+COORDS = "abcdefghijklmnopqrs"
+
+
+def synthetic_game(rng):
+    n = rng.randint(150, 350)
+    head = f"(;FF[4]GM[1]SZ[19]KM[7.5]RU[Chinese]PB[kata1-b18]PW[kata1-b18]RE[{rng.choice('BW')}+R]"
+    moves = "".join(f";{'BW'[i % 2]}[{rng.choice(COORDS)}{rng.choice(COORDS)}]" for i in range(n))
+    return head + moves + ")\n"
+
+
+def bench(name, fn, n_games):
+    t0 = time.perf_counter()
+    n = fn()
+    dt = time.perf_counter() - t0
+    assert n == n_games, (name, n, n_games)
+    print(f"{name:<34} {dt:8.3f}s {n_games / dt:12.0f} games/s")
+    return dt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sgf_dir', default='', help='folder of real .sgf files (default: synthetic)')
+    parser.add_argument('--n_games', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.sgf_dir:
+            paths = []
+            for root, _, files in os.walk(args.sgf_dir):
+                paths += [os.path.join(root, f) for f in files if f.lower().endswith('.sgf')]
+            paths = paths[:args.n_games]
+        else:
+            rng = random.Random(args.seed)
+            paths = []
+            for i in range(args.n_games):
+                path = os.path.join(tmp, f"{i}.sgf")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(synthetic_game(rng))
+                paths.append(path)
+        multi = os.path.join(tmp, 'all.sgfs')
+        with open(multi, 'w', encoding='utf-8') as out:
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    out.write(f.read().strip() + '\n')
+        n_games = len(paths)
+        print(f"### {n_games} games, {os.path.getsize(multi) / 1e6:.1f} MB")
+
+        def old_regex_per_file():
+            n = 0
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    OLD_MOVE_RE.findall(f.read())
+                n += 1
+            return n
+
+        def parser_per_file():
+            n = 0
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    n += len(SGFParser().feed(f.read(), eof=True))
+            return n
+
+        def parser_streaming():
+            with open(multi, 'r', encoding='utf-8') as f:
+                return sum(1 for _ in iter_games(f))
+
+        base = bench('regex per file (SGF2jsonl old)', old_regex_per_file, n_games)
+        bench('parser per file', parser_per_file, n_games)
+        dt = bench('parser streaming multi-game file', parser_streaming, n_games)
+        print(f"### streaming parser vs regex per file: {base / dt:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+import types
+
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from infer.rwkv7_prefill import RWKV7Prefill  # noqa: E402
+
+"""
+Prompt prefill benchmark for RWKV-7 on CPU.
+
+python benchmarks/bench_wkv7_prefill.py                                   # random L12-D384 model
+python benchmarks/bench_wkv7_prefill.py --model out/L24-D384-x070/rwkv-final.pth --prompt_len 386
+
+Feeds the same prompt token by token (the RNN path) and in one chunked
+prefill per chunk size, checks that the last logits and the final state
+agree, then that the prefilled state continues like the sequential one.
+A random model is checked against src/model.py's training forward too.
+"""
+
+
+def random_model(n_layer, n_embd, vocab_size):
+    os.environ.setdefault("RWKV_MY_TESTING", "x070")
+    os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+    os.environ.setdefault("RWKV_COMPILE_ON", "0")
+    os.environ.setdefault("RWKV_WKV_BACKEND", "torch")
+    from src.model import RWKV
+
+    args = types.SimpleNamespace(n_embd=n_embd, n_layer=n_layer, vocab_size=vocab_size, ctx_len=4096,
+                                 my_testing="x070", head_size=64, dim_att=n_embd, dim_ffn=n_embd * 4, grad_cp=0)
+    torch.manual_seed(0)
+    model = RWKV(args)
+    with torch.no_grad():
+        for p in model.parameters():  # zero-initialized outputs would hide everything
+            p.add_(torch.randn_like(p) * 0.02)
+    return model
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked prefill vs token-by-token RWKV-7 on CPU')
+    parser.add_argument('--model', default='', help='train.py checkpoint (.pth), default a random model')
+    parser.add_argument('--n_layer', type=int, default=12)
+    parser.add_argument('--n_embd', type=int, default=384)
+    parser.add_argument('--vocab_size', type=int, default=370)
+    parser.add_argument('--prompt_len', type=int, default=400)
+    parser.add_argument('--chunks', default='1,4,8,16,32,64,128')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 = default')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    train_model = None
+    if args.model:
+        model = RWKV7Prefill(args.model)
+    else:
+        train_model = random_model(args.n_layer, args.n_embd, args.vocab_size)
+        model = RWKV7Prefill(train_model.state_dict())
+    vocab_size = model.w['head.weight'].shape[0]
+    tokens = torch.randint(1, vocab_size, (args.prompt_len,), generator=torch.Generator().manual_seed(1)).tolist()
+    print(f"### L{model.n_layer} D{model.n_embd} H{model.n_head}x{model.head_size}, prompt {len(tokens)} tokens, "
+          f"{torch.get_num_threads()} threads")
+
+    def sequential():
+        state = None
+        for t in tokens:
+            logits, state = model.forward([t], state)
+        return logits, state
+
+    t_seq, (ref_logits, ref_state) = timed(sequential, 1)
+    print(f"  {'sequential':>12} {t_seq * 1000:9.1f} ms {len(tokens) / t_seq:9.1f} tok/s")
+    if train_model is not None:
+        with torch.no_grad():
+            full = train_model(torch.tensor([tokens]))[0, -1]
+        print(f"  training forward vs sequential: max abs diff {(full - ref_logits).abs().max().item():.2e}")
+
+    for chunk_len in [int(c) for c in args.chunks.split(',')]:
+        t, (logits, state) = timed(lambda: model.forward(tokens, chunk_len=chunk_len), args.repeat)
+        err_logits = (logits - ref_logits).abs().max().item()
+        err_state = max((s - r).abs().max().item() / max(r.abs().max().item(), 1e-12) for s, r in zip(state, ref_state))
+        print(f"  {'chunk ' + str(chunk_len):>12} {t * 1000:9.1f} ms {len(tokens) / t:9.1f} tok/s  x{t_seq / t:5.1f}  "
+              f"logits err {err_logits:.1e} state rel err {err_state:.1e}")
+
+    # continue from the prefilled state in RNN mode
+    _, state = model.forward(tokens)
+    cont = tokens[:5]
+    s_seq, s_pre = ref_state, state
+    for t in cont:
+        l_seq, s_seq = model.forward([t], s_seq)
+        l_pre, s_pre = model.forward([t], s_pre)
+    print(f"  RNN continuation after prefill: max abs logits diff {(l_seq - l_pre).abs().max().item():.2e}")
+
+
+if __name__ == '__main__':
+    main()
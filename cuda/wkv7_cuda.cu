@@ -7,11 +7,21 @@ __device__ inline bf to_bf(const float & u) { return __float2bfloat16_rn(u); }
 
 typedef bf * __restrict__ F_;
 
-__global__ void forward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_, F_ b_, bf* y_, float* s_, float* sa_) {
+// s0_ / sT_: initial / final state (B, H, C, C) in float, row i = value channel i; without
+// HAS_STATE the state starts at zero and neither is touched
+template <bool HAS_STATE>
+__global__ void forward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_, F_ b_, bf* y_, float* s_, float* sa_, const float* __restrict__ s0_, float* sT_) {
     constexpr int C = _C_;
     int bb = blockIdx.y, hh = blockIdx.x, i = threadIdx.x;
+    int sbase = (bb*H+hh)*C*C + i*C;
 
     float state[C] = {0};
+    if (HAS_STATE) {
+#pragma unroll
+        for (int j = 0; j < C; j++) {
+            state[j] = s0_[sbase + j];
+        }
+    }
     __shared__ float q[C], k[C], w[C], a[C], b[C];
 
     for (int t = 0; t < T; t++) {
@@ -49,13 +59,29 @@ __global__ void forward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_,
             }
         }
     }
+    if (HAS_STATE) {
+#pragma unroll
+        for (int j = 0; j < C; j++) {
+            sT_[sbase + j] = state[j];
+        }
+    }
 }
 
-__global__ void backward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_, F_ b_, F_ dy_, float * __restrict__ s_, float * __restrict__ sa_, bf* dw_, bf* dq_, bf* dk_, bf* dv_, bf* da_, bf* db_) {
+template <bool HAS_STATE>
+__global__ void backward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_, F_ b_, F_ dy_, float * __restrict__ s_, float * __restrict__ sa_, bf* dw_, bf* dq_, bf* dk_, bf* dv_, bf* da_, bf* db_, const float* __restrict__ dsT_, float* ds0_) {
     constexpr int C = _C_;
     int bb = blockIdx.y, hh = blockIdx.x, i = threadIdx.x;
+    int sbase = (bb*H+hh)*C*C;
 
+    // dstate[j] = dL/dS[i][j], dstateT[j] = dL/dS[j][i], starting from the gradient of the final state
     float stateT[C] = {0}, dstate[C] = {0}, dstateT[C] = {0};
+    if (HAS_STATE) {
+#pragma unroll
+        for (int j = 0; j < C; j++) {
+            dstate[j] = dsT_[sbase + i*C + j];
+            dstateT[j] = dsT_[sbase + j*C + i];
+        }
+    }
     __shared__ float w[C], q[C], k[C], v[C], a[C], b[C], dy[C], sa[C], dSb_shared[C];
     float qi, wi, ki, ai, bi, dyi;
 
@@ -127,12 +153,25 @@ __global__ void backward_kernel(int T, int H, F_ w_, F_ q_, F_ k_, F_ v_, F_ a_,
             dstateT[j] = dstateT[j]*wi + ai * dSb_shared[j];
         }
     }
+    if (HAS_STATE) {
+#pragma unroll
+        for (int j = 0; j < C; j++) {
+            ds0_[sbase + i*C + j] = dstate[j];
+        }
+    }
 }
 
 void cuda_forward(int B, int T, int H, bf*w, bf*q, bf*k, bf*v, bf*z, bf*a, bf*y, float*s, float*sa) {
-    forward_kernel<<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,y,s,sa);
+    forward_kernel<false><<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,y,s,sa,nullptr,nullptr);
 }
 void cuda_backward(int B, int T, int H, bf*w, bf*q, bf*k, bf*v, bf*z, bf*a, bf*dy, float*s, float*sa, bf*dw, bf*dq, bf*dk, bf*dv, bf*dz, bf*da) {
     assert(T%_CHUNK_LEN_ == 0);
-    backward_kernel<<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,dy,s,sa,dw,dq,dk,dv,dz,da);
+    backward_kernel<false><<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,dy,s,sa,dw,dq,dk,dv,dz,da,nullptr,nullptr);
+}
+void cuda_forward_state(int B, int T, int H, bf*w, bf*q, bf*k, bf*v, bf*z, bf*a, bf*y, float*s, float*sa, float*s0, float*sT) {
+    forward_kernel<true><<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,y,s,sa,s0,sT);
+}
+void cuda_backward_state(int B, int T, int H, bf*w, bf*q, bf*k, bf*v, bf*z, bf*a, bf*dy, float*s, float*sa, bf*dw, bf*dq, bf*dk, bf*dv, bf*dz, bf*da, float*dsT, float*ds0) {
+    assert(T%_CHUNK_LEN_ == 0);
+    backward_kernel<true><<<dim3(H,B), dim3(_C_)>>>(T,H,w,q,k,v,z,a,dy,s,sa,dw,dq,dk,dv,dz,da,dsT,ds0);
 }
@@ -1,4 +1,5 @@
 
+# For a built binidx, data/binidx_stats.py gets the same histogram from the .idx without re-tokenizing.
 import json
 import matplotlib.pyplot as plt
 from tqdm import tqdm
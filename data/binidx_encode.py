@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.binidx import MMapIndexedDataset, MMapIndexedDatasetBuilder, data_file_path, index_file_path  # noqa: E402
+
+"""
+Re-encode the token storage of a binidx.
+
+How to use:
+
+python data/binidx_encode.py data/go_capture_simulation_output data/go_capture_packed --encoding packed
+python data/binidx_encode.py data/go_capture_simulation_output data/go_capture_lzma --encoding lzma --chunk_tokens 16384
+
+packed stores each token in 9 bits (the vocab has 370 tokens), that is 9/16 of
+a uint16 .bin, and decoding a window only touches its own bytes. zlib / lzma
+compress chunks of --chunk_tokens tokens and keep their offsets in the .idx;
+a read decodes only the chunks under the window. Smaller chunks make random
+ctx_len reads cheaper but compress worse. --encoding raw converts back to a
+plain v1 binidx. The output is read by MMapIndexedDataset / train.py like any
+other binidx.
+"""
+
+
+def file_size(prefix):
+    return os.path.getsize(data_file_path(prefix)) + os.path.getsize(index_file_path(prefix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a binidx to raw / 9-bit packed / zlib / lzma token storage')
+    parser.add_argument('input', help='binidx path without .bin/.idx')
+    parser.add_argument('output', help='output prefix, without .bin/.idx')
+    parser.add_argument('--encoding', choices=['raw', 'packed', 'zlib', 'lzma'], default='packed')
+    parser.add_argument('--bits', type=int, default=9, help='bits per token for --encoding packed')
+    parser.add_argument('--chunk_tokens', type=int, default=0, help='tokens per chunk (0 = default for the encoding)')
+    parser.add_argument('--no_verify', action='store_true', help='skip reading the output back')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    data = MMapIndexedDataset(args.input, skip_warmup=True)
+    index = data._index
+    builder = MMapIndexedDatasetBuilder(data_file_path(args.output), dtype=index.dtype, encoding=args.encoding,
+                                        chunk_tokens=args.chunk_tokens, bits=args.bits)
+    doc_ends = set(index.doc_idx[1:].tolist())
+    for i in range(len(data)):
+        builder.add_item(np.array(data.get(i)))
+        if i + 1 in doc_ends:
+            builder.end_document()
+    builder.finalize(index_file_path(args.output))
+    print(f"### {args.output}.bin/idx written in {time.perf_counter() - t0:.1f}s")
+
+    if not args.no_verify:
+        t0 = time.perf_counter()
+        out = MMapIndexedDataset(args.output, skip_warmup=True)
+        assert out.num_tokens == data.num_tokens and len(out) == len(data)
+        step = 1 << 22
+        for start in range(0, data.num_tokens, step):
+            n = min(step, data.num_tokens - start)
+            assert np.array_equal(out.tokens(start, n), data.tokens(start, n)), f"mismatch at token {start}"
+        print(f"### Verified {out.num_tokens} tokens ({time.perf_counter() - t0:.1f}s)")
+
+    before, after = file_size(args.input), file_size(args.output)
+    print(f"### {index.encoding} {before} bytes -> {args.encoding} {after} bytes ({100.0 * after / before:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.binidx import MMapIndexedDataset, data_file_path, index_file_path  # noqa: E402
+from src.magic_prime import binidx_num_tokens  # noqa: E402
+
+"""
+Corpus statistics straight from a binidx, without touching the JSONL.
+
+How to use:
+
+python data/binidx_stats.py data/go_capture_simulation_output --ctx_len 512 --tokens -j 16 --plot token_distribution.png
+
+Document lengths come from the int32 sizes array of the .idx (memmapped, one
+NumPy call per statistic). With --tokens the .bin is split into chunks that
+worker processes memmap and np.bincount on their own, so whole-corpus token
+frequencies take about as long as reading the file once.
+"""
+
+VOCAB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenizer', 'rwkv_Goose_Go_vocab.txt')
+BINS = [128, 256, 512, 1024, 2048, 4096, 8192, 16384]
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99, 99.9]
+
+
+def length_stats(sizes, bins=BINS, ctx_len=None):
+    """Histogram (same bins as analyze_data_distribution.py) and percentiles of document lengths."""
+    # right-closed bins: 0-128, 129-256, ..., >16384
+    counts = np.bincount(np.searchsorted(np.asarray(bins), sizes, side='left'), minlength=len(bins) + 1)
+    labels = [f"0-{bins[0]}"] + [f"{bins[i] + 1}-{bins[i + 1]}" for i in range(len(bins) - 1)] + [f">{bins[-1]}"]
+    stats = {
+        'docs': int(sizes.size),
+        'tokens': int(sizes.sum(dtype=np.int64)),
+        'min': int(sizes.min()) if sizes.size else 0,
+        'max': int(sizes.max()) if sizes.size else 0,
+        'mean': float(sizes.mean()) if sizes.size else 0.0,
+        'percentiles': {str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(sizes, PERCENTILES))} if sizes.size else {},
+        'histogram': dict(zip(labels, counts.tolist())),
+    }
+    if ctx_len:
+        over = sizes > ctx_len + 1
+        stats['docs_over_ctx'] = int(over.sum())
+        stats['tokens_over_ctx'] = int((sizes[over] - (ctx_len + 1)).sum(dtype=np.int64))
+    return stats
+
+
+def _count_chunk(job):
+    prefix, encoding, dtype, start, stop, minlength = job
+    if encoding == 'raw':
+        tokens = np.memmap(data_file_path(prefix), dtype=dtype, mode='r',
+                           offset=start * np.dtype(dtype).itemsize, shape=(stop - start,))
+    else:
+        # packed / compressed .bin: decode just this range
+        tokens = MMapIndexedDataset(prefix, skip_warmup=True).tokens(start, stop - start)
+    return np.bincount(tokens, minlength=minlength)
+
+
+def token_counts(prefix, dtype, n_workers=None, chunk_tokens=1 << 26):
+    """Whole-corpus token frequencies, one chunked np.bincount per worker."""
+    with open(index_file_path(prefix), 'rb') as stream:
+        header = MMapIndexedDataset.Index.read_header(stream)
+    n_tokens = binidx_num_tokens(prefix)
+    minlength = 1 << (8 * np.dtype(dtype).itemsize) if np.dtype(dtype).itemsize <= 2 else 0
+    jobs = [(prefix, header.encoding, dtype, s, min(s + chunk_tokens, n_tokens), minlength)
+            for s in range(0, n_tokens, chunk_tokens)]
+    total = np.zeros(max(minlength, 1), dtype=np.int64)
+    with Pool(n_workers) as pool:
+        for counts in pool.imap_unordered(_count_chunk, jobs):
+            if counts.size > total.size:
+                total = np.pad(total, (0, counts.size - total.size))
+            total[:counts.size] += counts
+    return total
+
+
+def plot_histogram(histogram, title, out_file):
+    import matplotlib.pyplot as plt
+
+    labels, counts = list(histogram.keys()), list(histogram.values())
+    plt.figure(figsize=(12, 7))
+    bars = plt.bar(labels, counts, color='skyblue')
+    for bar in bars:
+        yval = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width() / 2.0, yval, int(yval), va='bottom', ha='center')
+    plt.xlabel('Token Count Bins')
+    plt.ylabel('Number of Samples')
+    plt.title(title)
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    plt.savefig(out_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Length histogram / percentiles and token frequencies of a binidx')
+    parser.add_argument('prefix', help='binidx path without .bin/.idx')
+    parser.add_argument('--ctx_len', type=int, default=None, help='also count docs longer than ctx_len + 1')
+    parser.add_argument('--tokens', action='store_true', help='count token frequencies over the whole .bin')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk_tokens', type=int, default=1 << 26, help='tokens per bincount job')
+    parser.add_argument('--top', type=int, default=50, help='most frequent tokens to print')
+    parser.add_argument('--plot', default='', help='save the length histogram as an image')
+    parser.add_argument('--json', default='', help='write all statistics to this file')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = MMapIndexedDataset.Index(index_file_path(args.prefix), skip_warmup=True)
+    stats = length_stats(index.sizes, ctx_len=args.ctx_len)
+    print(f"### {args.prefix}: {stats['docs']} docs, {stats['tokens']} tokens, dtype {index.dtype.__name__} "
+          f"({time.perf_counter() - t0:.2f}s)")
+    print(f"  length min {stats['min']} mean {stats['mean']:.1f} max {stats['max']}")
+    print('  ' + '  '.join(f"p{p} {v:.0f}" for p, v in stats['percentiles'].items()))
+    if args.ctx_len:
+        print(f"  {stats['docs_over_ctx']} docs longer than ctx_len+1 ({stats['tokens_over_ctx']} tokens past it)")
+    for label, count in stats['histogram'].items():
+        print(f"  {label:>12} {count:>12} {100.0 * count / max(stats['docs'], 1):6.2f}%")
+
+    if args.plot:
+        plot_histogram(stats['histogram'], f"Token Count Distribution in {args.prefix}", args.plot)
+        print(f"Chart saved to {args.plot}")
+
+    if args.tokens:
+        t0 = time.perf_counter()
+        counts = token_counts(args.prefix, index.dtype, args.workers, args.chunk_tokens)
+        n = int(counts.sum())
+        print(f"\n### Token frequencies: {n} tokens, {int((counts > 0).sum())} distinct "
+              f"({time.perf_counter() - t0:.2f}s)")
+        idx2token = {}
+        if os.path.exists(VOCAB_FILE):
+            from tokenizer.rwkv_tokenizer import TRIE_TOKENIZER
+            idx2token = TRIE_TOKENIZER(VOCAB_FILE).idx2token
+        for tok in np.argsort(counts)[::-1][:args.top]:
+            if counts[tok] == 0:
+                break
+            print(f"  {int(tok):>6} {repr(idx2token.get(int(tok), b'<eod>' if tok == 0 else b'?')):>12} "
+                  f"{int(counts[tok]):>14} {100.0 * counts[tok] / max(n, 1):6.2f}%")
+        stats['token_counts'] = {int(t): int(c) for t, c in enumerate(counts) if c}
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+        print(f"Statistics saved to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
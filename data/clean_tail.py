@@ -1,9 +1,31 @@
 import json
 
+
+def remove_tail(text):
+    """
+    去除text最后一个空格及其后的文本
+    例如: "KeGh GgOq B+R" -> "KeGh GgOq"
+    """
+    # 找到最后一个空格的位置并截取之前的部分
+    if ' ' in text:
+        text = text[:text.rfind(' ')]
+    return text
+
+
+def tail_result(text):
+    """
+    text 末尾的对局结果，没有则返回 None
+    例如: "KeGh GgOq B+R" -> "B+R"
+    """
+    tail = text[text.rfind(' ') + 1:]
+    return tail if '+' in tail else None
+
+
 def remove_text_after_last_space(input_file, output_file):
     """
     去除jsonl文件中每个text字段最后一个空格及其后的文本
     例如: "KeGh GgOq B+R" -> "KeGh GgOq"
+    去掉的结果存进 result（.meta 的胜方列要用）
     """
     with open(input_file, 'r', encoding='utf-8') as infile, \
          open(output_file, 'w', encoding='utf-8') as outfile:
@@ -11,16 +33,14 @@ def remove_text_after_last_space(input_file, output_file):
         for line in infile:
             data = json.loads(line.strip())
             
-            text = data.get('text', '')
-            
-            # 找到最后一个空格的位置并截取之前的部分
-            if ' ' in text:
-                last_space_index = text.rfind(' ')
-                text = text[:last_space_index]
-            
-            data['text'] = text
+            result = tail_result(data.get('text', ''))
+            if result:
+                data.setdefault('result', result)
+            data['text'] = remove_tail(data.get('text', ''))
             
             outfile.write(json.dumps(data, ensure_ascii=False) + '\n')
 
-# 使用示例
-remove_text_after_last_space('/mnt/69043a6d-b152-4bd1-be10-e1130af6487f/RWKV_GooseGooseGo/dataset.jsonl', '/mnt/69043a6d-b152-4bd1-be10-e1130af6487f/RWKV_GooseGooseGo/dataset_cleaned.jsonl')
\ No newline at end of file
+
+if __name__ == '__main__':
+    # 使用示例
+    remove_text_after_last_space('/mnt/69043a6d-b152-4bd1-be10-e1130af6487f/RWKV_GooseGooseGo/dataset.jsonl', '/mnt/69043a6d-b152-4bd1-be10-e1130af6487f/RWKV_GooseGooseGo/dataset_cleaned.jsonl')
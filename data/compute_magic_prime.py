@@ -1,46 +1,32 @@
 # -*- coding: utf-8 -*-
 
+import argparse
 import os
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.binidx import MMapIndexedDataset  # noqa: E402
+from src.magic_prime import compute_magic_prime  # noqa: E402
 
-
-def is_prime(n):
-    if n <= 1:
-        return False
-    if n <= 3:
-        return True
-    if n % 2 == 0 or n % 3 == 0:
-        return False
-    i = 5
-    while i * i <= n:
-        if n % i == 0 or n % (i + 2) == 0:
-            return False
-        i += 6
-    return True
-
-
-# Modify these to your DATA_NAME and CTX_LEN, to compute the correct --my_exit_tokens and --magic_prime ####
+# Compute the correct --my_exit_tokens and --magic_prime for a binidx and CTX_LEN ####
 # Use only the path with the DataName, without .bin or .idx extensions. ####
-# Usage: python compute_magic_prime.py ####
-DATA_NAME = '/home/rwkv/RWKV-LM-V7/data/demo'
-CTX_LEN = 4096
-
-print(f"### Loading {DATA_NAME}")
-data = MMapIndexedDataset(DATA_NAME)
-data_len = len(data)
-data_size = len(data._bin_buffer) // data._index._dtype_size
-
-print(f"\n### {DATA_NAME}.bin/idx has {data_size} tokens, {data_len} items. Dtype {data._index.dtype}")
-
-n_chunk = int(data_size // CTX_LEN) - 1
-for i in range(n_chunk, 0, -1):
-    if i % 3 == 2:
-        if is_prime(i):
-            print(f"\n### magic_prime = {i} (for ctxlen {CTX_LEN})")
-            print(
-                f'\n--my_exit_tokens {data_size} --magic_prime {i} --ctx_len {CTX_LEN}\n')
-            exit(0)
+# Usage: python compute_magic_prime.py /home/rwkv/RWKV-LM-V7/data/demo 4096 ####
+# (train.py also derives it by itself when --magic_prime is left at 0) ####
+parser = argparse.ArgumentParser(description='Compute --magic_prime / --my_exit_tokens for a binidx')
+parser.add_argument('data_name', help='binidx path without .bin/.idx, or shards "a,b" / "shards/*"')
+parser.add_argument('ctx_len', type=int, nargs='?', default=4096)
+parser.add_argument('--data_weights', default='', help='per-shard sampling weights, as for train.py')
+parser.add_argument('--data_align', default='none', choices=['none', 'doc'],
+                    help='doc: count doc-aligned windows (builds the .win sidecars), as for train.py')
+parser.add_argument('--data_filter', default='', help='predicate over the .meta sidecar, as for train.py')
+args = parser.parse_args()
+
+magic_prime, data_size = compute_magic_prime(args.data_name, args.ctx_len, args.data_weights, args.data_align, args.data_filter)
+print(f"\n### {args.data_name}.bin/idx has {data_size} tokens")
+
+if magic_prime > 0:
+    print(f"\n### magic_prime = {magic_prime} (for ctxlen {args.ctx_len})")
+    print(
+        f'\n--my_exit_tokens {data_size} --magic_prime {magic_prime} --ctx_len {args.ctx_len}\n')
+else:
+    print(f"\n### Not enough data for ctxlen {args.ctx_len}")
@@ -1,49 +1,130 @@
 #!/usr/bin/env python3
 import argparse
 import json
+import math
+import os
 import random
+import resource
+import tempfile
 from pathlib import Path
 
-def extract_text_from_jsonl(file_path):
-    texts = []
+# 每条记录在内存中的大致额外开销（Python str 对象头、列表指针）
+RECORD_OVERHEAD_BYTES = 80
+
+
+def max_open_buckets():
+    """同时打开的桶文件数上限：文件描述符软上限 (ulimit -n) 的一半，其余留给输入文件等。"""
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return 4096
+    return max(2, min(4096, soft // 2))
+
+
+def iter_records_from_jsonl(file_path, fields):
+    source = os.path.splitext(os.path.basename(file_path))[0]
     with open(file_path, 'r', encoding='utf-8') as f:
         for line in f:
             if line.strip():
                 try:
                     data = json.loads(line.strip())
                     if 'text' in data:
-                        texts.append({'text': data['text']})
+                        data.setdefault('source', source)  # 合并后就分不出来自哪个文件了
+                        yield {k: data[k] for k in fields if k in data}
                 except json.JSONDecodeError:
                     print(f"警告: 无法解析 {file_path} 中的一行: {line}")
                     continue
-    return texts
 
-def save_texts_to_jsonl(texts, output_file):
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in texts:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+def external_shuffle(lines, n_buckets, rng, tmp_dir=None, max_open=None):
+    """
+    有限内存的外部乱序：先把每行随机写入 n_buckets 个临时桶文件，
+    再逐个桶读入内存乱序并输出。每一行落入任意位置的概率相同，
+    内存中最多只有一个桶。
+    n_buckets 超过 max_open（默认 max_open_buckets()）时分两级：先随机分到
+    max_open 个桶，每个桶再各自外部乱序，同时打开的文件不超过 max_open。
+    """
+    if n_buckets <= 1:
+        lines = list(lines)
+        rng.shuffle(lines)
+        yield from lines
+        return
+
+    max_open = max_open or max_open_buckets()
+    fan_out = min(n_buckets, max_open)
+    sub_buckets = math.ceil(n_buckets / fan_out)
+    with tempfile.TemporaryDirectory(prefix='concat_shuffle_', dir=tmp_dir) as tmp:
+        buckets = [open(os.path.join(tmp, f"bucket_{i:05d}.jsonl"), 'w', encoding='utf-8')
+                   for i in range(fan_out)]
+        try:
+            for line in lines:
+                buckets[rng.randrange(fan_out)].write(line)
+        finally:
+            for b in buckets:
+                b.close()
+
+        for i in range(fan_out):
+            path = os.path.join(tmp, f"bucket_{i:05d}.jsonl")
+            if sub_buckets > 1:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield from external_shuffle(f, sub_buckets, rng, tmp, max_open)
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    bucket = f.readlines()
+                rng.shuffle(bucket)
+                yield from bucket
+            os.remove(path)
+
+
+def estimate_buckets(input_files, memory_mb):
+    total_bytes = sum(os.path.getsize(p) for p in input_files)
+    # 按行数估计对象开销：假设平均每行至少 64 字节
+    need = total_bytes + (total_bytes // 64) * RECORD_OVERHEAD_BYTES
+    budget = max(memory_mb, 1) * 1024 * 1024
+    return max(1, math.ceil(need / budget)), total_bytes
+
 
 def main():
-    parser = argparse.ArgumentParser(description='从JSONL数据集中提取text键并合并乱序')
+    parser = argparse.ArgumentParser(description='从JSONL数据集中提取text键并合并乱序（外部乱序，内存有上限）')
     parser.add_argument('input_files', nargs='+', help='输入的JSONL文件路径')
     parser.add_argument('-o', '--output', default='merged_dataset.jsonl', help='输出文件名')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，相同种子得到相同顺序')
+    parser.add_argument('--memory_mb', type=int, default=4096, help='乱序时最多占用的内存 (MB)')
+    parser.add_argument('--tmp_dir', default=None, help='临时桶文件目录，默认与输出文件相同')
+    parser.add_argument('--fields', default='text,AB,AW,result,source',
+                        help='保留的键，逗号分隔（AB/AW 是让子棋的摆子，缺少会让棋盘错位；'
+                             'result/source 是 .meta 的胜方和来源列）')
     args = parser.parse_args()
-    all_texts = []
-    
+
+    fields = [f for f in args.fields.split(',') if f]
+    input_files = []
     for file_path in args.input_files:
         if Path(file_path).exists():
-            print(f"处理文件: {file_path}")
-            texts = extract_text_from_jsonl(file_path)
-            all_texts.extend(texts)
-            print(f"从 {file_path} 中提取了 {len(texts)} 条记录")
+            input_files.append(file_path)
         else:
             print(f"警告: 文件 {file_path} 不存在，跳过")
-    
-    print(f"总共收集到 {len(all_texts)} 条记录，正在进行乱序...")
-    random.shuffle(all_texts)
-    
-    save_texts_to_jsonl(all_texts, args.output)
-    print(f"数据已保存到 {args.output}")
+
+    n_buckets, total_bytes = estimate_buckets(input_files, args.memory_mb)
+    print(f"输入共 {total_bytes / 1e6:.1f} MB，内存上限 {args.memory_mb} MB，使用 {n_buckets} 个临时桶")
+    rng = random.Random(args.seed)
+    tmp_dir = args.tmp_dir or (os.path.dirname(os.path.abspath(args.output)))
+
+    def iter_lines():
+        for file_path in input_files:
+            print(f"处理文件: {file_path}")
+            n = 0
+            for item in iter_records_from_jsonl(file_path, fields):
+                n += 1
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+            print(f"从 {file_path} 中提取了 {n} 条记录")
+
+    n_total = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for line in external_shuffle(iter_lines(), n_buckets, rng, tmp_dir):
+            f.write(line)
+            n_total += 1
+
+    print(f"总共 {n_total} 条记录，已乱序保存到 {args.output}")
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,5 @@
 import json
+import os
 from tqdm import tqdm
 
 def get_neighbors(row, col, board_size):
@@ -44,13 +45,125 @@ def find_group(row, col, board):
     
     return group_stones, liberties
 
-def convert_go_dataset(input_file='input.jsonl', output_file='output.jsonl'):
+def iter_position_texts(move_text, board_size=19, setup_black=(), setup_white=()):
+    """只要样本文本，见 iter_numbered_positions。"""
+    for _, output_text in iter_numbered_positions(move_text, board_size, setup_black, setup_white):
+        yield output_text
+
+
+def iter_numbered_positions(move_text, board_size=19, setup_black=(), setup_white=()):
     """
-    将围棋数据集转换为每步独立保存的格式，并实现吃子逻辑。
-    每个回合一行，格式为：
+    将一局棋的落子文本展开为每步独立的训练样本，并实现吃子逻辑。
+    产出 (手数, 文本)：手数按落子文本里的每一手计（从 1 开始），虚着 "Tt" 不产出样本但也算一手，
+    所以虚着之后的手数与棋谱一致。
+    每个回合产出一段文本，格式为：
     [上一步坐标][颜色token]\n[当前棋盘状态]\n[当前落子坐标][颜色token]
     或者如果是第一步则没有前缀。
 
+    Args:
+        move_text (str): 形如 "PdDp QqDd" 的落子文本。
+        board_size (int): 棋盘大小。
+        setup_black, setup_white: 开局前摆放的棋子（让子，SGF的AB/AW），形如 ["Pd", "Dp"]。
+    """
+    board = [['#' for _ in range(board_size)] for _ in range(board_size)]
+    for stones, stone_char in ((setup_black, 'B'), (setup_white, 'W')):
+        for coord in stones:
+            col = ord(coord[0].lower()) - ord('a')
+            row = ord(coord[1].lower()) - ord('a')
+            if 0 <= row < board_size and 0 <= col < board_size:
+                board[row][col] = stone_char
+
+    prev_move_coord = None
+    prev_color_token = None
+
+    def board_prefix():
+        # 构造当前棋盘状态字符串
+        board_representation = "\n".join(["".join(row) for row in board])
+        if prev_move_coord is not None and prev_color_token is not None:
+            return f"{prev_color_token}{prev_move_coord}\n{board_representation}"
+        return board_representation
+
+    def process_a_single_move(move_coord, is_black):
+        nonlocal prev_move_coord, prev_color_token
+
+        # 解析坐标
+        col = ord(move_coord[0].lower()) - ord('a')
+        row = ord(move_coord[1].lower()) - ord('a')
+
+        if not (0 <= row < board_size and 0 <= col < board_size):
+            return None  # 无效坐标，跳过
+
+        player_char = 'B' if is_black else 'W'
+        opponent_char = 'W' if is_black else 'B'
+        color_token = "Black" if is_black else "White"
+
+        # 构造输出内容
+        output_text = f"{board_prefix()}\n{color_token}{move_coord}"
+
+        # 落子
+        board[row][col] = player_char
+
+        # 检查并移除被吃的对方棋子
+        for nr, nc in get_neighbors(row, col, board_size):
+            if board[nr][nc] == opponent_char:
+                opponent_group, group_liberties = find_group(nr, nc, board)
+                if not group_liberties:
+                    for gr, gc in opponent_group:
+                        board[gr][gc] = '#'
+
+        # 更新上一步信息
+        prev_move_coord = move_coord
+        prev_color_token = color_token
+        return output_text
+
+    # 遍历所有移动对或特殊指令
+    move = 0
+    for item in move_text.split():
+        if len(item) == 4 and item.isalpha():
+            for move_coord, is_black in ((item[:2], True), (item[2:], False)):
+                move += 1
+                output_text = process_a_single_move(move_coord, is_black)
+                if output_text is not None:
+                    yield move, output_text
+
+        elif 'X' in item:
+            # 特殊指令处理：模拟落子，但不改变颜色
+            # 不更新 prev_move_coord 和 prev_color_token
+            move += 1
+            yield move, f"{board_prefix()}\n{item}"
+
+
+def parse_winner(result):
+    """对局结果 "B+R" / "W+3.5" -> 0 (黑胜) / 1 (白胜)，和棋、无胜负或未知 -> -1。"""
+    result = (result or '').strip().upper()
+    if result.startswith('B+'):
+        return 0
+    if result.startswith('W+'):
+        return 1
+    return -1
+
+
+def position_player(output_text):
+    """iter_position_texts 产出的样本里当前落子的一方：0 黑，1 白，-1 其他（如 X 指令）。"""
+    last = output_text[output_text.rfind('\n') + 1:]
+    if last.startswith('Black'):
+        return 0
+    if last.startswith('White'):
+        return 1
+    return -1
+
+
+def position_meta(output_text, move, game, source, result):
+    """每个局面的元数据（见 src/binidx.py 的 DOC_META_COLUMNS），make_data.py / pipeline.py 写入 .meta。"""
+    return {"move": move, "game": game, "source": source,
+            "player": position_player(output_text), "winner": parse_winner(result)}
+
+
+def convert_go_dataset(input_file='input.jsonl', output_file='output.jsonl'):
+    """
+    将围棋数据集转换为每步独立保存的格式，见 iter_position_texts。
+    每行同时带上 position_meta 的元数据（第几手、第几局、来源、落子方、胜方）。
+
     Args:
         input_file (str): 输入的JSONL文件名。
         output_file (str): 输出的JSONL文件名。
@@ -58,89 +171,23 @@ def convert_go_dataset(input_file='input.jsonl', output_file='output.jsonl'):
     with open(input_file, 'r', encoding='utf-8') as f:
         total_lines = sum(1 for _ in f)
 
+    source = os.path.splitext(os.path.basename(input_file))[0]
     with open(input_file, 'r', encoding='utf-8') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
-        for line in tqdm(f_in, total=total_lines, desc="Processing"):
+        for game, line in enumerate(tqdm(f_in, total=total_lines, desc="Processing")):
             data = json.loads(line)
-            move_pairs = data['text'].split()
-
-            board_size = 19
-            board = [['#' for _ in range(board_size)] for _ in range(board_size)]
-
-            prev_move_coord = None
-            prev_color_token = None
-
-            def process_a_single_move(move_coord, is_black):
-                nonlocal board, prev_move_coord, prev_color_token
-
-                # 解析坐标
-                col = ord(move_coord[0].lower()) - ord('a')
-                row = ord(move_coord[1].lower()) - ord('a')
-
-                if not (0 <= row < board_size and 0 <= col < board_size):
-                    return  # 无效坐标，跳过
-
-                player_char = 'B' if is_black else 'W'
-                opponent_char = 'W' if is_black else 'B'
-                color_token = "Black" if is_black else "White"
-
-                # 构造当前棋盘状态字符串
-                board_representation = "\n".join(["".join(row) for row in board])
-
-                # 构造输出内容
-                if prev_move_coord is not None and prev_color_token is not None:
-                    prefix = f"{prev_color_token}{prev_move_coord}\n"
-                else:
-                    prefix = ""
-
-                output_text = f"{prefix}{board_representation}\n{color_token}{move_coord}"
-
+            positions = iter_numbered_positions(data['text'], setup_black=data.get('AB', ()), setup_white=data.get('AW', ()))
+            for move, output_text in positions:
                 # 写入这一回合的内容
-                f_out.write(json.dumps({"text": output_text}) + '\n')
-
-                # 落子
-                board[row][col] = player_char
-
-                # 检查并移除被吃的对方棋子
-                for nr, nc in get_neighbors(row, col, board_size):
-                    if board[nr][nc] == opponent_char:
-                        opponent_group, group_liberties = find_group(nr, nc, board)
-                        if not group_liberties:
-                            for gr, gc in opponent_group:
-                                board[gr][gc] = '#'
-
-                # 更新上一步信息
-                prev_move_coord = move_coord
-                prev_color_token = color_token
-
-            # 遍历所有移动对或特殊指令
-            for item in move_pairs:
-                if len(item) == 4 and item.isalpha():
-                    black_move = item[:2]
-                    white_move = item[2:]
-
-                    process_a_single_move(black_move, is_black=True)
-                    process_a_single_move(white_move, is_black=False)
-
-                elif 'X' in item:
-                    # 特殊指令处理：模拟落子，但不改变颜色
-                    board_representation = "\n".join(["".join(row) for row in board])
-
-                    if prev_move_coord is not None and prev_color_token is not None:
-                        prefix = f"{prev_color_token}{prev_move_coord}\n"
-                    else:
-                        prefix = ""
-
-                    output_text = f"{prefix}{board_representation}\n{item}"
-
-                    f_out.write(json.dumps({"text": output_text}) + '\n')
-
-                    # 不更新 prev_move_coord 和 prev_color_token
+                record = {"text": output_text}
+                record.update(position_meta(output_text, move, game, data.get('source', source), data.get('result')))
+                f_out.write(json.dumps(record) + '\n')
 
 
-# 运行转换函数
-convert_go_dataset(
-    input_file="/home/rwkv/alic-li/RWKV_GooseGooseGo/data/dataset_cleaned.jsonl",
-    output_file="/home/rwkv/alic-li/RWKV_GooseGooseGo/data/go_capture_simulation_output.jsonl"
-)
+if __name__ == '__main__':
+    # 运行转换函数
+    convert_go_dataset(
+        input_file="/home/rwkv/alic-li/RWKV_GooseGooseGo/data/dataset_cleaned.jsonl",
+        output_file="/home/rwkv/alic-li/RWKV_GooseGooseGo/data/go_capture_simulation_output.jsonl"
+    )
 
-print("数据转换完成，并已保存到 go_capture_simulation_output.jsonl 文件中。")
\ No newline at end of file
+    print("数据转换完成，并已保存到 go_capture_simulation_output.jsonl 文件中。")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Streaming deduplication of games and positions.
+
+How to use:
+
+# games: move-pair JSONL ("PdDp QqDd ..."), one source per input file
+python data/datasets_dedup.py --mode games leela_zero.jsonl v2.jsonl katago.jsonl -o games_dedup.jsonl
+
+# positions: datasets_convert.py output, one position (+ the move played) per line
+python data/datasets_dedup.py --mode positions go_capture_simulation_output.jsonl -o positions_dedup.jsonl
+
+Games are keyed by their move sequence (plus AB/AW setup), canonicalized as the
+smallest of its 8 board symmetries, so rotated and mirrored copies collide.
+Positions are keyed by a Zobrist hash of the board, the side to move and the
+move played, again the smallest over the 8 symmetries. Keys go into a
+disk-backed Bloom filter (default, memmapped bit array, false positives only)
+or an exact sqlite set (--exact). Both files can be reused across runs to
+dedup new data against an existing corpus.
+"""
+
+BOARD_SIZE = 19
+_LETTERS = "abcdefghijklmnopqrs"
+_FLIP = str.maketrans(_LETTERS, _LETTERS[::-1])
+
+
+########################################################################################################
+# Key stores
+########################################################################################################
+
+class BloomFilter(object):
+    """Bloom filter over 128-bit keys, backed by a memmapped bit array on disk."""
+
+    def __init__(self, path, n_bits=1 << 33, n_hashes=7):
+        n_bytes = (n_bits + 7) // 8
+        exists = os.path.exists(path)
+        if exists and os.path.getsize(path) != n_bytes:
+            # reopening it with another size would wipe the keys of the earlier runs
+            raise ValueError(f"{path} holds a Bloom filter of {os.path.getsize(path) * 8} bits, not {n_bytes * 8}; "
+                             f"pass the same --bloom_bits or remove the file")
+        self._bits = np.memmap(path, dtype=np.uint8, mode='r+' if exists else 'w+', shape=(n_bytes,))
+        self.n_bits = n_bytes * 8
+        self.n_hashes = n_hashes
+        # keys added in this run only; a reused filter also holds the earlier ones
+        self.n_added = 0
+
+    def add(self, key):
+        """Insert key (16 bytes); return True if it was (probably) already present."""
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:], 'little') | 1
+        idx = np.array([(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)], dtype=np.int64)
+        byte, mask = idx >> 3, (1 << (idx & 7)).astype(np.uint8)
+        seen = bool(np.all(self._bits[byte] & mask))
+        if not seen:
+            np.bitwise_or.at(self._bits, byte, mask)  # several hashes can share a byte
+            self.n_added += 1
+        return seen
+
+    def false_positive_rate(self):
+        """Expected false positive rate at the current fill, (1 - e^(-kn/m))^k."""
+        return (1.0 - math.exp(-self.n_hashes * self.n_added / self.n_bits)) ** self.n_hashes
+
+    def close(self):
+        self._bits.flush()
+
+
+class DiskHashSet(object):
+    """Exact set of 128-bit keys in sqlite."""
+
+    def __init__(self, path, batch=100000):
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE IF NOT EXISTS k (h BLOB PRIMARY KEY) WITHOUT ROWID')
+        self._batch = batch
+        self._pending = 0
+
+    def add(self, key):
+        cur = self._db.execute('INSERT OR IGNORE INTO k VALUES (?)', (key,))
+        self._pending += 1
+        if self._pending >= self._batch:
+            self._db.commit()
+            self._pending = 0
+        return cur.rowcount == 0
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+########################################################################################################
+# Keys
+########################################################################################################
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _symmetries(cols, rows):
+    """The 8 board symmetries of a coordinate sequence given as column / row letter strings."""
+    fc, fr = cols.translate(_FLIP), rows.translate(_FLIP)
+    return ((cols, rows), (fc, rows), (cols, fr), (fc, fr),
+            (rows, cols), (fr, cols), (rows, fc), (fr, fc))
+
+
+def game_key(record):
+    """Canonical key of a move-pair record; passes ("Tt") are unchanged by every symmetry."""
+    moves = record['text'].replace(' ', '').replace('X', '').lower()
+    black = ''.join(record.get('AB', ())).lower()
+    white = ''.join(record.get('AW', ())).lower()
+    m, b = len(moves) // 2, len(black) // 2
+    seq = moves + black + white
+    variants = []
+    for c, r in _symmetries(seq[0::2], seq[1::2]):
+        # setup stones are a set, sort them after the transform
+        setup_b = ''.join(sorted(map(str.__add__, c[m:m + b], r[m:m + b])))
+        setup_w = ''.join(sorted(map(str.__add__, c[m + b:], r[m + b:])))
+        variants.append(f"{c[:m]}|{r[:m]}|{setup_b}|{setup_w}")
+    return _digest(min(variants).encode('ascii'))
+
+
+class ZobristHasher(object):
+    """Zobrist hash of (board, side to move, move played), minimized over the 8 symmetries."""
+
+    def __init__(self, seed=20240601):
+        n = BOARD_SIZE * BOARD_SIZE
+        rng = np.random.default_rng(seed)
+        table = rng.integers(0, 2**63, size=(3, n + 1), dtype=np.int64).astype(np.uint64)
+        table[0] = 0  # empty point
+        self._table = table  # [stone: '#', 'B', 'W'] x [point, off-board / pass]
+
+        grid = np.arange(n).reshape(BOARD_SIZE, BOARD_SIZE)  # grid[row, col]
+        perms = [grid, grid[:, ::-1], grid[::-1, :], grid[::-1, ::-1],
+                 grid.T, grid.T[:, ::-1], grid.T[::-1, :], grid.T[::-1, ::-1]]
+        # perm[s, p] = where point p lands under symmetry s
+        self._perm = np.empty((8, n + 1), dtype=np.int64)
+        for s, g in enumerate(perms):
+            self._perm[s, g.reshape(-1)] = np.arange(n)
+            self._perm[s, n] = n
+        self._move_table = rng.integers(0, 2**63, size=(2, n + 1), dtype=np.int64).astype(np.uint64)
+        self._stone = np.zeros(256, dtype=np.int64)
+        self._stone[ord('B')] = 1
+        self._stone[ord('W')] = 2
+
+    def key(self, position_text):
+        lines = position_text.split('\n')
+        board_lines = [ln for ln in lines if len(ln) == BOARD_SIZE and not ln.strip('#BW')]
+        if len(board_lines) != BOARD_SIZE:
+            return _digest(position_text.encode('utf-8'))  # not a board, hash as text
+        last = lines[-1]
+        side = 1 if last.startswith('White') else 0
+        coord = last[5:] if last[:5] in ('Black', 'White') else last
+        n = BOARD_SIZE * BOARD_SIZE
+        point = n
+        if len(coord) >= 2 and coord[0].lower() in _LETTERS and coord[1].lower() in _LETTERS:
+            point = (ord(coord[1].lower()) - 97) * BOARD_SIZE + (ord(coord[0].lower()) - 97)
+
+        board = np.frombuffer(''.join(board_lines).encode('ascii'), dtype=np.uint8)
+        stones = self._stone[board]
+        occupied = np.nonzero(stones)[0]
+        # (8, n_stones) hashes of every stone under every symmetry
+        h = self._table[stones[occupied], self._perm[:, occupied]]
+        h = np.bitwise_xor.reduce(h, axis=1) if occupied.size else np.zeros(8, dtype=np.uint64)
+        h ^= self._move_table[side, self._perm[:, point]]
+        extra = coord[2:] if len(coord) > 2 else ''  # e.g. the "X" end marker
+        return _digest(int(h.min()).to_bytes(8, 'little') + bytes([side]) + extra.encode('utf-8'))
+
+
+########################################################################################################
+
+
+class Deduper(object):
+    """Filters records through a key store and counts duplicates per source."""
+
+    def __init__(self, store, key_fn):
+        self.store = store
+        self.key_fn = key_fn
+        self.stats = OrderedDict()
+
+    def is_duplicate(self, item, source=''):
+        dup = self.store.add(self.key_fn(item))
+        total, dups = self.stats.get(source, (0, 0))
+        self.stats[source] = (total + 1, dups + int(dup))
+        return dup
+
+    def filter(self, records, item_fn=lambda rec: rec, source_fn=lambda rec: rec.get('source', '')):
+        for rec in records:
+            if not self.is_duplicate(item_fn(rec), source_fn(rec)):
+                yield rec
+
+    def report(self):
+        lines = []
+        all_total = all_dups = 0
+        for source, (total, dups) in self.stats.items():
+            all_total += total
+            all_dups += dups
+            lines.append(f"  {source:<24} {total:>12} seen {dups:>12} dup {100.0 * dups / max(total, 1):6.2f}%")
+        lines.append(f"  {'total':<24} {all_total:>12} seen {all_dups:>12} dup {100.0 * all_dups / max(all_total, 1):6.2f}%")
+        return '\n'.join(lines)
+
+
+def make_store(args):
+    if args.exact:
+        return DiskHashSet(args.store or f"{args.output}.{args.mode}.sqlite")
+    return BloomFilter(args.store or f"{args.output}.{args.mode}.bloom", args.bloom_bits, args.bloom_hashes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming dedup of games / positions with a disk-backed key set')
+    parser.add_argument('input_files', nargs='+', help='JSONL files, each file counts as one source')
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('--mode', choices=['games', 'positions'], default='games')
+    parser.add_argument('--exact', action='store_true', help='exact sqlite set instead of a Bloom filter')
+    parser.add_argument('--store', default='', help='Bloom / sqlite file, reused if it exists')
+    parser.add_argument('--bloom_bits', type=int, default=1 << 33, help='Bloom filter size in bits (default 1 GiB)')
+    parser.add_argument('--bloom_hashes', type=int, default=7)
+    args = parser.parse_args()
+
+    store = make_store(args)
+    if args.mode == 'games':
+        deduper = Deduper(store, game_key)
+    else:
+        deduper = Deduper(store, ZobristHasher().key)
+
+    with open(args.output, 'w', encoding='utf-8') as out:
+        for path in args.input_files:
+            source = os.path.splitext(os.path.basename(path))[0]
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    rec = json.loads(line)
+                    item = rec if args.mode == 'games' else rec['text']
+                    if not deduper.is_duplicate(item, source):
+                        out.write(line if line.endswith('\n') else line + '\n')
+            print(f"{path} done", flush=True)
+    store.close()
+    if isinstance(store, BloomFilter):
+        print(f"### Bloom filter: {store.n_bits} bits, {store.n_hashes} hashes, "
+              f"expected false positive rate {store.false_positive_rate():.2e}")
+    print(f"### Duplicate {args.mode} per source\n{deduper.report()}")
+
+
+if __name__ == '__main__':
+    main()
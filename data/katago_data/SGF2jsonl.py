@@ -1,46 +1,52 @@
-import re
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sgf_parser import game_to_record, iter_games, parse_sgf  # noqa: E402
+
+
+def sgf_content_to_records(sgf_content):
+    # 解析文件中的每一局棋（主分支、虚着、让子、贴目、结果），只保留19路棋盘
+    for game in parse_sgf(sgf_content):
+        if game.size == 19 and game.moves:
+            yield game_to_record(game)
+
+
+def sgf_file_to_records(sgf_path):
+    # 流式读取，支持一个文件里有多局棋
+    with open(sgf_path, 'r', encoding='utf-8', errors='replace') as f:
+        for game in iter_games(f):
+            if game.size == 19 and game.moves:
+                yield game_to_record(game)
+
 
 def sgf_to_json_text(sgf_path):
-    with open(sgf_path, 'r', encoding='utf-8') as f:
-        sgf_content = f.read()
-
-    # 匹配所有落子坐标（B[xx] 或 W[xx]）
-    moves = re.findall(r';[BW]\[([a-zA-Z]{2})\]', sgf_content)
-
-    # 每个坐标首字母大写
-    moves = [m[0].upper() + m[1] for m in moves]
-
-    # 每两个坐标合并为一个字符串
-    paired_moves = []
-    i = 0
-    while i < len(moves):
-        if i + 1 < len(moves):
-            paired_moves.append(moves[i] + moves[i + 1])
-            i += 2
-        else:
-            paired_moves.append(moves[i] + "X")
-            i += 1
-
-    # 拼接为最终字符串
-    move_str = ' '.join(paired_moves)
-    return {"text": move_str}
+    records = list(sgf_file_to_records(sgf_path))
+    return records[0] if records else {"text": ""}
+
+
+def iter_sgf_files(folder_path):
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith('.sgf'):
+                yield os.path.join(root, file)
+
 
 def process_folder(folder_path, output_jsonl_path):
     with open(output_jsonl_path, 'w', encoding='utf-8') as out_file:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith('.sgf'):
-                    sgf_path = os.path.join(root, file)
-                    try:
-                        result = sgf_to_json_text(sgf_path)
-                        out_file.write(json.dumps(result, ensure_ascii=False) + '\n')
-                        print(f"✅ 处理完成：{sgf_path}")
-                    except Exception as e:
-                        print(f"❌ 错误处理文件 {sgf_path}: {e}")
-
-# 示例用法
-input_folder = "data/katago_data/"
-output_jsonl = "katago_output.jsonl"
-process_folder(input_folder, output_jsonl)
+        for sgf_path in iter_sgf_files(folder_path):
+            try:
+                for result in sgf_file_to_records(sgf_path):
+                    out_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                print(f"✅ 处理完成：{sgf_path}")
+            except Exception as e:
+                print(f"❌ 错误处理文件 {sgf_path}: {e}")
+
+
+if __name__ == '__main__':
+    # 示例用法
+    input_folder = "data/katago_data/"
+    output_jsonl = "katago_output.jsonl"
+    process_folder(input_folder, output_jsonl)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SGF2jsonl import sgf_content_to_records  # noqa: E402
+
+"""
+Parallel, resumable SGF -> JSONL ingestion.
+
+How to use:
+
+python data/katago_data/sgf_ingest.py katago_archive/ more_games.tar.gz -o katago_shards/ -j 16
+
+Inputs can be folders, single .sgf files or .tar/.tar.gz/.tgz/.zip archives
+(archives found while walking a folder are read as well). SGFs are handed to a
+process pool in batches, every batch becomes one shard
+(katago_shards/shard-000042.jsonl, same records as SGF2jsonl.py)
+and is then recorded in katago_shards/manifest.jsonl. Re-running the same
+command skips every input already listed in the manifest, so an interrupted run
+just picks up where it stopped.
+"""
+
+ARCHIVE_EXTS = ('.tar', '.tar.gz', '.tgz', '.zip')
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTS)
+
+
+def iter_archive(path):
+    """Yield (key, bytes) for every .sgf member of an archive."""
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.sgf'):
+                    yield f"{path}::{info.filename}", zf.read(info)
+    else:
+        # streaming mode: members are read in order, no random access into .tar.gz
+        with tarfile.open(path, 'r|*') as tf:
+            for member in tf:
+                if member.isfile() and member.name.lower().endswith('.sgf'):
+                    yield f"{path}::{member.name}", tf.extractfile(member).read()
+
+
+def iter_inputs(paths):
+    """Yield (key, payload). payload is a file path for plain files and the raw bytes for archive members."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    full = os.path.join(root, file)
+                    if file.lower().endswith('.sgf'):
+                        yield full, full
+                    elif is_archive(file):
+                        yield from iter_archive(full)
+        elif is_archive(path):
+            yield from iter_archive(path)
+        else:
+            yield path, path
+
+
+def process_batch(shard_path, items):
+    """Worker: parse one batch and write it as one shard. Returns (n_games, errors)."""
+    errors = []
+    n_games = 0
+    tmp_path = shard_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out_file:
+        for key, payload in items:
+            try:
+                if isinstance(payload, bytes):
+                    content = payload.decode('utf-8', errors='replace')
+                else:
+                    with open(payload, 'r', encoding='utf-8', errors='replace') as f:
+                        content = f.read()
+                records = list(sgf_content_to_records(content))
+            except Exception as e:
+                errors.append(f"{key}: {e}")
+                continue
+            for record in records:
+                out_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            n_games += len(records)
+    os.replace(tmp_path, shard_path)
+    return n_games, errors
+
+
+def load_manifest(out_dir):
+    """Return (set of finished input keys, set of finished shard names)."""
+    done, shards = set(), set()
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return done, shards
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of an interrupted run
+            shards.add(entry['shard'])
+            done.update(entry['inputs'])
+    return done, shards
+
+
+def remove_orphan_shards(out_dir, shards):
+    """Shards written by an interrupted run but never recorded would duplicate games after resume."""
+    for name in os.listdir(out_dir):
+        if name.startswith('shard-') and name not in shards:
+            os.remove(os.path.join(out_dir, name))
+
+
+def shard_index(name):
+    return int(name[len('shard-'):].split('.')[0])
+
+
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel resumable SGF -> sharded JSONL ingestion')
+    parser.add_argument('inputs', nargs='+', help='folders, .sgf files or .tar/.tar.gz/.zip archives')
+    parser.add_argument('-o', '--output_dir', required=True)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch_size', type=int, default=5000, help='SGF files per shard')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    done, shards = load_manifest(args.output_dir)
+    remove_orphan_shards(args.output_dir, shards)
+    next_shard = max((shard_index(s) for s in shards), default=-1) + 1
+    if done:
+        print(f"### Resuming: {len(done)} inputs in {len(shards)} shards already done")
+
+    todo = ((key, payload) for key, payload in iter_inputs(args.inputs) if key not in done)
+
+    manifest = open(os.path.join(args.output_dir, MANIFEST_NAME), 'a', encoding='utf-8')
+    n_files = n_games = n_errors = 0
+    t0 = time.time()
+    pending = {}
+
+    def collect(futures):
+        nonlocal n_files, n_games, n_errors
+        for fut in futures:
+            name, keys = pending.pop(fut)
+            games, errors = fut.result()
+            for err in errors:
+                print(f"❌ {err}")
+            manifest.write(json.dumps({"shard": name, "inputs": keys}, ensure_ascii=False) + '\n')
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            n_files += len(keys)
+            n_games += games
+            n_errors += len(errors)
+        dt = time.time() - t0
+        print(f"{n_files} files, {n_games} games, {n_errors} errors, {n_files / max(dt, 1e-9):.0f} files/s", flush=True)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for batch in batched(todo, args.batch_size):
+            name = f"shard-{next_shard:06d}.jsonl"
+            next_shard += 1
+            fut = pool.submit(process_batch, os.path.join(args.output_dir, name), batch)
+            pending[fut] = (name, [key for key, _ in batch])
+            if len(pending) >= 2 * args.workers:  # bound the batches held in memory
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        if pending:
+            collect(list(pending))
+
+    manifest.close()
+    print(f"### Done: {n_files} files -> {n_games} games in {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
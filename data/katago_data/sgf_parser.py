@@ -0,0 +1,281 @@
+import re
+
+"""
+Incremental SGF parser.
+
+Streams games out of (multi-game) SGF text fed in arbitrary chunks and keeps
+only the main line: the first variation at every branch. Passes (B[] and
+B[tt] on boards up to 19x19), setup stones (AB/AW), board size, komi,
+handicap and result are kept.
+
+    with open("games.sgf", encoding="utf-8") as f:
+        for game in iter_games(f):
+            print(game.size, game.komi, game.result, len(game))
+"""
+
+# A run of plain move nodes ";B[pd];W[dp]..." is matched in one go; the
+# fixed-width form (no passes, no whitespace) is then split by slicing alone.
+# The lookaheads make sure the last node of a run has no further properties
+# and that a value list cut at the end of a chunk is never taken half-read.
+_TOKEN_RE = re.compile(
+    r"\s*(?:"
+    r"((?:;[BW]\[[a-zA-Z]{2}\])+)(?=[;()\s])"  # 1: run of fixed-width move nodes
+    r"|((?:;\s*[BW]\s*\[[a-zA-Z]{0,2}\]\s*)+)(?=[;()])"  # 2: any run of move nodes
+    r"|([();])"  # 3: structure
+    r"|([A-Za-z]+)\s*((?:\[(?:[^\]\\]|\\.)*\]\s*)+)(?=[;()A-Za-z])"  # 4, 5: property with values
+    r")",
+    re.S,
+)
+# A whole plain game "(;root properties;B[pd];W[dp]...)" at the top level in one match: a single
+# node of properties, then only fixed-width move nodes. Anything else (variations, passes as B[],
+# setup nodes, a game cut at the end of the chunk) does not match and goes through _TOKEN_RE.
+_GAME_RE = re.compile(
+    r"\s*\(\s*;\s*((?:[A-Za-z]+\s*(?:\[(?:[^\]\\]|\\.)*\]\s*)+)*)"  # 1: root node properties
+    r"((?:;[BW]\[[a-zA-Z]{2}\])*)\s*\)",  # 2: run of fixed-width move nodes
+    re.S,
+)
+_PROPERTY_RE = re.compile(r"([A-Za-z]+)\s*((?:\[(?:[^\]\\]|\\.)*\]\s*)+)", re.S)
+# anything unparsable this far from the end of the buffer is junk, not a cut token
+_MAX_TOKEN_WAIT = 1 << 16
+_RUN_MOVE_RE = re.compile(r"([BW])\s*\[([a-zA-Z]{0,2})\]")
+_VALUE_RE = re.compile(r"\[((?:[^\]\\]|\\.)*)\]", re.S)
+
+PASS = "--"
+
+
+class SGFGame(object):
+    """Main line and metadata of one game.
+
+    `colors` is a str with one 'B'/'W' per move and `moves` a str with the
+    matching 2-char SGF coordinates ("pddp..."), PASS ("--") for a pass.
+    """
+
+    __slots__ = ("size", "komi", "handicap", "result", "black", "white",
+                 "setup_black", "setup_white", "colors", "moves")
+
+    def __init__(self):
+        self.size = 19
+        self.komi = None
+        self.handicap = 0
+        self.result = ""
+        self.black = ""
+        self.white = ""
+        self.setup_black = []
+        self.setup_white = []
+        self.colors = ""
+        self.moves = ""
+
+    def __len__(self):
+        return len(self.colors)
+
+    def iter_moves(self):
+        """(color, coord) pairs, coord is PASS for a pass."""
+        moves = self.moves
+        for i, color in enumerate(self.colors):
+            yield color, moves[2 * i:2 * i + 2]
+
+    def __repr__(self):
+        return (f"<SGFGame {self.size}x{self.size} km {self.komi} ha {self.handicap} "
+                f"re {self.result!r} {len(self)} moves>")
+
+
+def _expand_point_list(values):
+    """AB[aa][bb] and the compressed AB[aa:cc] rectangle form."""
+    points = []
+    for v in values:
+        if len(v) == 5 and v[2] == ":":
+            c0, r0, c1, r1 = v[0], v[1], v[3], v[4]
+            for c in range(ord(min(c0, c1)), ord(max(c0, c1)) + 1):
+                for r in range(ord(min(r0, r1)), ord(max(r0, r1)) + 1):
+                    points.append(chr(c) + chr(r))
+        elif len(v) == 2:
+            points.append(v)
+    return points
+
+
+class SGFParser(object):
+    """Feed text with `feed`, collect finished games from its return value."""
+
+    def __init__(self):
+        self._buf = ""
+        self._reset()
+
+    def _reset(self):
+        self._game = None
+        # one entry per open "(": [on_main_line, has_child_variation]
+        self._stack = []
+
+    def _add_fixed_run(self, run):
+        """";B[pd];W[dp]..." -> colors "BW", moves "pddp"."""
+        game = self._game
+        raw = run.encode("ascii")
+        moves = bytearray(len(raw) // 3)
+        moves[0::2] = raw[3::6]
+        moves[1::2] = raw[4::6]
+        moves = moves.decode("ascii")
+        # coordinates on boards up to 19x19 never contain 't', so this only hits passes
+        if game.size <= 19 and "t" in moves:
+            moves = "".join(PASS if moves[i:i + 2] == "tt" else moves[i:i + 2] for i in range(0, len(moves), 2))
+        game.colors += run[1::6]
+        game.moves += moves
+
+    def _add_move(self, color, value):
+        game = self._game
+        if len(value) != 2 or (value == "tt" and game.size <= 19):
+            value = PASS
+        game.colors += color
+        game.moves += value
+
+    def _add_property(self, ident, values):
+        game = self._game
+        if not ident.isupper():
+            ident = "".join(ch for ch in ident if ch.isupper())  # FF[3] allowed "AddBlack"
+        if ident in ("B", "W"):
+            self._add_move(ident, values[0] if values else "")
+        elif ident == "AB" and not game.moves:
+            game.setup_black.extend(_expand_point_list(values))
+        elif ident == "AW" and not game.moves:
+            game.setup_white.extend(_expand_point_list(values))
+        elif ident == "SZ":
+            try:
+                game.size = int(values[0].split(":")[0])
+            except ValueError:
+                pass
+        elif ident == "KM":
+            try:
+                game.komi = float(values[0])
+            except ValueError:
+                pass
+        elif ident == "HA":
+            try:
+                game.handicap = int(values[0])
+            except ValueError:
+                pass
+        elif ident == "RE":
+            game.result = values[0].strip()
+        elif ident == "PB":
+            game.black = values[0]
+        elif ident == "PW":
+            game.white = values[0]
+
+    def feed(self, text, eof=False):
+        """Consume text, return the list of games completed by it."""
+        buf = self._buf + text if self._buf else text
+        pos = 0
+        n = len(buf)
+        done = []
+        stack = self._stack
+        match = _TOKEN_RE.match
+        match_game = _GAME_RE.match
+        while pos < n:
+            if not stack:
+                m = match_game(buf, pos)
+                if m is not None:
+                    pos = m.end()
+                    self._game = SGFGame()
+                    for ident, values in _PROPERTY_RE.findall(m.group(1)):
+                        self._add_property(ident, _VALUE_RE.findall(values))
+                    if m.group(2):
+                        self._add_fixed_run(m.group(2))
+                    done.append(self._game)
+                    self._game = None
+                    continue
+            m = match(buf, pos)
+            if m is None:
+                if not eof and (n - pos < _MAX_TOKEN_WAIT or buf.find("]", pos) < 0):
+                    break  # token cut at the end of the chunk, wait for more text
+                if not stack:
+                    # junk between games
+                    nxt = buf.find("(", pos + 1)
+                    pos = n if nxt < 0 else nxt
+                else:
+                    pos += 1
+                continue
+            pos = m.end()
+            fixed_run, run, struct, ident = m.group(1, 2, 3, 4)
+            if struct == "(":
+                if not stack:
+                    self._game = SGFGame()
+                    stack.append([True, False])
+                else:
+                    parent = stack[-1]
+                    stack.append([parent[0] and not parent[1], False])
+                    parent[1] = True
+            elif struct == ")":
+                if stack:
+                    stack.pop()
+                    if not stack:
+                        done.append(self._game)
+                        self._game = None
+            elif not stack or not stack[-1][0]:
+                continue  # outside a game, or inside a side variation
+            elif fixed_run is not None:
+                self._add_fixed_run(fixed_run)
+            elif run is not None:
+                for color, value in _RUN_MOVE_RE.findall(run):
+                    self._add_move(color, value)
+            elif ident is not None:
+                self._add_property(ident, _VALUE_RE.findall(m.group(5)))
+        self._buf = buf[pos:]
+        if eof:
+            if self._game is not None and self._game.moves:
+                done.append(self._game)  # unterminated last game
+            self._buf = ""
+            self._reset()
+        return done
+
+    def close(self):
+        return self.feed("", eof=True)
+
+
+def iter_games(f, chunk_size=1 << 20):
+    """Stream SGFGame objects out of a text file object."""
+    parser = SGFParser()
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def parse_sgf(text):
+    """Parse a whole SGF string, return the list of games."""
+    parser = SGFParser()
+    return parser.feed(text, eof=True)
+
+
+def game_to_text(game):
+    """Main line in the "PdDp QqDd" move-pair format used by the data scripts.
+
+    Pairs are always (black, white). A pass, or a missing move when the same
+    colour plays twice (e.g. white starting a handicap game), becomes "Tt",
+    which datasets_convert.py skips as off-board while keeping the colours
+    aligned. An unpaired last move gets the "X" suffix, as in SGF2jsonl.py.
+    """
+    moves = []
+    expect = "B"
+    for color, move in game.iter_moves():
+        if color != expect:
+            moves.append("Tt")
+        moves.append("Tt" if move == PASS else move[0].upper() + move[1])
+        expect = "W" if color == "B" else "B"
+
+    paired_moves = []
+    for i in range(0, len(moves), 2):
+        if i + 1 < len(moves):
+            paired_moves.append(moves[i] + moves[i + 1])
+        else:
+            paired_moves.append(moves[i] + "X")
+    return " ".join(paired_moves)
+
+
+def game_to_record(game):
+    """Compact JSON-able record: the move-pair text plus metadata."""
+    record = {"text": game_to_text(game), "size": game.size, "komi": game.komi,
+              "handicap": game.handicap, "result": game.result}
+    if game.setup_black:
+        record["AB"] = [p[0].upper() + p[1] for p in game.setup_black]
+    if game.setup_white:
+        record["AW"] = [p[0].upper() + p[1] for p in game.setup_white]
+    return record
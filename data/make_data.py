@@ -10,7 +10,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from tokenizer.rwkv_tokenizer import TRIE_TOKENIZER  # noqa: E402
 
-from src.binidx import MMapIndexedDataset  # noqa: E402
+from src.binidx import DocMetadataBuilder, MMapIndexedDataset, MMapIndexedDatasetBuilder, doc_meta_file_path  # noqa: E402
+from src.magic_prime import largest_magic_prime  # noqa: E402
 
 """
 How to use:
@@ -48,35 +49,6 @@ except FileNotFoundError:
     tokenizer = TRIE_TOKENIZER("data/tokenizer/rwkv_Goose_Go_vocab.txt")
 
 
-def index_file_path(prefix_path):
-    return prefix_path + ".idx"
-
-
-def data_file_path(prefix_path):
-    return prefix_path + ".bin"
-
-
-class MMapIndexedDatasetBuilder(object):
-    def __init__(self, out_file, dtype=np.uint16):
-        self._data_file = open(out_file, "wb")
-        self._dtype = dtype
-        self._sizes = []
-        self._doc_idx = [0]
-
-    def add_item(self, np_array):
-        assert np_array.dtype == self._dtype
-        self._data_file.write(np_array.tobytes(order="C"))
-        self._sizes.append(np_array.size)
-
-    def end_document(self):
-        self._doc_idx.append(len(self._sizes))
-
-    def finalize(self, index_file):
-        self._data_file.close()
-        with MMapIndexedDataset.Index.writer(index_file, self._dtype) as index:
-            index.write(self._sizes, self._doc_idx)
-
-
 cnt = 0
 
 
@@ -98,20 +70,6 @@ def add_raw(raw):
     cnt += 1
 
 
-def is_prime(n):
-    if n <= 1:
-        return False
-    if n <= 3:
-        return True
-    if n % 2 == 0 or n % 3 == 0:
-        return False
-    i = 5
-    while i * i <= n:
-        if n % i == 0 or n % (i + 2) == 0:
-            return False
-        i += 6
-    return True
-
 ########################################################################################################
 
 
@@ -141,10 +99,18 @@ print(f"### Convert {IN_FILE} to {OUT_NAME}.bin/idx...")
 print("### Building binidx...")
 
 builder = MMapIndexedDatasetBuilder(f"{OUT_NAME}.bin")
+# datasets_convert.py output carries per-position metadata, kept in a .meta sidecar
+meta_builder = None
 with fileinput.input(IN_FILE, encoding="utf-8") as ffff:
     for line in ffff:
-        x = json.loads(line)["text"]
+        record = json.loads(line)
+        x = record["text"]
         add_raw(x)
+        if "move" in record:
+            if meta_builder is None:
+                assert cnt == 1, "metadata must be on every line"
+                meta_builder = DocMetadataBuilder(doc_meta_file_path(OUT_NAME))
+            meta_builder.add(record["move"], record["game"], record["source"], record["player"], record["winner"])
     # for i, line in enumerate(ffff):
     #     try:
     #         x = json.loads(line)["text"]
@@ -156,6 +122,8 @@ with fileinput.input(IN_FILE, encoding="utf-8") as ffff:
     #         print(f"Error: {e}")
     #         print(f"!!!!!!!!!!!!!!!!!!!!!!!!!!")
 builder.finalize((f"{OUT_NAME}.idx"))
+if meta_builder is not None:
+    meta_builder.finalize()
 print("done")
 
 print("### Verifying result...")
@@ -193,11 +161,7 @@ for idx in TODO:
 print(f"{'-'*80}\n### Final {OUT_NAME}.bin/idx has {data_size} tokens, {data_len} items. Dtype {data._index.dtype}")
 
 if data_size >= CTX_LEN * 3:
-    n_chunk = int(data_size // CTX_LEN) - 1
-    for i in range(n_chunk, 0, -1):
-        if i % 3 == 2:
-            if is_prime(i):
-                print(f"\n### magic_prime = {i} (for ctxlen {CTX_LEN})")
-                print(
-                    f'\n--my_exit_tokens {data_size} --magic_prime {i} --ctx_len {CTX_LEN}\n')
-                exit(0)
\ No newline at end of file
+    magic_prime = largest_magic_prime(int(data_size // CTX_LEN) - 1)
+    print(f"\n### magic_prime = {magic_prime} (for ctxlen {CTX_LEN})")
+    print(
+        f'\n--my_exit_tokens {data_size} --magic_prime {magic_prime} --ctx_len {CTX_LEN}\n')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.binidx import MMapIndexedDataset, MMapIndexedDatasetBuilder  # noqa: E402
+from src.dataset import assistant_spans, chat_prompt  # noqa: E402
+
+"""
+Tokenize an SFT JSONL once, for train.py --data_type sft.
+
+How to use:
+
+python data/make_sft_data.py sft.jsonl data/sft --tokenizer path/to/hf_tokenizer --ctx_len 1024
+
+Every line is {"conversations": [{"content": ...}, ...]} as for SFTDataset. The
+chat template is applied and tokenized here instead of in __getitem__, and
+written as <output>.bin/idx (tokens, one document per sample, at most ctx_len + 1)
+plus <output>.mask.bin/idx (int32 [start, end) pairs of the assistant replies
+the loss is computed on). Pass --data_file <output> to train.py and pick
+--sft_batching bucket or pack.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-tokenize SFT conversations into a binidx with loss spans')
+    parser.add_argument('input', help='SFT JSONL')
+    parser.add_argument('output', help='output prefix, without .bin/.idx')
+    parser.add_argument('--tokenizer', required=True, help='HF tokenizer, as train.py --tokenizer')
+    parser.add_argument('--ctx_len', type=int, default=1024, help='samples are cut at ctx_len + 1 tokens')
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    bos_id = tokenizer('<|im_start|>assistant', add_special_tokens=False).input_ids
+    eos_id = tokenizer('<|im_end|>', add_special_tokens=False).input_ids
+    dtype = np.uint16 if len(tokenizer) <= 65536 else np.int32
+
+    t0 = time.perf_counter()
+    builder = MMapIndexedDatasetBuilder(f"{args.output}.bin", dtype=dtype)
+    mask_builder = MMapIndexedDatasetBuilder(f"{args.output}.mask.bin", dtype=np.int32)
+    n_samples = n_tokens = n_trained = n_cut = 0
+    with open(args.input, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            input_ids = tokenizer(chat_prompt(tokenizer, json.loads(line)['conversations'])).input_ids
+            n_cut += len(input_ids) > args.ctx_len + 1
+            input_ids = input_ids[:args.ctx_len + 1]
+            spans = assistant_spans(input_ids, bos_id, eos_id)
+            builder.add_item(np.array(input_ids, dtype=dtype))
+            builder.end_document()
+            mask_builder.add_item(np.array(spans, dtype=np.int32).reshape(-1))
+            mask_builder.end_document()
+            n_samples += 1
+            n_tokens += len(input_ids)
+            n_trained += sum(end - start for start, end in spans)
+    builder.finalize(f"{args.output}.idx")
+    mask_builder.finalize(f"{args.output}.mask.idx")
+
+    sizes = MMapIndexedDataset.Index(f"{args.output}.idx", skip_warmup=True).sizes
+    print(f"### {args.output}.bin/idx: {n_samples} samples, {n_tokens} tokens ({n_trained} trained on), "
+          f"{n_cut} cut at {args.ctx_len + 1} ({time.perf_counter() - t0:.1f}s)")
+    if n_samples:
+        print(f"  length mean {sizes.mean():.1f}, p50 {np.percentile(sizes, 50):.0f}, p99 {np.percentile(sizes, 99):.0f}; "
+              f"padding to ctx_len would keep {100.0 * n_tokens / (n_samples * (args.ctx_len + 1)):.1f}% real tokens")
+
+
+if __name__ == '__main__':
+    main()
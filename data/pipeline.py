@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tokenizer.rwkv_tokenizer import TRIE_TOKENIZER  # noqa: E402
+from katago_data.SGF2jsonl import iter_sgf_files, sgf_file_to_records  # noqa: E402
+from datasets_clean import transform_text  # noqa: E402
+from clean_tail import remove_tail, tail_result  # noqa: E402
+from datasets_concat import estimate_buckets, external_shuffle  # noqa: E402
+from datasets_convert import iter_numbered_positions, position_meta  # noqa: E402
+from datasets_dedup import BloomFilter, Deduper, DiskHashSet, ZobristHasher, game_key  # noqa: E402
+
+from src.binidx import DocMetadataBuilder, MMapIndexedDataset, MMapIndexedDatasetBuilder, doc_meta_file_path  # noqa: E402
+from src.magic_prime import largest_magic_prime  # noqa: E402
+
+"""
+Streaming SGF / JSONL -> binidx pipeline.
+
+Chains the stages of
+
+    katago_data/SGF2jsonl.py -> datasets_clean.py -> clean_tail.py
+        -> datasets_concat.py -> datasets_convert.py -> make_data.py
+
+as generators, so no intermediate JSONL is ever written. The games are
+shuffled like datasets_concat.py does, through temporary bucket files next to
+the output, holding at most --shuffle_memory_mb of them in memory.
+
+How to use:
+
+python data/pipeline.py --sgf data/katago_data/ --pgn go_pgn_string_v2_train.jsonl -o go_capture_simulation_output
+
+--sgf    folders of KataGo .sgf files (SGF2jsonl)
+--pgn    raw "1. >Pc Cp 2. >Cd Qp ... B+R" JSONL (datasets_clean + clean_tail)
+--moves  already cleaned "PcCp CdQp" JSONL
+
+--dedup_games / --dedup_positions drop repeated games / positions on the way
+(see datasets_dedup.py), keyed under the 8 board symmetries.
+
+Next to the .bin/.idx a .meta sidecar holds move number, game, source, side to
+move and winner of every position, for train.py --data_filter.
+"""
+
+VOCAB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenizer', 'rwkv_Goose_Go_vocab.txt')
+
+
+class StageMeter(object):
+    """Counts items and the wall time spent pulling them out of a stage.
+
+    The time is inclusive of all upstream stages; `report` subtracts the
+    upstream time so every stage gets its own share.
+    """
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.seconds = 0.0
+
+    def wrap(self, iterable):
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.seconds += time.perf_counter() - t0
+                return
+            self.seconds += time.perf_counter() - t0
+            self.count += 1
+            yield item
+
+
+def report(meters, total_seconds):
+    upstream = 0.0
+    lines = []
+    for m in meters:
+        own = max(m.seconds - upstream, 0.0)
+        upstream = m.seconds
+        rate = m.count / own if own > 0 else float('inf')
+        lines.append(f"  {m.name:<10} {m.count:>12} {m.unit:<6} {own:9.2f}s  {rate:12.1f} {m.unit}/s")
+    lines.append(f"  {'total':<10} {total_seconds:.2f}s")
+    return '\n'.join(lines)
+
+
+########################################################################################################
+# Stages. Every record is a dict with at least {"text", "source", "kind"}.
+########################################################################################################
+
+def read_sources(sgf_dirs, pgn_files, moves_files):
+    for folder in sgf_dirs:
+        source = os.path.basename(os.path.normpath(folder))
+        for sgf_path in iter_sgf_files(folder):
+            try:
+                records = list(sgf_file_to_records(sgf_path))
+            except OSError as e:
+                print(f"Warning: skip {sgf_path}: {e}")
+                continue
+            for rec in records:
+                rec['source'] = source
+                rec['kind'] = 'moves'
+                yield rec
+
+    for kind, files in (('pgn', pgn_files), ('moves', moves_files)):
+        for path in files:
+            source = os.path.splitext(os.path.basename(path))[0]
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = json.loads(line)
+                        rec['text']
+                    except (json.JSONDecodeError, KeyError):
+                        print(f"Warning: bad line in {path}: {line[:80]!r}")
+                        continue
+                    rec['source'] = source
+                    rec['kind'] = kind
+                    yield rec
+
+
+def clean(records):
+    """datasets_clean.py"""
+    for rec in records:
+        if rec['kind'] == 'pgn':
+            rec['text'] = transform_text(rec['text'])
+        yield rec
+
+
+def clean_tails(records):
+    """clean_tail.py"""
+    for rec in records:
+        if rec['kind'] == 'pgn':
+            result = tail_result(rec['text'])
+            if result:
+                rec.setdefault('result', result)  # kept for the .meta winner column
+            rec['text'] = remove_tail(rec['text'])
+            rec['kind'] = 'moves'
+        if rec['text']:
+            yield rec
+
+
+def shuffle(records, n_buckets, seed, tmp_dir=None):
+    """datasets_concat.py: a full external shuffle over n_buckets temporary files."""
+    lines = (json.dumps(rec, ensure_ascii=False) + '\n' for rec in records)
+    for line in external_shuffle(lines, n_buckets, random.Random(seed), tmp_dir):
+        yield json.loads(line)
+
+
+def input_files(sgf_dirs, pgn_files, moves_files):
+    return [path for folder in sgf_dirs for path in iter_sgf_files(folder)] + list(pgn_files) + list(moves_files)
+
+
+def dedup(records, deduper, positions=False):
+    """datasets_dedup.py"""
+    if positions:
+        return deduper.filter(records, item_fn=lambda rec: rec['text'])
+    return deduper.filter(records)
+
+
+def make_deduper(args, mode, key_fn):
+    path = f"{args.output}.{mode}.{'sqlite' if args.dedup_exact else 'bloom'}"
+    store = DiskHashSet(path) if args.dedup_exact else BloomFilter(path, args.bloom_bits)
+    return Deduper(store, key_fn)
+
+
+def convert(records):
+    """datasets_convert.py: one record per position, with its .meta row."""
+    for game, rec in enumerate(records):
+        positions = iter_numbered_positions(rec['text'], setup_black=rec.get('AB', ()), setup_white=rec.get('AW', ()))
+        for move, text in positions:
+            yield {'text': text, 'source': rec['source'], 'kind': 'position',
+                   'meta': position_meta(text, move, game, rec['source'], rec.get('result'))}
+
+
+def tokenize(records, tokenizer, verify):
+    """make_data.py"""
+    for rec in records:
+        raw = rec['text']
+        out = tokenizer.encode(raw)
+        if verify and tokenizer.decode(out) != raw:
+            raise ValueError(f"tokenizer BAD CASE: {raw!r}")
+        out.append(0)  # [0] = end_of_doc for rwkv tokenizer
+        rec['tokens'] = np.array(out, dtype=np.uint16)
+        yield rec
+
+
+########################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming SGF/JSONL -> binidx pipeline (no intermediate JSONL)')
+    parser.add_argument('--sgf', nargs='*', default=[], help='folders of .sgf files')
+    parser.add_argument('--pgn', nargs='*', default=[], help='raw pgn-string JSONL files')
+    parser.add_argument('--moves', nargs='*', default=[], help='cleaned move-pair JSONL files')
+    parser.add_argument('-o', '--output', required=True, help='output prefix, without .bin/.idx')
+    parser.add_argument('--shuffle_memory_mb', type=int, default=4096,
+                        help='memory for the external game shuffle (datasets_concat.py), <=0 disables')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no_verify', action='store_true', help='skip the decode(encode(x)) == x check')
+    parser.add_argument('--dedup_games', action='store_true', help='drop repeated games (canonical move sequence)')
+    parser.add_argument('--dedup_positions', action='store_true', help='drop repeated (position, move) docs (Zobrist)')
+    parser.add_argument('--dedup_exact', action='store_true', help='exact sqlite key set instead of a Bloom filter')
+    parser.add_argument('--bloom_bits', type=int, default=1 << 33, help='bits per Bloom filter')
+    parser.add_argument('--ctx_len', type=int, default=512, help='ctx_len the magic_prime is computed for')
+    parser.add_argument('--encoding', choices=['raw', 'packed', 'zlib', 'lzma'], default='raw',
+                        help='.bin token storage: raw uint16 (v1), 9-bit packed or zlib / lzma chunks (v2)')
+    parser.add_argument('--report_every', type=int, default=1000000, help='print throughput every N documents')
+    args = parser.parse_args()
+
+    if not (args.sgf or args.pgn or args.moves):
+        parser.error('no input given')
+
+    tokenizer = TRIE_TOKENIZER(VOCAB_FILE)
+
+    game_dedup = make_deduper(args, 'games', game_key) if args.dedup_games else None
+    position_dedup = make_deduper(args, 'positions', ZobristHasher().key) if args.dedup_positions else None
+
+    meters = [StageMeter('read', 'games')]
+    stream = meters[-1].wrap(read_sources(args.sgf, args.pgn, args.moves))
+    meters.append(StageMeter('clean', 'games'))
+    stream = meters[-1].wrap(clean(stream))
+    meters.append(StageMeter('tail', 'games'))
+    stream = meters[-1].wrap(clean_tails(stream))
+    if game_dedup is not None:
+        meters.append(StageMeter('dedup', 'games'))
+        stream = meters[-1].wrap(dedup(stream, game_dedup))
+    if args.shuffle_memory_mb > 0:
+        n_buckets, total_bytes = estimate_buckets(input_files(args.sgf, args.pgn, args.moves), args.shuffle_memory_mb)
+        print(f"### Shuffle: {total_bytes / 1e6:.1f} MB of input, {n_buckets} buckets")
+        meters.append(StageMeter('shuffle', 'games'))
+        stream = meters[-1].wrap(shuffle(stream, n_buckets, args.seed, os.path.dirname(os.path.abspath(args.output))))
+    meters.append(StageMeter('convert', 'docs'))
+    stream = meters[-1].wrap(convert(stream))
+    if position_dedup is not None:
+        meters.append(StageMeter('dedup', 'docs'))
+        stream = meters[-1].wrap(dedup(stream, position_dedup, positions=True))
+    meters.append(StageMeter('tokenize', 'docs'))
+    stream = meters[-1].wrap(tokenize(stream, tokenizer, not args.no_verify))
+    write_meter = StageMeter('write', 'docs')
+
+    print(f"### Building {args.output}.bin/idx...")
+    t_start = time.perf_counter()
+    builder = MMapIndexedDatasetBuilder(f"{args.output}.bin", encoding=args.encoding)
+    meta_builder = DocMetadataBuilder(doc_meta_file_path(args.output))
+    n_tokens = 0
+    for rec in stream:
+        t0 = time.perf_counter()
+        builder.add_item(rec['tokens'])
+        builder.end_document()
+        meta_builder.add(**rec['meta'])
+        n_tokens += rec['tokens'].size
+        write_meter.count += 1
+        write_meter.seconds += time.perf_counter() - t0
+        if write_meter.count % args.report_every == 0:
+            print(f"\n{write_meter.count} docs, {n_tokens} tokens\n"
+                  f"{report(meters, time.perf_counter() - t_start)}", flush=True)
+    t0 = time.perf_counter()
+    builder.finalize(f"{args.output}.idx")
+    meta_builder.finalize()
+    write_meter.seconds += time.perf_counter() - t0
+    # the writer is the last consumer, so its own time is not included upstream
+    write_meter.seconds += meters[-1].seconds
+
+    print(f"\n### Stage throughput\n{report(meters + [write_meter], time.perf_counter() - t_start)}")
+    for name, deduper in (('games', game_dedup), ('positions', position_dedup)):
+        if deduper is not None:
+            deduper.store.close()
+            print(f"\n### Duplicate {name} per source\n{deduper.report()}")
+
+    data = MMapIndexedDataset(args.output)
+    data_size = data.num_tokens
+    print(f"\n### Final {args.output}.bin/idx has {data_size} tokens, {len(data)} items. Dtype {data._index.dtype}")
+    magic_prime = largest_magic_prime(data_size // args.ctx_len - 1)
+    print(f"\n### magic_prime = {magic_prime} (for ctxlen {args.ctx_len})")
+    print(f'\n--my_exit_tokens {data_size} --magic_prime {magic_prime} --ctx_len {args.ctx_len}\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -28,7 +28,7 @@ PROJ_DIR="out/L"$N_LAYER"-D"$N_EMBD"-"$MODEL_TYPE # set output folder
 M_BSZ="192" # takes ~9G VRAM here => reduce this to save VRAM, increase this for faster speed
 LR_INIT="4e-4"
 LR_FINAL="4e-6"
-GRAD_CP=0 # 1 => slower, save VRAM; 0 => faster, more VRAM
+GRAD_CP=0 # 1 => slower, save VRAM; 0 => faster, more VRAM; 2 => torch.utils.checkpoint, see --grad_cp_every / --grad_cp_policy
 EPOCH_SAVE=20 # save every 10 "miniepochs" (1 miniepoch = 40320 * ctx_len tokens) => decrease if your GPU is weak
 #
 ################################################################################
@@ -43,7 +43,7 @@ DS_BUCKET_MB=2 # set to 2 for consumer GPUs, set to 200 for A100 / H100 (affects
 #
 # --my_exit_tokens 224188824986 --magic_prime 437868791 --ctx_len 512
 MY_EXIT_TOKENS="224188824986"
-MAGIC_PRIME="437868791"
+MAGIC_PRIME="437868791" # 0 = let train.py compute it from the binidx at startup
 # DATA_FILE="data/pretrain_hq"
 DATA_FILE="data/go_capture_simulation_output"
 DATA_TYPE="binidx"
@@ -0,0 +1,112 @@
+########################################################################################################
+# RWKV-7 inference on CPU with chunked-parallel prefill
+########################################################################################################
+#
+# Loads a checkpoint written by train.py (src/model.py names) and runs it with
+# plain PyTorch: a prompt goes through every layer chunk by chunk (matmuls
+# inside a chunk, the state carried between chunks, as CHUNK_LEN in the
+# training kernel), single tokens take the RNN step. Both return the state, so
+# a prefilled prompt continues token by token.
+#
+# model = RWKV7Prefill("out/L12-D768-x070/rwkv-final.pth")
+# logits, state = model.forward(prompt_tokens)          # prefill
+# logits, state = model.forward([next_token], state)    # RNN mode
+#
+# benchmarks/bench_wkv7_prefill.py compares chunk sizes with the sequential path.
+
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.wkv7_torch import CHUNK_LEN, wkv7_chunked, wkv7_naive  # noqa: E402
+
+
+class RWKV7Prefill(object):
+    def __init__(self, model, chunk_len=CHUNK_LEN):
+        """model: checkpoint path (.pth optional) or a state_dict of src/model.py's RWKV."""
+        if isinstance(model, str):
+            if not model.endswith(".pth") and not os.path.exists(model):
+                model += ".pth"
+            model = torch.load(model, map_location="cpu")
+        self.w = {k: v.float() for k, v in model.items()}
+        self.n_layer = 1 + max(int(k.split(".")[1]) for k in self.w if k.startswith("blocks."))
+        self.n_embd = self.w["emb.weight"].shape[1]
+        self.n_head, self.head_size = self.w["blocks.0.att.r_k"].shape
+        self.chunk_len = chunk_len
+
+    def zero_state(self):
+        """Per layer: [previous x of att, wkv state (H, N, N), previous x of ffn]."""
+        state = []
+        for _ in range(self.n_layer):
+            state += [
+                torch.zeros(self.n_embd),
+                torch.zeros(self.n_head, self.head_size, self.head_size),
+                torch.zeros(self.n_embd),
+            ]
+        return state
+
+    @torch.no_grad()
+    def forward(self, tokens, state=None, full_output=False, chunk_len=None):
+        """(logits of the last token, or of every token with full_output, new state)."""
+        chunk_len = chunk_len or self.chunk_len
+        state = self.zero_state() if state is None else [s.clone() for s in state]
+        w = self.w
+        x = w["emb.weight"][torch.as_tensor(tokens, dtype=torch.long)]
+        v_first = None
+        for i in range(self.n_layer):
+            bb = f"blocks.{i}."
+            if i == 0:
+                x = F.layer_norm(x, (self.n_embd,), w[bb + "ln0.weight"], w[bb + "ln0.bias"])
+            xa = F.layer_norm(x, (self.n_embd,), w[bb + "ln1.weight"], w[bb + "ln1.bias"])
+            xa, v_first, state[i * 3], state[i * 3 + 1] = self.time_mix(
+                bb + "att.", xa, v_first, state[i * 3], state[i * 3 + 1], chunk_len
+            )
+            x = x + xa
+            xf = F.layer_norm(x, (self.n_embd,), w[bb + "ln2.weight"], w[bb + "ln2.bias"])
+            xf, state[i * 3 + 2] = self.channel_mix(bb + "ffn.", xf, state[i * 3 + 2])
+            x = x + xf
+        if not full_output:
+            x = x[-1:]
+        x = F.layer_norm(x, (self.n_embd,), w["ln_out.weight"], w["ln_out.bias"])
+        logits = x @ w["head.weight"].t()
+        return (logits if full_output else logits[0]), state
+
+    def time_mix(self, p, x, v_first, x_prev, S, chunk_len):
+        w = self.w
+        T, C = x.shape
+        H, N = self.n_head, self.head_size
+        xx = torch.cat([x_prev[None], x[:-1]]) - x
+        xr, xw, xk, xv, xa, xg = [x + xx * w[p + m][0, 0] for m in ("x_r", "x_w", "x_k", "x_v", "x_a", "x_g")]
+
+        r = xr @ w[p + "receptance.weight"].t()
+        dec = -F.softplus(-(w[p + "w0"][0, 0] + torch.tanh(xw @ w[p + "w1"]) @ w[p + "w2"])) - 0.5
+        k = xk @ w[p + "key.weight"].t()
+        v = xv @ w[p + "value.weight"].t()
+        if v_first is None:
+            v_first = v
+        else:
+            v = torch.lerp(v, v_first, torch.sigmoid(w[p + "v0"][0, 0] + (xv @ w[p + "v1"]) @ w[p + "v2"]))
+        a = torch.sigmoid(w[p + "a0"][0, 0] + (xa @ w[p + "a1"]) @ w[p + "a2"])
+        g = torch.sigmoid(xg @ w[p + "g1"]) @ w[p + "g2"]
+        kk = F.normalize((k * w[p + "k_k"][0, 0]).view(T, H, N), dim=-1, p=2.0).view(T, C)
+        k = k * (1 + (a - 1) * w[p + "k_a"][0, 0])
+
+        q_, w_, k_, v_, a_, b_ = [t.view(1, T, H, N) for t in (r, dec, k, v, -kk, kk * a)]
+        if T == 1:
+            y, S = wkv7_naive(q_, w_, k_, v_, a_, b_, state=S[None])  # RNN step
+        else:
+            y, S = wkv7_chunked(q_, w_, k_, v_, a_, b_, state=S[None], chunk_len=chunk_len)
+        y = F.group_norm(y.reshape(T, C), H, w[p + "ln_x.weight"], w[p + "ln_x.bias"], eps=64e-5)
+        y = y + ((r.view(T, H, N) * k.view(T, H, N) * w[p + "r_k"]).sum(-1, keepdim=True) * v.view(T, H, N)).view(T, C)
+        return (y * g) @ w[p + "output.weight"].t(), v_first, x[-1], S[0]
+
+    def channel_mix(self, p, x, x_prev):
+        w = self.w
+        xx = torch.cat([x_prev[None], x[:-1]]) - x
+        k = x + xx * w[p + "x_k"][0, 0]
+        k = torch.relu(k @ w[p + "key.weight"].t()) ** 2
+        return k @ w[p + "value.weight"].t(), x[-1]
@@ -1,5 +1,18 @@
+import array
+import ast
+import glob
+import hashlib
+import json
+import lzma
+import mmap
 import os
+import queue
+import resource
 import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
 from functools import lru_cache
 from itertools import accumulate
 
@@ -17,11 +30,54 @@ def print_rank_0(*message):
     #     print(*message, flush=True)
 
 
-def _warmup_mmap_file(path):
-    pass
-    # with open(path, "rb") as stream:
-    #     while stream.read(100 * 1024 * 1024):
-    #         pass
+PAGE_SIZE = mmap.PAGESIZE
+
+# access pattern -> (posix_fadvise, madvise) hints, applied where the platform has them
+_ACCESS_ADVICE = {
+    "normal": ("POSIX_FADV_NORMAL", "MADV_NORMAL"),
+    "random": ("POSIX_FADV_RANDOM", "MADV_RANDOM"),
+    "sequential": ("POSIX_FADV_SEQUENTIAL", "MADV_SEQUENTIAL"),
+    "willneed": ("POSIX_FADV_WILLNEED", "MADV_WILLNEED"),
+}
+
+# reads slower than this count as an IO stall
+SLOW_READ_SECONDS = 1e-3
+IO_STAT_FIELDS = ("reads", "tokens", "read_seconds", "slow_reads", "major_faults")
+_RUSAGE_WHO = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+
+def _warmup_mmap_file(path, access="willneed"):
+    """Tell the kernel how the file will be read (readahead for "willneed"), without reading it."""
+    advice = getattr(os, _ACCESS_ADVICE[access][0], None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _madvise(buffer_mmap, access, start=0, length=None):
+    """madvise a byte range of an np.memmap (page aligned here); best effort."""
+    advice = getattr(mmap, _ACCESS_ADVICE[access][1], None)
+    mm = getattr(buffer_mmap, "_mmap", None)
+    if advice is None or mm is None or not hasattr(mm, "madvise"):
+        return False
+    size = len(mm)
+    if length is None:
+        length = size - start
+    end = min(start + length, size)
+    start -= start % PAGE_SIZE
+    if end <= start:
+        return False
+    try:
+        mm.madvise(advice, start, end - start)
+    except (OSError, ValueError):
+        return False
+    return True
 
 
 dtypes = {
@@ -36,6 +92,59 @@ dtypes = {
 }
 
 
+def _count_read(stats, t0, faults, n_windows, n_tokens):
+    """Add one timed read to an IO_STAT_FIELDS array (t0 / faults taken before the read)."""
+    dt = time.perf_counter() - t0
+    stats[0] += n_windows
+    stats[1] += n_tokens
+    stats[2] += dt
+    stats[3] += dt > SLOW_READ_SECONDS * n_windows
+    stats[4] += resource.getrusage(_RUSAGE_WHO).ru_majflt - faults
+
+
+# .bin encodings. "raw" is the original v1 file; the others write a v2 index.
+#   packed: every token in `bits` bits, little endian bit stream (9 bits fit our 370 token vocab)
+#   zlib / lzma: chunks of chunk_tokens tokens compressed one by one, with their byte offsets in the .idx
+ENCODINGS = {"raw": 0, "packed": 1, "zlib": 2, "lzma": 3}
+DEFAULT_CHUNK_TOKENS = {"raw": 0, "packed": 1 << 16, "zlib": 1 << 14, "lzma": 1 << 14}
+# decoded zlib / lzma chunks kept per dataset
+CHUNK_CACHE_SIZE = 16
+
+IndexHeader = namedtuple(
+    "IndexHeader",
+    ["dtype", "length", "doc_count", "offset", "version", "encoding", "bits", "chunk_tokens", "num_tokens", "n_chunks"],
+)
+
+
+def _pack_bits(tokens, bits):
+    bit_array = (tokens.astype(np.uint32)[:, None] >> np.arange(bits, dtype=np.uint32)) & 1
+    return np.packbits(bit_array.astype(np.uint8).reshape(-1), bitorder="little").tobytes()
+
+
+def _unpack_bits(buffer, start, length, bits, dtype):
+    """Tokens [start, start + length) of a packed bit stream, touching only their bytes."""
+    first = start * bits // 8
+    last = ((start + length) * bits + 7) // 8
+    bit_array = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8, count=last - first, offset=first), bitorder="little")
+    skip = start * bits - 8 * first
+    bit_array = bit_array[skip:skip + length * bits].reshape(length, bits)
+    return bit_array.dot(1 << np.arange(bits)).astype(dtype)
+
+
+def _encode_chunk(tokens, encoding, bits):
+    if encoding == "packed":
+        return _pack_bits(tokens, bits)
+    if encoding == "zlib":
+        return zlib.compress(tokens.tobytes(), 6)
+    return lzma.compress(tokens.tobytes(), preset=6)
+
+
+def _decode_chunk(payload, encoding, dtype):
+    if encoding == "zlib":
+        return np.frombuffer(zlib.decompress(payload), dtype=dtype)
+    return np.frombuffer(lzma.decompress(payload), dtype=dtype)
+
+
 def code(dtype):
     for k in dtypes.keys():
         if dtypes[k] == dtype:
@@ -56,7 +165,11 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         _HDR_MAGIC = b"MMIDIDX\x00\x00"
 
         @classmethod
-        def writer(cls, path, dtype):
+        def writer(cls, path, dtype, encoding="raw", bits=0, chunk_tokens=0):
+            """encoding "raw" writes the original v1 index, anything else a v2 index
+            that also records the encoding and (for zlib / lzma) the chunk offsets."""
+            version = 1 if encoding == "raw" else 2
+
             class _Writer(object):
                 def __enter__(self):
                     self._file = open(path, "wb")
@@ -65,7 +178,7 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                     self._file.write(cls._HDR_MAGIC)
                     # Write version number
                     # Little endian unsigned 64 Bit integer
-                    self._file.write(struct.pack("<Q", 1))
+                    self._file.write(struct.pack("<Q", version))
                     # Little endian unsigned 8 Bit integer
                     self._file.write(struct.pack("<B", code(dtype)))
 
@@ -83,13 +196,18 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
 
                     return pointers
 
-                def write(self, sizes, doc_idx):
+                def write(self, sizes, doc_idx, num_tokens=0, chunk_offsets=()):
+                    # pointers stay byte offsets into the decoded token stream
                     pointers = self._get_pointers(sizes)
 
                     # Little endian unsigned 64 Bit integer
                     self._file.write(struct.pack("<Q", len(sizes)))
                     # Little endian unsigned 64 Bit integer
                     self._file.write(struct.pack("<Q", len(doc_idx)))
+                    if version == 2:
+                        # encoding, bits per packed token, tokens per chunk, total tokens, chunk count
+                        self._file.write(struct.pack("<BBQQQ", ENCODINGS[encoding], bits, chunk_tokens,
+                                                     num_tokens, max(len(chunk_offsets) - 1, 0)))
 
                     sizes = np.array(sizes, dtype=np.int32)
                     self._file.write(sizes.tobytes(order="C"))
@@ -102,36 +220,52 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                     doc_idx = np.array(doc_idx, dtype=np.int64)
                     self._file.write(doc_idx.tobytes(order="C"))
 
+                    if len(chunk_offsets) > 0:
+                        self._file.write(np.array(chunk_offsets, dtype=np.int64).tobytes(order="C"))
+
                 def __exit__(self, exc_type, exc_val, exc_tb):
                     self._file.close()
 
             return _Writer()
 
+        @classmethod
+        def read_header(cls, stream):
+            """Parse the header only; returns an IndexHeader (offset = where the sizes array starts)."""
+            magic_test = stream.read(9)
+            assert cls._HDR_MAGIC == magic_test, (
+                "Index file doesn't match expected format. "
+                "Make sure that --dataset-impl is configured properly."
+            )
+            # Little endian unsigned 64 Bit integer
+            (version,) = struct.unpack("<Q", stream.read(8))
+            assert version in (1, 2)
+
+            # Little endian unsigned 8 Bit integer
+            (dtype_code,) = struct.unpack("<B", stream.read(1))
+
+            length = struct.unpack("<Q", stream.read(8))[0]
+            doc_count = struct.unpack("<Q", stream.read(8))[0]
+            encoding, bits, chunk_tokens, num_tokens, n_chunks = "raw", 0, 0, 0, 0
+            if version == 2:
+                encoding_code, bits, chunk_tokens, num_tokens, n_chunks = struct.unpack("<BBQQQ", stream.read(26))
+                encoding = {v: k for k, v in ENCODINGS.items()}[encoding_code]
+            return IndexHeader(dtypes[dtype_code], length, doc_count, stream.tell(), version,
+                               encoding, bits, chunk_tokens, num_tokens, n_chunks)
+
         def __init__(self, path, skip_warmup=False):
             with open(path, "rb") as stream:
-                magic_test = stream.read(9)
-                assert self._HDR_MAGIC == magic_test, (
-                    "Index file doesn't match expected format. "
-                    "Make sure that --dataset-impl is configured properly."
-                )
-                # Little endian unsigned 64 Bit integer
-                version = struct.unpack("<Q", stream.read(8))
-                assert (1,) == version
-
-                # Little endian unsigned 8 Bit integer
-                (dtype_code,) = struct.unpack("<B", stream.read(1))
-                self._dtype = dtypes[dtype_code]
+                self.header = self.read_header(stream)
+                self._dtype, self._len, self._doc_count, offset = self.header[:4]
                 self._dtype_size = self._dtype().itemsize
 
-                self._len = struct.unpack("<Q", stream.read(8))[0]
-                self._doc_count = struct.unpack("<Q", stream.read(8))[0]
-                offset = stream.tell()
-
             if not skip_warmup:
                 print_rank_0("    warming up index mmap file...")
                 _warmup_mmap_file(path)
 
             self._bin_buffer_mmap = np.memmap(path, mode="r", order="C")
+            if not skip_warmup:
+                # sizes / pointers are read all over the place, fault them in up front
+                _madvise(self._bin_buffer_mmap, "willneed")
             self._bin_buffer = memoryview(self._bin_buffer_mmap)
             print_rank_0("    reading sizes...")
             self._sizes = np.frombuffer(
@@ -151,6 +285,12 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                 count=self._doc_count,
                 offset=offset + self._sizes.nbytes + self._pointers.nbytes,
             )
+            self._chunk_offsets = np.frombuffer(
+                self._bin_buffer,
+                dtype=np.int64,
+                count=self.header.n_chunks + 1 if self.header.n_chunks else 0,
+                offset=offset + self._sizes.nbytes + self._pointers.nbytes + self._doc_idx.nbytes,
+            )
 
         def __del__(self):
             self._bin_buffer_mmap._mmap.close()
@@ -160,6 +300,10 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         def dtype(self):
             return self._dtype
 
+        @property
+        def encoding(self):
+            return self.header.encoding
+
         @property
         def sizes(self):
             return self._sizes
@@ -175,34 +319,42 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         def __len__(self):
             return self._len
 
-    def __init__(self, path, skip_warmup=False):
+    def __init__(self, path, skip_warmup=False, access="normal"):
+        """access: "random" / "sequential" / "normal" read pattern of the .bin, used for
+        the fadvise / madvise readahead hints."""
         super().__init__()
 
         self._path = None
         self._index = None
         self._bin_buffer = None
 
-        self._do_init(path, skip_warmup)
+        self._do_init(path, skip_warmup, access)
 
     def __getstate__(self):
-        return self._path
+        return self._path, self._access
 
     def __setstate__(self, state, skip_warmup=False):
-        self._do_init(state, skip_warmup)
+        if isinstance(state, str):
+            state = (state, "normal")
+        self._do_init(state[0], skip_warmup, state[1])
 
-    def _do_init(self, path, skip_warmup):
+    def _do_init(self, path, skip_warmup, access="normal"):
         self._path = path
+        self._access = access
+        self.io_stats = np.zeros(len(IO_STAT_FIELDS), dtype=np.float64)
         self._index = self.Index(index_file_path(self._path), skip_warmup)
 
         if not skip_warmup:
             print_rank_0("    warming up data mmap file...")
-            _warmup_mmap_file(data_file_path(self._path))
+            _warmup_mmap_file(data_file_path(self._path), access)
         print_rank_0("    creating numpy buffer of mmap...")
         self._bin_buffer_mmap = np.memmap(
             data_file_path(self._path), mode="r", order="C"
         )
+        _madvise(self._bin_buffer_mmap, access)
         print_rank_0("    creating memory view of numpy buffer...")
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        self._chunk_cache = OrderedDict()
 
     def __del__(self):
         self._bin_buffer_mmap._mmap.close()
@@ -212,14 +364,60 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
     def __len__(self):
         return len(self._index)
 
+    @property
+    def num_tokens(self):
+        if self._index.encoding == "raw":
+            return len(self._bin_buffer) // self._index._dtype_size
+        return self._index.header.num_tokens
+
+    def _chunk(self, c):
+        """Decoded zlib / lzma chunk c, with a small LRU cache."""
+        chunk = self._chunk_cache.get(c)
+        if chunk is None:
+            start, end = self._index._chunk_offsets[c:c + 2]
+            chunk = _decode_chunk(self._bin_buffer[start:end], self._index.encoding, self._index.dtype)
+            self._chunk_cache[c] = chunk
+            if len(self._chunk_cache) > CHUNK_CACHE_SIZE:
+                self._chunk_cache.popitem(last=False)
+        else:
+            self._chunk_cache.move_to_end(c)
+        return chunk
+
+    def tokens(self, start, length):
+        """length tokens at token position start of the .bin, decoding only what covers them.
+
+        A zero-copy view for raw files.
+        """
+        header = self._index.header
+        if header.encoding == "raw":
+            return np.frombuffer(
+                self._bin_buffer, dtype=self._index.dtype, count=length, offset=start * self._index._dtype_size
+            )
+        if header.encoding == "packed":
+            return _unpack_bits(self._bin_buffer, start, length, header.bits, self._index.dtype)
+        ct = header.chunk_tokens
+        first, last = start // ct, (start + max(length, 1) - 1) // ct
+        if first == last:
+            data = self._chunk(first)
+        else:
+            data = np.concatenate([self._chunk(c) for c in range(first, last + 1)])
+        return data[start - first * ct:start - first * ct + length]
+
+    def _byte_range(self, start, end):
+        """Bytes of the .bin holding tokens [start, end)."""
+        header = self._index.header
+        if header.encoding == "raw":
+            return start * self._index._dtype_size, end * self._index._dtype_size
+        if header.encoding == "packed":
+            return start * header.bits // 8, (end * header.bits + 7) // 8
+        ct = header.chunk_tokens
+        last = min((max(end, start + 1) - 1) // ct + 1, header.n_chunks)
+        return int(self._index._chunk_offsets[start // ct]), int(self._index._chunk_offsets[last])
+
     # @lru_cache(maxsize=8)
     def __getitem__(self, idx):
         if isinstance(idx, int):
-            ptr, size = self._index[idx]
-            np_array = np.frombuffer(
-                self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr
-            )
-            return np_array
+            return self.get(idx)
         elif isinstance(idx, slice):
             start, stop, step = idx.indices(len(self))
             if step != 1:
@@ -229,9 +427,7 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
             sizes = self._index._sizes[idx]
             offsets = list(accumulate(sizes))
             total_size = sum(sizes)
-            np_array = np.frombuffer(
-                self._bin_buffer, dtype=self._index.dtype, count=total_size, offset=ptr
-            )
+            np_array = self.tokens(ptr // self._index._dtype_size, total_size)
             sents = np.split(np_array, offsets[:-1])
             return sents
 
@@ -244,12 +440,59 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         ptr, size = self._index[idx]
         if length is None:
             length = size - offset
-        ptr += offset * np.dtype(self._index.dtype).itemsize
-        np_array = np.frombuffer(
-            self._bin_buffer, dtype=self._index.dtype, count=length, offset=ptr
-        )
+        return self.tokens(ptr // self._index._dtype_size + offset, length)
+
+    def read(self, idx, offset=0, length=None, stats=None):
+        """Like get(), but returns a copy and counts the time spent faulting the pages in.
+
+        stats: array of len(IO_STAT_FIELDS) to add to, self.io_stats by default.
+        """
+        stats = self.io_stats if stats is None else stats
+        faults = resource.getrusage(_RUSAGE_WHO).ru_majflt
+        t0 = time.perf_counter()
+        np_array = np.array(self.get(idx, offset, length))
+        _count_read(stats, t0, faults, 1, np_array.size)
         return np_array
 
+    def read_windows(self, offsets, length, idx=0, stats=None):
+        """Gather len(offsets) windows of `length` tokens starting at item idx with one fancy index.
+
+        Like get(), windows may run past the end of item idx (MyDataset reads the
+        whole .bin as item 0). Returns a (len(offsets), length) array, counted like read().
+        """
+        stats = self.io_stats if stats is None else stats
+        ptr, _ = self._index[idx]
+        start = ptr // self._index._dtype_size
+        offsets = np.asarray(offsets, dtype=np.int64)
+        faults = resource.getrusage(_RUSAGE_WHO).ru_majflt
+        t0 = time.perf_counter()
+        if self._index.encoding == "raw":
+            tokens = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, offset=ptr)
+            np_array = tokens[offsets[:, None] + np.arange(length, dtype=np.int64)]
+        else:
+            np_array = np.empty((offsets.size, length), dtype=self._index.dtype)
+            for r, offset in enumerate(offsets.tolist()):
+                np_array[r] = self.tokens(start + offset, length)
+        _count_read(stats, t0, faults, offsets.size, np_array.size)
+        return np_array
+
+    def prefetch_range(self, idx, offset, length):
+        """Page in tokens [offset, offset + length) of item idx: readahead hint, then touch every page."""
+        ptr, size = self._index[idx]
+        first_token = int(ptr) // self._index._dtype_size + offset
+        start, end = self._byte_range(first_token, first_token + length)
+        end = min(end, len(self._bin_buffer))
+        if end <= start:
+            return
+        _madvise(self._bin_buffer_mmap, "willneed", start, end - start)
+        first = start - start % PAGE_SIZE
+        pages = np.frombuffer(self._bin_buffer, dtype=np.uint8, count=end - first, offset=first)
+        int(pages[::PAGE_SIZE].sum())  # blocks until every page is resident
+
+    def prefetch(self, indices):
+        for i in indices:
+            self.prefetch_range(i, 0, int(self._index._sizes[i]))
+
     @property
     def sizes(self):
         return self._index.sizes
@@ -266,10 +509,538 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
 
     @property
     def supports_prefetch(self):
-        return False
+        return True
 
     @staticmethod
     def exists(path):
         return os.path.exists(index_file_path(path)) and os.path.exists(
             data_file_path(path)
         )
+
+
+def expand_data_files(spec):
+    """"a,b" / ["a", "b"] / "shards/*" -> list of binidx prefixes (globs matched against the .idx files)."""
+    if isinstance(spec, str):
+        spec = [p for p in spec.split(",") if p]
+    paths = []
+    for p in spec:
+        if glob.has_magic(p):
+            paths += sorted(f[: -len(".idx")] for f in glob.glob(index_file_path(p)))
+        else:
+            paths.append(p)
+    return paths
+
+
+def parse_data_weights(spec, n_shards):
+    """"" -> all 1.0, else one comma separated weight per shard."""
+    if not spec:
+        return [1.0] * n_shards
+    weights = [float(w) for w in spec.split(",")] if isinstance(spec, str) else list(spec)
+    assert len(weights) == n_shards, f"{len(weights)} data weights for {n_shards} shards"
+    return weights
+
+
+def virtual_token_count(shard_tokens, weights):
+    """Tokens of every shard as seen by the sampler: a shard with weight w takes w times its size."""
+    return (np.asarray(shard_tokens, dtype=np.float64) * np.asarray(weights, dtype=np.float64)).astype(np.int64)
+
+
+def window_index_file_path(prefix_path, ctx_len, tag=""):
+    return prefix_path + f".ctx{ctx_len}" + (f".{tag}" if tag else "") + ".win"
+
+
+def doc_meta_file_path(prefix_path):
+    return prefix_path + ".meta"
+
+
+def doc_aligned_windows(index, num_tokens, ctx_len, doc_mask=None):
+    """(starts, lengths) of windows that begin on a document start, for reads of ctx_len + 1 tokens.
+
+    Whole documents are packed greedily: a window ends where the next one
+    starts, at the last document start at most ctx_len + 1 tokens away.
+    Documents longer than that are cut every ctx_len tokens, and a window
+    ending on such a cut keeps the next token as its last target. lengths[w] <=
+    ctx_len + 1 are the tokens of the read that belong to the window, the rest
+    is masked out.
+
+    doc_mask (bool per document of doc_idx) keeps only those documents: windows
+    never run into a document that is left out.
+    """
+    itemsize = index._dtype_size
+    doc_idx = np.asarray(index.doc_idx, dtype=np.int64)
+    first_item = doc_idx[:-1]
+    doc_starts = np.full(first_item.shape, num_tokens, dtype=np.int64)
+    has_items = first_item < len(index)
+    doc_starts[has_items] = index._pointers[first_item[has_items]] // itemsize
+    doc_lengths = np.diff(np.append(doc_starts, num_tokens))
+    keep = doc_lengths > 0
+    if doc_mask is not None:
+        assert len(doc_mask) == len(doc_starts), f"{len(doc_mask)} metadata rows for {len(doc_starts)} documents"
+    selected = np.ones(len(doc_starts), dtype=bool) if doc_mask is None else np.asarray(doc_mask, dtype=bool)
+    doc_starts, doc_lengths, selected = doc_starts[keep], doc_lengths[keep], selected[keep]
+
+    # split long documents into pieces of ctx_len (+1 token shared with the next piece)
+    pieces = np.maximum(1, (doc_lengths + ctx_len - 2) // ctx_len)
+    first_piece = np.repeat(np.cumsum(pieces) - pieces, pieces)
+    piece = np.arange(first_piece.size) - first_piece
+    starts = np.append(np.repeat(doc_starts, pieces) + piece * ctx_len, num_tokens)  # + sentinel
+    at_doc = np.append(piece == 0, True)
+    usable = np.append(np.repeat(selected, pieces), True)
+
+    # nxt[i]: where a window starting at starts[i] ends, a document start within
+    # ctx_len + 1 tokens or a cut within ctx_len; > i since pieces are <= ctx_len apart
+    doc_pos = np.nonzero(at_doc)[0]
+    to_doc = doc_pos[np.searchsorted(starts[doc_pos], starts[:-1] + ctx_len + 1, side="right") - 1]
+    to_cut = np.searchsorted(starts, starts[:-1] + ctx_len, side="right") - 1
+    nxt = np.maximum(to_doc, to_cut)
+    # ... but never past the first document that is left out
+    gaps = np.nonzero(~usable)[0]
+    if gaps.size:
+        barrier = np.append(gaps, len(starts) - 1)[np.searchsorted(gaps, np.arange(len(nxt)), side="right")]
+        nxt = np.minimum(nxt, barrier)
+    # resume at the next usable start after a window
+    usable_pos = np.nonzero(usable)[0]
+    next_usable = usable_pos[np.searchsorted(usable_pos, np.arange(len(starts)), side="left")].tolist()
+
+    nxt = nxt.tolist()
+    chain = []
+    i, n = next_usable[0], len(nxt)
+    while i < n:
+        chain.append(i)
+        i = next_usable[nxt[i]]
+    chain = np.array(chain, dtype=np.int64)
+    ends = np.asarray(nxt, dtype=np.int64)[chain]
+    window_starts = starts[chain]
+    window_lengths = starts[ends] - window_starts + np.where(at_doc[ends], 0, 1)
+    return window_starts.astype(np.int64), window_lengths.astype(np.int32)
+
+
+class WindowIndex(object):
+    """Memmapped .ctx{N}.win sidecar of a binidx: doc_aligned_windows() for one ctx_len."""
+
+    _HDR_MAGIC = b"WINIDX\x00\x00\x00"
+
+    def __init__(self, path):
+        self._bin_buffer_mmap = np.memmap(path, mode="r", order="C")
+        self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        assert bytes(self._bin_buffer[:9]) == self._HDR_MAGIC, f"{path} is not a window index"
+        version, self.ctx_len, count = struct.unpack("<QQQ", self._bin_buffer[9:33])
+        assert version == 1
+        self.starts = np.frombuffer(self._bin_buffer, dtype=np.int64, count=count, offset=33)
+        self.lengths = np.frombuffer(self._bin_buffer, dtype=np.int32, count=count, offset=33 + self.starts.nbytes)
+
+    def __len__(self):
+        return self.starts.size
+
+    @classmethod
+    def write(cls, path, ctx_len, starts, lengths):
+        # write then rename, so ranks building the same sidecar never see half a file
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(cls._HDR_MAGIC)
+            f.write(struct.pack("<QQQ", 1, ctx_len, len(starts)))
+            f.write(np.asarray(starts, dtype=np.int64).tobytes(order="C"))
+            f.write(np.asarray(lengths, dtype=np.int32).tobytes(order="C"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, prefix_path, dataset, ctx_len, doc_filter=""):
+        """The sidecar of prefix_path, (re)built when missing or older than the .idx (and .meta).
+
+        doc_filter: a DocMetadata.select() predicate, the windows then only cover
+        the documents it keeps (one sidecar per predicate).
+        """
+        sources = [index_file_path(prefix_path)]
+        tag = ""
+        if doc_filter:
+            sources.append(doc_meta_file_path(prefix_path))
+            tag = hashlib.blake2b(doc_filter.encode("utf-8"), digest_size=4).hexdigest()
+        path = window_index_file_path(prefix_path, ctx_len, tag)
+        if not os.path.exists(path) or any(os.path.getmtime(path) < os.path.getmtime(p) for p in sources):
+            print_rank_0(f"    building {path}...")
+            doc_mask = DocMetadata(sources[-1]).select(doc_filter) if doc_filter else None
+            cls.write(path, ctx_len, *doc_aligned_windows(dataset._index, dataset.num_tokens, ctx_len, doc_mask))
+        return cls(path)
+
+
+# Columns of the .meta sidecar, one row per document of doc_idx:
+#   move    move number of the position in its game (1 = first move)
+#   game    game number, unique within the binidx
+#   source  index into the source names (input folder / file of the game)
+#   player  side to move, 0 black, 1 white, -1 none (e.g. the "X" end marker)
+#   winner  0 black, 1 white, -1 unknown / draw; winner == player is "won by the side to move"
+DOC_META_COLUMNS = (("move", np.int32), ("game", np.int64), ("source", np.int16), ("player", np.int8), ("winner", np.int8))
+
+
+class DocMetadata(object):
+    """Memmapped columnar per-document metadata of a binidx (the .meta sidecar)."""
+
+    _HDR_MAGIC = b"DOCMETA\x00\x00"
+
+    def __init__(self, path):
+        self._bin_buffer_mmap = np.memmap(path, mode="r", order="C")
+        self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        assert bytes(self._bin_buffer[:9]) == self._HDR_MAGIC, f"{path} is not a metadata sidecar"
+        version, self.n_docs, header_len = struct.unpack("<QQQ", self._bin_buffer[9:33])
+        assert version == 1
+        header = json.loads(bytes(self._bin_buffer[33:33 + header_len]))
+        self.sources = header["sources"]
+        self.columns = OrderedDict()
+        offset = _align8(33 + header_len)
+        for name, dtype in header["columns"]:
+            self.columns[name] = np.frombuffer(self._bin_buffer, dtype=np.dtype(dtype), count=self.n_docs, offset=offset)
+            offset = _align8(offset + self.columns[name].nbytes)
+
+    def __len__(self):
+        return self.n_docs
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def source_in(self, *names):
+        """Bool per document: is its source one of names."""
+        codes = [self.sources.index(n) for n in names if n in self.sources]
+        return np.isin(self.columns["source"], codes)
+
+    def select(self, predicate):
+        """Bool mask over documents from a vectorized predicate over the columns.
+
+        predicate is a callable taking this object, or an expression over the
+        column names, e.g. "(move <= 60) & (winner == player)" or
+        "source_in('katago') and move > 20". The expression is not eval'd:
+        only column names, numbers, comparisons, and / or / not (or & | ~),
+        + - * // % and source_in('name', ...) are accepted.
+        """
+        if callable(predicate):
+            mask = predicate(self)
+        else:
+            try:
+                tree = ast.parse(predicate.strip(), mode="eval")
+            except SyntaxError as e:
+                raise ValueError(f"bad metadata filter {predicate!r}: {e.msg}") from None
+            mask = self._eval_filter(tree.body, predicate)
+        mask = np.broadcast_to(np.asarray(mask, dtype=bool), (self.n_docs,))
+        return mask
+
+    _FILTER_OPS = {
+        ast.And: np.logical_and, ast.Or: np.logical_or, ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or,
+        ast.Not: np.logical_not, ast.Invert: np.logical_not, ast.USub: np.negative, ast.UAdd: np.positive,
+        ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.FloorDiv: np.floor_divide, ast.Mod: np.mod,
+        ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+        ast.Gt: np.greater, ast.GtE: np.greater_equal,
+    }
+
+    def _eval_filter(self, node, predicate):
+        ops = self._FILTER_OPS
+        if isinstance(node, ast.BoolOp) and type(node.op) in ops:
+            values = [self._eval_filter(v, predicate) for v in node.values]
+            return ops[type(node.op)].reduce([np.asarray(v, dtype=bool) for v in values])
+        if isinstance(node, ast.BinOp) and type(node.op) in ops:
+            return ops[type(node.op)](self._eval_filter(node.left, predicate), self._eval_filter(node.right, predicate))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in ops:
+            return ops[type(node.op)](self._eval_filter(node.operand, predicate))
+        if isinstance(node, ast.Compare) and all(type(op) in ops for op in node.ops):
+            left, mask = self._eval_filter(node.left, predicate), True
+            for op, right in zip(node.ops, node.comparators):  # a < b < c is (a < b) & (b < c)
+                right = self._eval_filter(right, predicate)
+                mask = np.logical_and(mask, ops[type(op)](left, right))
+                left = right
+            return mask
+        if isinstance(node, ast.Name) and node.id in self.columns:
+            return self.columns[node.id]
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float, bool):
+            return node.value
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "source_in"
+                and not node.keywords and all(isinstance(a, ast.Constant) and isinstance(a.value, str) for a in node.args)):
+            return self.source_in(*(a.value for a in node.args))
+        raise ValueError(f"bad metadata filter {predicate!r}: {ast.unparse(node)!r} is not allowed "
+                         f"(columns {', '.join(self.columns)}, numbers, comparisons, and/or/not, source_in('name'))")
+
+
+def _align8(n):
+    return (n + 7) // 8 * 8
+
+
+class DocMetadataBuilder(object):
+    """Collects DOC_META_COLUMNS row by row, call add() once per end_document()."""
+
+    def __init__(self, out_file):
+        self._out_file = out_file
+        self._columns = {name: array.array(np.dtype(dtype).char) for name, dtype in DOC_META_COLUMNS}
+        self._sources = {}
+
+    def add(self, move=0, game=-1, source="", player=-1, winner=-1):
+        code = self._sources.setdefault(source, len(self._sources))
+        for name, value in (("move", move), ("game", game), ("source", code), ("player", player), ("winner", winner)):
+            self._columns[name].append(value)
+
+    def finalize(self):
+        n_docs = len(self._columns["move"])
+        header = json.dumps({
+            "columns": [[name, np.dtype(dtype).str] for name, dtype in DOC_META_COLUMNS],
+            "sources": list(self._sources),
+        }).encode("utf-8")
+        tmp_path = f"{self._out_file}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(DocMetadata._HDR_MAGIC)
+            f.write(struct.pack("<QQQ", 1, n_docs, len(header)))
+            f.write(header)
+            for name, dtype in DOC_META_COLUMNS:
+                f.write(b"\x00" * (_align8(f.tell()) - f.tell()))
+                f.write(np.frombuffer(self._columns[name], dtype=dtype).tobytes(order="C"))
+        os.replace(tmp_path, self._out_file)
+
+
+class ShardedIndexedDataset(object):
+    """Several binidx shards read as one token stream, with per-shard sampling weights.
+
+    Like MyDataset's use of a single .bin, the concatenated shards are item 0:
+    get / read / read_windows / prefetch_range take global token offsets and
+    windows may cross shard boundaries. A window inside one shard is a zero-copy
+    view (get), windows across a boundary are stitched together.
+
+    locate() maps offsets of the weighted "virtual" stream, where shard s is
+    weight[s] times its real size, back to global offsets: weight 2 samples a
+    shard twice as often, 0.5 half as often, without rewriting any data.
+    """
+
+    def __init__(self, paths, weights=None, skip_warmup=False, access="normal"):
+        self._do_init(paths, weights, skip_warmup, access)
+
+    def __getstate__(self):
+        # like MMapIndexedDataset, every process maps the shards itself instead of pickling their tokens
+        return self.paths, self.weights.tolist(), self._skip_warmup, self._access, self._align
+
+    def __setstate__(self, state):
+        paths, weights, skip_warmup, access, align = state
+        self._do_init(paths, weights, skip_warmup, access)
+        if align is not None:
+            self.align_windows(*align)
+
+    def _do_init(self, paths, weights, skip_warmup, access):
+        self.paths = expand_data_files(paths)
+        assert self.paths, f"no binidx found for {paths}"
+        self._skip_warmup = skip_warmup
+        self._access = access
+        self._align = None
+        self.shards = [MMapIndexedDataset(p, skip_warmup, access) for p in self.paths]
+        self.dtype = self.shards[0]._index.dtype
+        assert all(d._index.dtype == self.dtype for d in self.shards), "all shards need the same dtype"
+        self.weights = np.asarray(parse_data_weights(weights, len(self.shards)), dtype=np.float64)
+        self.io_stats = np.zeros(len(IO_STAT_FIELDS), dtype=np.float64)
+
+        self.shard_tokens = np.array([d.num_tokens for d in self.shards], dtype=np.int64)
+        # starts[s] = global offset of shard s, starts[-1] = total tokens
+        self.starts = np.concatenate([[0], np.cumsum(self.shard_tokens)])
+        self.virtual_starts = np.concatenate([[0], np.cumsum(virtual_token_count(self.shard_tokens, self.weights))])
+        # raw shards are fancy-indexed directly, encoded ones decode window by window
+        self._tokens = [np.frombuffer(d._bin_buffer, dtype=self.dtype) if d._index.encoding == "raw" else None
+                        for d in self.shards]
+
+    @property
+    def num_tokens(self):
+        return int(self.starts[-1])
+
+    @property
+    def num_virtual_tokens(self):
+        return int(self.virtual_starts[-1])
+
+    def __len__(self):
+        return len(self.shards)
+
+    def locate(self, virtual_offsets, length=0):
+        """Global offsets of virtual offsets (int or array), kept length tokens away from the end."""
+        v = np.asarray(virtual_offsets, dtype=np.int64)
+        shard = np.searchsorted(self.virtual_starts, v, side="right") - 1
+        shard = np.clip(shard, 0, len(self.shards) - 1)
+        local = np.floor((v - self.virtual_starts[shard]) / self.weights[shard]).astype(np.int64)
+        return np.minimum(self.starts[shard] + local, self.num_tokens - length)
+
+    def align_windows(self, ctx_len, doc_filter=""):
+        """Load (or build) the doc-aligned window sidecar of every shard; returns the virtual window count.
+
+        Windows whose ctx_len + 1 read would run past the end of their shard are
+        left out. Shard weights apply to windows the way locate() applies them to
+        tokens. doc_filter keeps only the documents a predicate over the .meta
+        sidecars selects (see DocMetadata.select).
+        """
+        self._align = (ctx_len, doc_filter)
+        self.windows = [WindowIndex.load_or_build(p, d, ctx_len, doc_filter) for p, d in zip(self.paths, self.shards)]
+        self.window_counts = np.array(
+            [np.searchsorted(w.starts, n - (ctx_len + 1), side="right") for w, n in zip(self.windows, self.shard_tokens)],
+            dtype=np.int64,
+        )
+        self.virtual_window_starts = np.concatenate([[0], np.cumsum(virtual_token_count(self.window_counts, self.weights))])
+        return int(self.virtual_window_starts[-1])
+
+    def locate_windows(self, virtual_windows):
+        """(global offsets, lengths) of virtual window numbers (int or array), see align_windows()."""
+        v = np.asarray(virtual_windows, dtype=np.int64)
+        shard = np.searchsorted(self.virtual_window_starts, v, side="right") - 1
+        shard = np.clip(shard, 0, len(self.shards) - 1)
+        local = np.floor((v - self.virtual_window_starts[shard]) / self.weights[shard]).astype(np.int64)
+        local = np.minimum(local, self.window_counts[shard] - 1)
+        offsets = np.empty(v.shape, dtype=np.int64)
+        lengths = np.empty(v.shape, dtype=np.int64)
+        for s in np.unique(shard).tolist():
+            rows = shard == s
+            offsets[rows] = self.starts[s] + self.windows[s].starts[local[rows]]
+            lengths[rows] = self.windows[s].lengths[local[rows]]
+        return offsets, lengths
+
+    def get(self, idx=0, offset=0, length=None):
+        assert idx == 0, "sharded binidx is read as one stream"
+        if length is None:
+            length = self.num_tokens - offset
+        if offset < 0 or length < 0 or offset + length > self.num_tokens:
+            raise IndexError(f"tokens [{offset}, {offset + length}) out of range for {self.num_tokens} tokens "
+                             f"in {len(self.shards)} shards")
+        if length == 0:
+            return np.empty(0, dtype=self.dtype)
+        s = int(np.searchsorted(self.starts, offset, side="right")) - 1
+        local = offset - int(self.starts[s])
+        if local + length <= self.shard_tokens[s]:
+            return self.shards[s].tokens(local, length)  # zero-copy for raw shards
+        pieces = []
+        while length > 0 and s < len(self.shards):
+            piece = self.shards[s].tokens(local, min(length, int(self.shard_tokens[s]) - local))
+            pieces.append(piece)
+            length -= piece.size
+            s, local = s + 1, 0
+        return np.concatenate(pieces)
+
+    def read(self, idx=0, offset=0, length=None, stats=None):
+        stats = self.io_stats if stats is None else stats
+        faults = resource.getrusage(_RUSAGE_WHO).ru_majflt
+        t0 = time.perf_counter()
+        np_array = np.array(self.get(idx, offset, length))
+        _count_read(stats, t0, faults, 1, np_array.size)
+        return np_array
+
+    def read_windows(self, offsets, length, idx=0, stats=None):
+        """One fancy index per shard; the few windows crossing a shard boundary go through get()."""
+        assert idx == 0, "sharded binidx is read as one stream"
+        stats = self.io_stats if stats is None else stats
+        offsets = np.asarray(offsets, dtype=np.int64)
+        out = np.empty((offsets.size, length), dtype=self.dtype)
+        shard = np.searchsorted(self.starts, offsets, side="right") - 1
+        local = offsets - self.starts[shard]
+        inside = local + length <= self.shard_tokens[shard]
+        faults = resource.getrusage(_RUSAGE_WHO).ru_majflt
+        t0 = time.perf_counter()
+        for s in np.unique(shard[inside]).tolist():
+            rows = np.nonzero(inside & (shard == s))[0]
+            if self._tokens[s] is not None:
+                out[rows] = self._tokens[s][local[rows, None] + np.arange(length, dtype=np.int64)]
+            else:
+                for r in rows.tolist():
+                    out[r] = self.shards[s].tokens(int(local[r]), length)
+        for r in np.nonzero(~inside)[0].tolist():
+            out[r] = self.get(0, int(offsets[r]), length)
+        _count_read(stats, t0, faults, offsets.size, out.size)
+        return out
+
+    def prefetch_range(self, idx, offset, length):
+        assert idx == 0, "sharded binidx is read as one stream"
+        s = int(np.searchsorted(self.starts, offset, side="right")) - 1
+        local = offset - int(self.starts[s])
+        while length > 0 and s < len(self.shards):
+            n = min(length, int(self.shard_tokens[s]) - local)
+            self.shards[s].prefetch_range(0, local, n)
+            length -= n
+            s, local = s + 1, 0
+
+
+class BinidxPrefetcher(object):
+    """Background thread paging in the (idx, offset, length) ranges a sampler will ask for next.
+
+    submit() never blocks: when the thread is max_pending ranges behind,
+    new requests are dropped (and counted), the read will just fault normally.
+    """
+
+    def __init__(self, dataset, max_pending=64):
+        self.dataset = dataset
+        self.prefetched = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="binidx-prefetch", daemon=True)
+        self._thread.start()
+
+    def submit(self, idx, offset, length):
+        try:
+            self._queue.put_nowait((idx, offset, length))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.dataset.prefetch_range(*item)
+                self.prefetched += 1
+            except Exception:  # a hint only, never take the loader down
+                self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class MMapIndexedDatasetBuilder(object):
+    def __init__(self, out_file, dtype=np.uint16, encoding="raw", chunk_tokens=0, bits=9):
+        """encoding: "raw" (v1, default), "packed" (`bits` bits per token), "zlib" or "lzma"."""
+        assert encoding in ENCODINGS, encoding
+        self._data_file = open(out_file, "wb")
+        self._dtype = dtype
+        self._sizes = []
+        self._doc_idx = [0]
+        self._encoding = encoding
+        self._bits = bits if encoding == "packed" else 0
+        self._chunk_tokens = chunk_tokens or DEFAULT_CHUNK_TOKENS[encoding]
+        # packed chunks must end on a byte boundary to form one bit stream
+        assert encoding != "packed" or self._chunk_tokens % 8 == 0
+        self._pending = []
+        self._n_pending = 0
+        self._n_tokens = 0
+        self._chunk_offsets = [0]
+
+    def add_item(self, np_array):
+        assert np_array.dtype == self._dtype
+        self._sizes.append(np_array.size)
+        if self._encoding == "raw":
+            self._data_file.write(np_array.tobytes(order="C"))
+            return
+        if self._encoding == "packed" and np_array.size:
+            assert int(np_array.max()) < (1 << self._bits), f"token {np_array.max()} needs more than {self._bits} bits"
+        self._pending.append(np_array)
+        self._n_pending += np_array.size
+        while self._n_pending >= self._chunk_tokens:
+            self._flush(self._chunk_tokens)
+
+    def _flush(self, n):
+        data = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        chunk, rest = data[:n], data[n:]
+        self._pending = [rest] if rest.size else []
+        self._n_pending = rest.size
+        payload = _encode_chunk(chunk, self._encoding, self._bits)
+        self._data_file.write(payload)
+        self._chunk_offsets.append(self._chunk_offsets[-1] + len(payload))
+        self._n_tokens += chunk.size
+
+    def end_document(self):
+        self._doc_idx.append(len(self._sizes))
+
+    def finalize(self, index_file):
+        if self._n_pending:
+            self._flush(self._n_pending)
+        self._data_file.close()
+        with MMapIndexedDataset.Index.writer(index_file, self._dtype, self._encoding, self._bits,
+                                             self._chunk_tokens if self._encoding != "raw" else 0) as index:
+            if self._encoding == "raw":
+                index.write(self._sizes, self._doc_idx)
+            else:
+                # the packed stream is addressed by bit position, only zlib / lzma need chunk offsets
+                chunk_offsets = self._chunk_offsets if self._encoding in ("zlib", "lzma") else ()
+                index.write(self._sizes, self._doc_idx, self._n_tokens, chunk_offsets)
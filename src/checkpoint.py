@@ -0,0 +1,184 @@
+########################################################################################################
+# Asynchronous checkpoint saving
+########################################################################################################
+#
+# AsyncCheckpointer.save() copies the state dict into pinned CPU buffers (allocated once, reused by
+# every save) with non-blocking copies, and returns. A background thread waits for the copies, writes
+# ff + ".tmp" and renames it to ff, so a crash never leaves a truncated rwkv-N.pth behind. Training
+# continues while the file is written; the next save waits only if the previous one is still running.
+#
+# Each checkpoint gets a sidecar rwkv-N.json (step, loss, data position, ...), and with keep_last > 0
+# only the newest keep_last numbered checkpoints rwkv-N.pth are kept (rwkv-init / rwkv-final never go).
+#
+# With --step_save S, train_callback also writes rwkv-step-{global step}.pth every S steps, and every
+# checkpoint gets the optimizer state of each rank ({stem}-optim-rank{R}.pt). train.py resumes from
+# the checkpoint with the highest global step: MyDataset sampling is a function of (epoch, idx, rank),
+# so skipping the steps already done in that epoch continues exactly at the next sample.
+
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import torch
+from pytorch_lightning.utilities import rank_zero_info
+
+CHECKPOINT_RE = re.compile(r"rwkv-(\d+)\.pth$")
+STEP_CHECKPOINT_RE = re.compile(r"rwkv-step-(\d+)\.pth$")
+
+
+def sidecar_path(ff):
+    return os.path.splitext(ff)[0] + ".json"
+
+
+def write_sidecar(ff, meta):
+    tmp = sidecar_path(ff) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, sidecar_path(ff))
+
+
+def read_sidecar(ff):
+    """The sidecar of checkpoint ff, or None."""
+    try:
+        with open(sidecar_path(ff)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def optim_state_path(ff, rank):
+    """Optimizer state of `rank` saved with checkpoint ff."""
+    return f"{os.path.splitext(ff)[0]}-optim-rank{rank}.pt"
+
+
+def _numbered(proj_dir, pattern):
+    found = []
+    for p in glob.glob(f"{proj_dir}/rwkv-*.pth"):
+        m = pattern.search(os.path.basename(p))
+        if m:
+            found.append((int(m.group(1)), p))
+    return sorted(found)
+
+
+def _remove_checkpoint(p):
+    for q in [p, sidecar_path(p)] + glob.glob(optim_state_path(p, "*")):
+        if os.path.exists(q):
+            os.remove(q)
+
+
+def prune_checkpoints(proj_dir, keep_last):
+    """Delete all but the newest keep_last rwkv-N.pth (and their sidecars / optimizer states)."""
+    found = _numbered(proj_dir, CHECKPOINT_RE)
+    for _, p in found[:-keep_last] if keep_last > 0 else []:
+        _remove_checkpoint(p)
+
+
+def prune_step_checkpoints(proj_dir, keep):
+    """Delete all but the newest `keep` rwkv-step-S.pth: they are only there to resume from."""
+    for _, p in _numbered(proj_dir, STEP_CHECKPOINT_RE)[:-keep]:
+        _remove_checkpoint(p)
+
+
+def list_checkpoints(proj_dir, epoch_steps):
+    """[(global step, path)] of the checkpoints to resume from, oldest first: rwkv-init is step 0,
+    rwkv-N the end of epoch N (or the step in its sidecar: a run stopped by max_steps saves it
+    mid-epoch), rwkv-step-S step S. Optimizer states may be saved later than the .pth by the other
+    ranks, resume_optim_state checks them."""
+    found = [(0, f"{proj_dir}/rwkv-init.pth")] if os.path.exists(f"{proj_dir}/rwkv-init.pth") else []
+    for n, p in _numbered(proj_dir, CHECKPOINT_RE):
+        meta = read_sidecar(p)
+        found.append((meta["global_step"] if meta else (n + 1) * epoch_steps, p))
+    # a step checkpoint counts once its sidecar (written last) is there
+    found += [(s, p) for s, p in _numbered(proj_dir, STEP_CHECKPOINT_RE) if os.path.exists(sidecar_path(p))]
+    # on a tie the epoch checkpoint wins, it is the one kept by --keep_last
+    return sorted(found, key=lambda sp: (sp[0], "rwkv-step-" not in sp[1]))
+
+
+def resume_optim_state(ff, world_size):
+    """True when every rank's optimizer state of checkpoint ff is there, for the same world size."""
+    meta = read_sidecar(ff)
+    if meta is None or meta.get("world_size") != world_size:
+        return False
+    return all(os.path.exists(optim_state_path(ff, r)) for r in range(world_size))
+
+
+def load_optim_state(optimizer, ff, rank, world_size):
+    """Restore the optimizer state saved with checkpoint ff into this rank's optimizer."""
+    if hasattr(optimizer, "_restore_from_elastic_fp32_weights"):
+        # DeepSpeed ZeRO 1/2: a list of every rank's partition, the fp32 master weights come from it
+        states = [torch.load(optim_state_path(ff, r), map_location="cpu") for r in range(world_size)]
+        optimizer.load_state_dict(states, load_from_fp32_weights=True)
+    else:
+        optimizer.load_state_dict(torch.load(optim_state_path(ff, rank), map_location="cpu"))
+
+
+class AsyncCheckpointer(object):
+    def __init__(self, proj_dir, keep_last=0, keep_steps=2):
+        self.proj_dir = proj_dir
+        self.keep_last = keep_last
+        self.keep_steps = keep_steps
+        self.pin = torch.cuda.is_available()
+        self._buffers = {}
+        self._thread = None
+        self.error = None
+
+    def _copy(self, v, key):
+        """v with its tensors copied into the reusable CPU buffers (nested dicts / lists, as in optimizer states)."""
+        if isinstance(v, dict):
+            return {k: self._copy(x, key + (k,)) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return type(v)(self._copy(x, key + (i,)) for i, x in enumerate(v))
+        if not torch.is_tensor(v):
+            return v
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != v.shape or buf.dtype != v.dtype:
+            buf = torch.empty(v.shape, dtype=v.dtype, device="cpu", pin_memory=self.pin and v.is_cuda)
+            self._buffers[key] = buf
+        buf.copy_(v.detach(), non_blocking=buf.is_pinned())
+        return buf
+
+    def _snapshot(self, dd):
+        """Copies dd into the reusable CPU buffers; returns (cpu state dict, CUDA event or None)."""
+        out = self._copy(dd, ())
+        event = None
+        if self.pin:
+            event = torch.cuda.Event()
+            event.record()
+        return out, event
+
+    def _write(self, out, event, ff, meta):
+        try:
+            if event is not None:
+                event.synchronize()
+            t0 = time.perf_counter()
+            tmp = ff + ".tmp"
+            torch.save(out, tmp)
+            os.replace(tmp, ff)
+            if meta is not None:
+                meta = dict(meta, save_seconds=round(time.perf_counter() - t0, 3))
+                write_sidecar(ff, meta)
+                if self.keep_last > 0:
+                    prune_checkpoints(self.proj_dir, self.keep_last)
+                prune_step_checkpoints(self.proj_dir, self.keep_steps)
+        except Exception as e:  # reported by the next save / wait
+            self.error = (ff, e)
+
+    def wait(self):
+        """Block until the checkpoint being written (if any) is on disk."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            ff, e = self.error
+            self.error = None
+            rank_zero_info(f"Error saving {ff}\n\n{e}\n\n")
+
+    def save(self, dd, ff, meta=None):
+        """Snapshot dd and write it to ff in the background. Returns once dd may be modified again."""
+        self.wait()  # the buffers are reused
+        out, event = self._snapshot(dd)
+        self._thread = threading.Thread(target=self._write, args=(out, event, ff, meta), daemon=False)
+        self._thread.start()
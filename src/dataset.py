@@ -1,25 +1,17 @@
+import bisect
 import math
 import json
+import os
+import numpy as np
 import torch
 from pytorch_lightning.utilities import rank_zero_info
 from torch.utils.data import Dataset
 
-from .binidx import MMapIndexedDataset
+from .binidx import IO_STAT_FIELDS, BinidxPrefetcher, MMapIndexedDataset, ShardedIndexedDataset
+from .magic_prime import is_prime
 
-
-def is_prime(n):
-    if n <= 1:
-        return False
-    if n <= 3:
-        return True
-    if n % 2 == 0 or n % 3 == 0:
-        return False
-    i = 5
-    while i * i <= n:
-        if n % i == 0 or n % (i + 2) == 0:
-            return False
-        i += 6
-    return True
+# F.cross_entropy's default ignore_index
+IGNORE_INDEX = -100
 
 
 class MyDataset(Dataset):
@@ -30,48 +22,369 @@ class MyDataset(Dataset):
         rank_zero_info(
             f"Current vocab size = {self.vocab_size} (make sure it's correct)")
 
-        self.data = MMapIndexedDataset(args.data_file)
-        self.data_size = len(
-            self.data._bin_buffer) // self.data._index._dtype_size
+        # --data_file can list several shards ("a,b" or a glob), sampled by --data_weights
+        self.data = ShardedIndexedDataset(args.data_file, args.data_weights, access=args.data_access)
+        # IO counters of all loader workers (see binidx.IO_STAT_FIELDS), shared so the trainer can log them
+        self.io_stats = torch.zeros(len(IO_STAT_FIELDS), dtype=torch.float64).share_memory_()
+        # [global_rank, real_epoch, world_size, skip_samples], shared so persistent workers see what
+        # train_callback sets at every epoch start
+        self._sampling_state = torch.tensor([0, 0, 1, 0], dtype=torch.int64).share_memory_()
+        self._ring = None
+        self._ring_pid = None
+        self._prefetcher = None
+        self._prefetcher_pid = None
+        self._prefetched_epoch = None
+        self.data_size = self.data.num_virtual_tokens
+        if len(self.data) > 1:
+            for path, tokens, weight in zip(self.data.paths, self.data.shard_tokens, self.data.weights):
+                rank_zero_info(f"  shard {path}: {tokens} tokens, weight {weight}")
         rank_zero_info(f"Data has {self.data_size} tokens.")
 
         self.samples_per_epoch = args.epoch_steps * args.real_bsz
         assert self.samples_per_epoch == 40320
         rank_zero_info(f"########## train stage {args.train_stage} ##########")
-        dataset_slot = self.data_size // args.ctx_len
+        # --data_align doc: samples are whole positions packed into ctx_len (the .ctx{N}.win
+        # sidecar next to the .idx) instead of windows on a fixed ctx_len grid.
+        # --data_filter keeps only the positions a predicate over the .meta sidecar selects
+        self.aligned = args.data_align == "doc" or bool(args.data_filter)
+        if self.aligned:
+            dataset_slot = self.data.align_windows(args.ctx_len, args.data_filter)
+            rank_zero_info(f"Data has {dataset_slot} doc-aligned windows"
+                           + (f" for {args.data_filter!r}." if args.data_filter else "."))
+        else:
+            dataset_slot = self.data_size // args.ctx_len
+        self.n_windows = dataset_slot
 
         assert is_prime(args.magic_prime)
         assert args.magic_prime % 3 == 2
         assert args.magic_prime / dataset_slot > 0.9 and args.magic_prime / dataset_slot <= 1
 
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_prefetcher"] = None  # threads stay in their process
+        state["_ring"] = None
+        return state
+
+    @property
+    def global_rank(self):
+        return int(self._sampling_state[0])
+
+    @global_rank.setter
+    def global_rank(self, value):
+        self._sampling_state[0] = value
+
+    @property
+    def real_epoch(self):
+        return int(self._sampling_state[1])
+
+    @real_epoch.setter
+    def real_epoch(self, value):
+        self._sampling_state[1] = value
+
+    @property
+    def world_size(self):
+        return int(self._sampling_state[2])
+
+    @world_size.setter
+    def world_size(self, value):
+        self._sampling_state[2] = value
+
+    @property
+    def skip_samples(self):
+        """Samples of this epoch already trained before a mid-epoch resume: the epoch starts after them."""
+        return int(self._sampling_state[3])
+
+    @skip_samples.setter
+    def skip_samples(self, value):
+        self._sampling_state[3] = value
+
     def __len__(self):
-        return self.args.epoch_steps * self.args.micro_bsz
+        return self.args.epoch_steps * self.args.micro_bsz - self.skip_samples
 
-    def __getitem__(self, idx):
+    def _slots(self, indices):
+        """Sample slots for sample indices (int or array), vectorized.
+
+        Same as (factor * ii**3) % magic_prime, but reduced mod magic_prime
+        after every product so it stays in int64.
+        """
         args = self.args
         rank = self.global_rank
         epoch = self.real_epoch
         world_size = self.world_size
 
-        ctx_len = args.ctx_len
-        req_len = ctx_len + 1
         magic_prime = args.magic_prime
 
-        ii = 1 + epoch * self.samples_per_epoch + (idx * world_size) + rank
-
         factor = (math.sqrt(5) - 1) / 2
         factor = int(magic_prime * factor)
-        i = ((factor * ii * ii * ii) % magic_prime) * ctx_len
+        # products of two residues must fit in int64, else fall back to Python ints
+        dtype = np.int64 if magic_prime < 2**31 else object
+
+        ii = 1 + epoch * self.samples_per_epoch + (np.asarray(indices, dtype=dtype) * world_size) + rank
+        ii %= magic_prime
+        return np.asarray(ii * ii % magic_prime * ii % magic_prime * factor % magic_prime).astype(np.int64)
+
+    def _stream_position(self, indices):
+        """Window within its --tbptt stream of sample indices: step s of the epoch trains window s % tbptt."""
+        return (np.asarray(indices, dtype=np.int64) // self.args.micro_bsz) % self.args.tbptt
 
+    def _window_slots(self, indices):
+        """Window numbers of sample indices. With --tbptt K, row r of the K steps of a stream reads the K
+        consecutive windows after the slot of the stream's first sample (row r of its first step)."""
+        K = self.args.tbptt
+        if K <= 1:
+            return self._slots(indices)
+        indices = np.asarray(indices, dtype=np.int64)
+        w = self._stream_position(indices)
+        first = np.minimum(self._slots(indices - w * self.args.micro_bsz), self.n_windows - K)
+        return first + w
 
-        dix = self.data.get(idx=0, offset=i, length=req_len).astype(int)
+    def _windows(self, indices):
+        """(token offsets, lengths) of the windows for sample indices; lengths < ctx_len + 1 only when aligned."""
+        ctx_len = self.args.ctx_len
+        if self.aligned:
+            return self.data.locate_windows(self._window_slots(indices))
+        # offset in the weighted stream -> offset in the shards
+        offsets = self.data.locate(self._window_slots(indices) * ctx_len, ctx_len + 1)
+        return offsets, np.full(offsets.shape, ctx_len + 1, dtype=np.int64)
+
+    def _offsets(self, indices):
+        return self._windows(indices)[0]
+
+    def _prefetch_ahead(self, idx, req_len):
+        ahead = self.args.data_prefetch
+        if ahead <= 0:
+            return
+        if self._prefetcher is None or self._prefetcher_pid != os.getpid():
+            self._prefetcher = BinidxPrefetcher(self.data, max_pending=2 * ahead)
+            self._prefetcher_pid = os.getpid()
+            self._prefetched_epoch = None
+        if self._prefetched_epoch != self.real_epoch:
+            self._prefetched_epoch = self.real_epoch
+            self._prefetched_until = idx
+        # the sampler is sequential, so idx + 1 ... idx + ahead come next
+        start = max(idx + 1, self._prefetched_until + 1)
+        stop = min(idx + ahead, self.args.epoch_steps * self.args.micro_bsz - 1) + 1
+        if start < stop:
+            for offset in self._offsets(np.arange(start, stop)).tolist():
+                self._prefetcher.submit(0, offset, req_len)
+        self._prefetched_until = max(self._prefetched_until, idx + ahead)
+
+    def __getitem__(self, idx):
+        req_len = self.args.ctx_len + 1
+        idx += self.skip_samples
+        i, n = self._windows(idx)
+        self._prefetch_ahead(idx, req_len)
+
+        dix = self.data.read(idx=0, offset=int(i), length=req_len, stats=self.io_stats.numpy()).astype(int)
 
         x = torch.tensor(dix[:-1], dtype=torch.long)
         y = torch.tensor(dix[1:], dtype=torch.long)
+        y[int(n) - 1:] = IGNORE_INDEX  # tokens after an aligned window
 
+        if self.args.tbptt > 1:
+            return x, y, torch.tensor(int(self._stream_position(idx)))
         return x, y
-    
+
+    def __getitems__(self, indices):
+        """Whole micro-batch at once: returns the collated (x, y) (and the --tbptt window), use with collate_batch."""
+        req_len = self.args.ctx_len + 1
+        indices = np.asarray(indices) + self.skip_samples
+        self._prefetch_ahead(int(indices.max()), req_len)
+
+        offsets, lengths = self._windows(indices)
+        dix = self.data.read_windows(offsets, req_len, stats=self.io_stats.numpy())
+
+        x, y = self._batch_buffers(len(indices))
+        np.copyto(x.numpy(), dix[:, :-1], casting="unsafe")
+        np.copyto(y.numpy(), dix[:, 1:], casting="unsafe")
+        if self.aligned:
+            # targets past the end of a window belong to the next position, F.cross_entropy skips them
+            y.numpy()[np.arange(req_len - 1) >= lengths[:, None] - 1] = IGNORE_INDEX
+
+        if self.args.tbptt > 1:
+            return x, y, torch.from_numpy(self._stream_position(indices))
+        return x, y
+
+    def _batch_buffers(self, batch_size):
+        """Next (x, y) slot of this worker's shared-memory ring.
+
+        Tensors sent from a worker normally get a fresh shared-memory segment per
+        batch; reusing a fixed ring lets the main process map every slot once. A
+        slot comes back after data_prefetch_factor + 3 batches, by then the main
+        process has pinned / copied it (prefetch_factor in flight, plus the one being
+        pinned, the one Lightning prefetches and the one being trained on).
+        """
+        shape = (batch_size, self.args.ctx_len)
+        if torch.utils.data.get_worker_info() is None or batch_size != self.args.micro_bsz:
+            return torch.empty(shape, dtype=torch.long), torch.empty(shape, dtype=torch.long)
+        if self._ring is None or self._ring_pid != os.getpid():
+            n_slots = self.args.data_prefetch_factor + 3
+            self._ring = [
+                (torch.empty(shape, dtype=torch.long).share_memory_(), torch.empty(shape, dtype=torch.long).share_memory_())
+                for _ in range(n_slots)
+            ]
+            self._ring_pid = os.getpid()
+            self._ring_next = 0
+        slot = self._ring[self._ring_next]
+        self._ring_next = (self._ring_next + 1) % len(self._ring)
+        return slot
+
+
+def collate_batch(batch):
+    """collate_fn for datasets whose __getitems__ already returns the batch."""
+    return batch
+
+
+# SFT batches are padded to a multiple of this (of the CUDA kernel's CHUNK_LEN, and
+# few enough distinct shapes for torch.compile)
+SFT_LENGTH_MULTIPLE = 64
+
+
+def chat_prompt(tokenizer, conversations):
+    """ChatML text of a conversation, turns alternate user / assistant."""
+    messages = []
+    for i, turn in enumerate(conversations):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        messages.append({"role": role, "content": turn['content']})
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=False
+    )
+
+
+def assistant_spans(input_ids, bos_id, eos_id):
+    """[start, end) ranges of input_ids trained on: every assistant reply up to and including its eos.
+
+    Same rule as SFTDataset's loss mask: from one token after bos to the end of eos.
+    """
+    spans = []
+    n, nb, ne = len(input_ids), len(bos_id), len(eos_id)
+    i = 0
+    while i < n:
+        if input_ids[i:i + nb] == bos_id:
+            start = end = i + nb
+            while end < n and input_ids[end:end + ne] != eos_id:
+                end += 1
+            if start + 1 < min(end + ne, n):
+                spans.append((start + 1, min(end + ne, n)))
+            i = end + ne if end < n else n
+        else:
+            i += 1
+    return spans
+
+
+class TokenizedSFTDataset(Dataset):
+    """SFT samples tokenized once by data/make_sft_data.py, served in whole micro-batches.
+
+    <data_file>.bin/idx holds the tokens of every sample, <data_file>.mask.bin/idx
+    the [start, end) token spans the loss is computed on. Batches are planned
+    once from the sizes alone:
+
+    bucket  micro_bsz samples of similar length per batch, padded to the longest
+    pack    samples packed best-fit into rows of ctx_len + 1 tokens (the state
+            carries over between samples of a row, like the eod-separated pretraining data)
+
+    and padded to a multiple of SFT_LENGTH_MULTIPLE instead of ctx_len. Targets
+    outside the spans are IGNORE_INDEX. The batch order is reshuffled every epoch.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.data = MMapIndexedDataset(args.data_file)
+        self.spans = MMapIndexedDataset(args.data_file + ".mask")
+        assert len(self.spans) == len(self.data)
+        self.vocab_size = args.vocab_size
+        self._sampling_state = torch.tensor([0, 0, 1, 0], dtype=torch.int64).share_memory_()
+
+        sizes = np.minimum(self.data.sizes.astype(np.int64), args.ctx_len + 1)
+        if args.sft_batching == "pack":
+            self.rows = self._pack(sizes, args.ctx_len + 1)
+        else:
+            self.rows = self._buckets(sizes, args.micro_bsz)
+        self.row_tokens = np.array([sizes[row].sum() for row in self.rows], dtype=np.int64)
+        self.n_batches = len(self.rows) // args.micro_bsz
+        # input positions per row (tokens - 1) and per batch once padded
+        used = np.maximum(self.row_tokens[: self.n_batches * args.micro_bsz] - 1, 1).reshape(self.n_batches, -1)
+        padded = np.minimum((used.max(1) + SFT_LENGTH_MULTIPLE - 1) // SFT_LENGTH_MULTIPLE * SFT_LENGTH_MULTIPLE, args.ctx_len)
+        rank_zero_info(
+            f"SFT data: {len(self.data)} samples, {sizes.sum()} tokens in {len(self.rows)} rows, "
+            f"{self.n_batches} batches ({args.sft_batching}), "
+            f"{100.0 * used.sum() / max(padded.sum() * args.micro_bsz, 1):.1f}% of the padded positions are real"
+        )
+
+    @staticmethod
+    def _buckets(sizes, batch_size):
+        # random order within equal lengths, then sorted: neighbours have about the same length
+        order = np.random.default_rng(0).permutation(len(sizes))
+        order = order[np.argsort(sizes[order], kind="stable")]
+        return [[i] for i in order.tolist()]
+
+    @staticmethod
+    def _pack(sizes, capacity):
+        """Best-fit decreasing: every sample goes to the fullest row it still fits in."""
+        rows = []
+        free = []  # sorted (free tokens, row)
+        for i in np.argsort(-sizes, kind="stable").tolist():
+            n = int(sizes[i])
+            j = bisect.bisect_left(free, (n, -1))
+            if j < len(free):
+                room, r = free.pop(j)
+            else:
+                room, r = capacity, len(rows)
+                rows.append([])
+            rows[r].append(i)
+            if room - n > 0:
+                bisect.insort(free, (room - n, r))
+        # rows are shuffled so batches mix full and partial rows
+        order = np.random.default_rng(0).permutation(len(rows))
+        return [rows[r] for r in order.tolist()]
+
+    global_rank = MyDataset.global_rank
+    real_epoch = MyDataset.real_epoch
+    world_size = MyDataset.world_size
+    skip_samples = MyDataset.skip_samples
+
+    def __len__(self):
+        # every rank walks its own share of the batches
+        steps = self.n_batches * self.args.micro_bsz // self.args.real_bsz
+        return steps * self.args.micro_bsz - self.skip_samples
+
+    def _batch(self, b):
+        """Rows of the b-th batch this rank sees in the current epoch."""
+        order = np.random.default_rng(self.real_epoch).permutation(self.n_batches)
+        batch = int(order[(b * self.world_size + self.global_rank) % self.n_batches])
+        return self.rows[batch * self.args.micro_bsz:(batch + 1) * self.args.micro_bsz]
+
+    def _collate(self, rows):
+        fill = max(int(sum(self.data.sizes[i] for i in row)) for row in rows) - 1
+        T = min((max(fill, 1) + SFT_LENGTH_MULTIPLE - 1) // SFT_LENGTH_MULTIPLE * SFT_LENGTH_MULTIPLE, self.args.ctx_len)
+        x = np.zeros((len(rows), T), dtype=np.int64)
+        y = np.full((len(rows), T), IGNORE_INDEX, dtype=np.int64)
+        for r, row in enumerate(rows):
+            pos = 0
+            for i in row:
+                tokens = self.data.get(i)[: self.args.ctx_len + 1]
+                n = min(tokens.size, T + 1 - pos)
+                x[r, pos:pos + n - 1] = tokens[:n - 1]
+                for start, end in self.spans.get(i).reshape(-1, 2).tolist():
+                    end = min(end, n)
+                    if start < end:
+                        y[r, pos + start - 1:pos + end - 1] = tokens[start:end]
+                pos += n
+        return torch.from_numpy(x), torch.from_numpy(y)
+
+    def __getitem__(self, idx):
+        b, r = divmod(idx + self.skip_samples, self.args.micro_bsz)
+        x, y = self._collate(self._batch(b)[r:r + 1])
+        return x[0], y[0]
+
+    def __getitems__(self, indices):
+        """The whole micro-batch of indices (consecutive, from the DataLoader's batch sampler)."""
+        return self._collate(self._batch((indices[0] + self.skip_samples) // self.args.micro_bsz))
+
+
 class SFTDataset(Dataset):
     def __init__(self, jsonl_path, tokenizer, max_length=1024):
         super().__init__()
@@ -94,15 +407,7 @@ class SFTDataset(Dataset):
 
     def _create_chat_prompt(self, conversations):
         """构建符合ChatML格式的对话"""
-        messages = []
-        for i, turn in enumerate(conversations):
-            role = 'user' if i % 2 == 0 else 'assistant'
-            messages.append({"role": role, "content": turn['content']})
-        return self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=False
-        )
+        return chat_prompt(self.tokenizer, conversations)
 
     # def _generate_loss_mask(self, input_ids):
     #     loss_mask = [0] * len(input_ids)
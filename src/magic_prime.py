@@ -0,0 +1,73 @@
+import os
+
+from .binidx import (
+    MMapIndexedDataset,
+    ShardedIndexedDataset,
+    data_file_path,
+    expand_data_files,
+    index_file_path,
+    parse_data_weights,
+    virtual_token_count,
+)
+
+# Deterministic Miller-Rabin: these bases are exact for every n < 3.3e24
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+
+def is_prime(n):
+    if n < 2:
+        return False
+    for p in _MR_BASES:
+        if n % p == 0:
+            return n == p
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in _MR_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def largest_magic_prime(upper):
+    """Largest prime p <= upper with p % 3 == 2, or 0 if there is none."""
+    p = upper - (upper - 2) % 3  # step over the p % 3 == 2 candidates only
+    while p >= 2:
+        if is_prime(p):
+            return p
+        p -= 3
+    return 0
+
+
+def binidx_num_tokens(path):
+    """Token count of a binidx from the .bin size and the .idx header, nothing is mmapped."""
+    with open(index_file_path(path), "rb") as stream:
+        header = MMapIndexedDataset.Index.read_header(stream)
+    if header.encoding != "raw":
+        return header.num_tokens
+    return os.path.getsize(data_file_path(path)) // header.dtype().itemsize
+
+
+def compute_magic_prime(path, ctx_len, weights=None, align="none", doc_filter=""):
+    """(magic_prime, data_size) for --magic_prime / --my_exit_tokens of a binidx at ctx_len.
+
+    path can also be several shards ("a,b" or a glob), data_size is then the
+    weighted token count ShardedIndexedDataset samples from. With align="doc"
+    or a doc_filter the slots are the doc-aligned windows (the .win sidecars
+    are built if needed).
+    """
+    paths = expand_data_files(path)
+    tokens = [binidx_num_tokens(p) for p in paths]
+    data_size = int(virtual_token_count(tokens, parse_data_weights(weights, len(paths))).sum())
+    if align == "doc" or doc_filter:
+        n_windows = ShardedIndexedDataset(paths, weights, skip_warmup=True).align_windows(ctx_len, doc_filter)
+        return largest_magic_prime(n_windows), data_size
+    return largest_magic_prime(data_size // ctx_len - 1), data_size
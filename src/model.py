@@ -11,10 +11,8 @@ import pytorch_lightning as pl
 import torch
 import torch.nn as nn
 from pytorch_lightning.strategies import DeepSpeedStrategy
-from rwkvfla.modules.token_shift import token_shift
-from rwkvfla.ops.rwkv7.fused_addcmul import fused_addcmul_rwkv7
-from rwkvfla.ops.rwkv7.fused_k_update import fused_k_rwkv7
 from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint as torch_checkpoint
 from torch.utils.cpp_extension import load
 
 if importlib.util.find_spec("deepspeed"):
@@ -44,7 +42,26 @@ if os.environ["RWKV_COMPILE_ON"] == "1":
 
 HEAD_SIZE = int(os.environ["RWKV_HEAD_SIZE"])
 
-if "x070" in os.environ["RWKV_MY_TESTING"]:
+# cuda = cuda/wkv7_cuda.cu + rwkvfla Triton ops, torch = src/wkv7_torch.py (any device, autograd)
+WKV_BACKEND = os.environ.get("RWKV_WKV_BACKEND", "auto")
+if WKV_BACKEND == "auto":
+    WKV_BACKEND = "cuda" if torch.cuda.is_available() else "torch"
+print(f"RWKV_WKV_BACKEND {WKV_BACKEND}")
+
+if WKV_BACKEND == "cuda":
+    from rwkvfla.modules.token_shift import token_shift
+    from rwkvfla.ops.rwkv7.fused_addcmul import fused_addcmul_rwkv7
+    from rwkvfla.ops.rwkv7.fused_k_update import fused_k_rwkv7
+else:
+    from .wkv7_torch import RUN_TORCH_RWKV7g, RUN_TORCH_RWKV7s, fused_addcmul_rwkv7, fused_k_rwkv7, token_shift
+
+    def RUN_CUDA_RWKV7g(q, w, k, v, a, b):
+        return RUN_TORCH_RWKV7g(q, w, k, v, a, b, HEAD_SIZE)
+
+    def RUN_CUDA_RWKV7s(q, w, k, v, a, b, s0):
+        return RUN_TORCH_RWKV7s(q, w, k, v, a, b, s0, HEAD_SIZE)
+
+if "x070" in os.environ["RWKV_MY_TESTING"] and WKV_BACKEND == "cuda":
     CHUNK_LEN = 16
 
     if ROCm_flag is True:
@@ -106,16 +123,58 @@ if "x070" in os.environ["RWKV_MY_TESTING"]:
             dw, dq, dk, dv, dz, db = [torch.empty_like(x) for x in [
                 w, q, k, v, z, b]]
             torch.ops.wind_backstepping.backward(
-                w, q, k, v, z, b, dy, s, sa, dw, dq, dk, dv, dz, db
-            )
+                w, q, k, v, z, b, dy, s, sa, dw, dq, dk, dv, dz, db)
             return dw, dq, dk, dv, dz, db
 
+    class WindBacksteppingState(torch.autograd.Function):
+        # s0: initial state (B, H, C, C) in fp32, S[value][key] as in src/wkv7_torch.py; also returns the final state
+        @staticmethod
+        def forward(ctx, w, q, k, v, z, b, s0):
+            B, T, H, C = w.shape
+            assert T % CHUNK_LEN == 0
+            assert all(i.dtype == torch.bfloat16 for i in [w, q, k, v, z, b])
+            assert all(i.is_contiguous() for i in [w, q, k, v, z, b])
+            assert s0.dtype == torch.float32 and s0.is_contiguous()
+            y = torch.empty_like(v)
+            s = torch.empty(
+                B, H, T // CHUNK_LEN, C, C, dtype=torch.float32, device=w.device
+            )
+            sa = torch.empty(B, T, H, C, dtype=torch.float32, device=w.device)
+            sT = torch.empty_like(s0)
+            torch.ops.wind_backstepping.forward_s(w, q, k, v, z, b, y, s, sa, s0, sT)
+            ctx.save_for_backward(w, q, k, v, z, b, s, sa)
+            return y, sT
+
+        @staticmethod
+        def backward(ctx, dy, dsT):
+            assert all(i.dtype == torch.bfloat16 for i in [dy])
+            assert all(i.is_contiguous() for i in [dy])
+            w, q, k, v, z, b, s, sa = ctx.saved_tensors
+            B, T, H, C = w.shape
+            if dsT is None:
+                dsT = torch.zeros(B, H, C, C, dtype=torch.float32, device=w.device)
+            dw, dq, dk, dv, dz, db = [torch.empty_like(x) for x in [
+                w, q, k, v, z, b]]
+            ds0 = torch.empty_like(dsT)
+            torch.ops.wind_backstepping.backward_s(
+                w, q, k, v, z, b, dy, s, sa, dw, dq, dk, dv, dz, db, dsT.contiguous(), ds0
+            )
+            return dw, dq, dk, dv, dz, db, ds0
+
     def RUN_CUDA_RWKV7g(q, w, k, v, a, b):
         B, T, HC = q.shape
         q, w, k, v, a, b = [i.view(B, T, HC // 64, 64)
                             for i in [q, w, k, v, a, b]]
         return WindBackstepping.apply(w, q, k, v, a, b).view(B, T, HC)
 
+    def RUN_CUDA_RWKV7s(q, w, k, v, a, b, s0):
+        """RUN_CUDA_RWKV7g from state s0 (B, H, 64, 64): (y, final state)."""
+        B, T, HC = q.shape
+        q, w, k, v, a, b = [i.view(B, T, HC // 64, 64)
+                            for i in [q, w, k, v, a, b]]
+        y, sT = WindBacksteppingState.apply(w, q, k, v, a, b, s0.contiguous())
+        return y.view(B, T, HC), sT
+
 
 #################################################################
 
@@ -137,9 +196,7 @@ class RWKV_Tmix_x070(nn.Module):
 
         ratio_0_to_1 = layer_id / (args.n_layer - 1)  # 0 to 1
         ratio_1_to_almost0 = 1.0 - (layer_id / args.n_layer)  # 1 to ~0
-        ddd = torch.ones(1, 1, C)
-        for i in range(C):
-            ddd[0, 0, i] = i / C
+        ddd = (torch.arange(C, dtype=torch.float64) / C).float().view(1, 1, C)
 
         self.x_r = nn.Parameter(1.0 - torch.pow(ddd, 0.2 * ratio_1_to_almost0))
         self.x_w = nn.Parameter(1.0 - torch.pow(ddd, 0.9 * ratio_1_to_almost0))
@@ -167,14 +224,11 @@ class RWKV_Tmix_x070(nn.Module):
                 assert False
             return x
 
-        www = torch.zeros(C)
-        zigzag = torch.zeros(C)
-        linear = torch.zeros(C)
-        for n in range(C):
-            linear[n] = n / (C - 1) - 0.5
-            zigzag[n] = ((n % N) - ((N - 1) / 2)) / ((N - 1) / 2)
-            zigzag[n] = zigzag[n] * abs(zigzag[n])
-            www[n] = -6 + 6 * (n / (C - 1)) ** (1 + 1 * ratio_0_to_1**0.3)
+        n = torch.arange(C, dtype=torch.float64)
+        linear = (n / (C - 1) - 0.5).float()
+        zigzag = (((n % N) - ((N - 1) / 2)) / ((N - 1) / 2)).float()
+        zigzag = zigzag * zigzag.abs()
+        www = (-6 + 6 * (n / (C - 1)) ** (1 + 1 * ratio_0_to_1**0.3)).float()
 
         # Increase lora dimension for headdim>64
         factor = self.head_size / 64
@@ -224,9 +278,14 @@ class RWKV_Tmix_x070(nn.Module):
         del www, zigzag, linear, ddd
 
     @CompileFunction
-    def forward(self, x, v_first):
+    def forward(self, x, v_first, shift=None, wkv_state=None):
+        """With shift (B, C) / wkv_state (B, H, N, N), the states before x: also returns the ones after."""
         B, T, C = x.size()
-        xx = token_shift(x)
+        if shift is None:
+            xx = token_shift(x)
+        else:
+            xx = torch.cat([shift.unsqueeze(1), x[:, :-1]], dim=1) - x
+            shift = x[:, -1]
         xr, xw, xk, xv, xa, xg = fused_addcmul_rwkv7(x, xx, self.x_r,
                                                      self.x_w, self.x_k, self.x_v,
                                                      self.x_a, self.x_g)
@@ -250,7 +309,10 @@ class RWKV_Tmix_x070(nn.Module):
                          dim=-1, p=2.0).view(B, T, C)
         k = fused_k_rwkv7(k, a, self.k_a)
 
-        x = RUN_CUDA_RWKV7g(r, w, k, v, -kk, kk * a)
+        if wkv_state is None:
+            x = RUN_CUDA_RWKV7g(r, w, k, v, -kk, kk * a)
+        else:
+            x, wkv_state = RUN_CUDA_RWKV7s(r, w, k, v, -kk, kk * a, wkv_state)
         x = self.ln_x(x.view(B * T, C)).view(B, T, C)
 
         x = x + (
@@ -260,7 +322,9 @@ class RWKV_Tmix_x070(nn.Module):
             * v.view(B, T, self.n_head, -1)
         ).view(B, T, C)
         x = self.output(x * g)
-        return x, v_first
+        if shift is None:
+            return x, v_first
+        return x, v_first, shift, wkv_state
 
 
 #################################################################
@@ -275,9 +339,7 @@ class RWKV_CMix_x070(nn.Module):
         self.time_shift = nn.ZeroPad2d((0, 0, 1, -1))
 
         ratio_1_to_almost0 = 1.0 - (layer_id / args.n_layer)  # 1 to ~0
-        ddd = torch.ones(1, 1, args.n_embd)
-        for i in range(args.n_embd):
-            ddd[0, 0, i] = i / args.n_embd
+        ddd = (torch.arange(args.n_embd, dtype=torch.float64) / args.n_embd).float().view(1, 1, args.n_embd)
         self.x_k = nn.Parameter(1.0 - torch.pow(ddd, ratio_1_to_almost0**4))
 
         self.key = nn.Linear(args.n_embd, args.n_embd * 4, bias=False)
@@ -289,11 +351,17 @@ class RWKV_CMix_x070(nn.Module):
         self.value.weight.data.zero_()
 
     @CompileFunction
-    def forward(self, x):
-        xx = token_shift(x)
+    def forward(self, x, shift=None):
+        """With shift (B, C), the x before this one: also returns the x[:, -1] for the next call."""
+        if shift is None:
+            xx = token_shift(x)
+        else:
+            xx = torch.cat([shift.unsqueeze(1), x[:, :-1]], dim=1) - x
         k = torch.addcmul(x, xx, self.x_k)
         k = torch.relu(self.key(k)) ** 2
-        return self.value(k)
+        if shift is None:
+            return self.value(k)
+        return self.value(k), x[:, -1]
 
 
 #################################################################
@@ -315,17 +383,63 @@ class Block(nn.Module):
 
         self.att = RWKV_Tmix_x070(args, layer_id)
         self.ffn = RWKV_CMix_x070(args, layer_id)
+        # --grad_cp 2: recompute the ffn's activations in the backward (set by RWKV)
+        self.cp_ffn = False
+
+    def _ffn(self, x, *shift):
+        return self.ffn(self.ln2(x), *shift)
+
+    def run_ffn(self, x, *shift):
+        if self.cp_ffn and torch.is_grad_enabled():
+            return torch_checkpoint(self._ffn, x, *shift, use_reentrant=False)
+        return self._ffn(x, *shift)
 
     @CompileFunction
-    def forward(self, x, v_first):
+    def forward(self, x, v_first, att_shift=None, att_state=None, ffn_shift=None):
+        """The states are the layer's three entries of RWKV.zero_state: given them, also returns the new ones."""
         if self.layer_id == 0:
             x = self.ln0(x)
 
-        x_attn, v_first = self.att(self.ln1(x), v_first)
+        if att_shift is None:
+            x_attn, v_first = self.att(self.ln1(x), v_first)
+            x = x + x_attn
+
+            x = x + self.run_ffn(x)
+            return x, v_first
+
+        x_attn, v_first, att_shift, att_state = self.att(self.ln1(x), v_first, att_shift, att_state)
         x = x + x_attn
 
-        x = x + self.ffn(self.ln2(x))
-        return x, v_first
+        x_ffn, ffn_shift = self.run_ffn(x, ffn_shift)
+        x = x + x_ffn
+        return x, v_first, att_shift, att_state, ffn_shift
+
+
+def _orthogonal(count, shape, gain, device="cpu", max_numel=1 << 28):
+    """count tensors like nn.init.orthogonal_(torch.empty(shape), gain), with batched QR
+    decompositions of at most max_numel elements."""
+    rows, cols = shape[0], math.prod(shape[1:])
+    per_batch = max(1, max_numel // (rows * cols))
+    out = []
+    for i in range(0, count, per_batch):
+        k = min(per_batch, count - i)
+        a = torch.randn(k, rows, cols, device=device)
+        if rows < cols:
+            a = a.transpose(1, 2)
+        q, r = torch.linalg.qr(a)
+        q *= torch.diagonal(r, dim1=-2, dim2=-1).sign().unsqueeze(-2)
+        if rows < cols:
+            q = q.transpose(1, 2)
+        q = (q * gain).reshape(k, *shape)
+        out += [t.clone(memory_format=torch.contiguous_format) for t in q.unbind(0)]
+    return out
+
+
+def _fused_adam(optim_groups, adam_w_mode, bias_correction=True, **kwargs):
+    """deepspeed FusedAdam, or torch.optim Adam / AdamW where its CUDA kernel can't run."""
+    if torch.cuda.is_available() and importlib.util.find_spec("deepspeed"):
+        return FusedAdam(optim_groups, bias_correction=bias_correction, adam_w_mode=adam_w_mode, **kwargs)
+    return (torch.optim.AdamW if adam_w_mode else torch.optim.Adam)(optim_groups, **kwargs)
 
 
 class L2Wrap(torch.autograd.Function):
@@ -345,6 +459,73 @@ class L2Wrap(torch.autograd.Function):
         return (grad_output, gy)
 
 
+class FusedHeadL2Loss(torch.autograd.Function):
+    """F.cross_entropy(head(x), targets) with L2Wrap, `chunk` tokens at a time.
+
+    Same loss and gradients as the L2Wrap path, but the (B, T, vocab) logits are
+    never held at once: the forward keeps per token only the logsumexp and the
+    max logit (value and index, for the L2Wrap term), the backward recomputes
+    each chunk's logits (one extra head matmul) and turns them into the
+    gradients of x and of the head weight right away.
+
+    Under autocast the logits are half precision while x is fp32; the backward
+    runs outside autocast, so it recomputes them in the dtype the forward saw.
+    """
+
+    @staticmethod
+    def forward(ctx, x, weight, targets, chunk):
+        shape = x.shape
+        x = x.reshape(-1, shape[-1])
+        targets = targets.reshape(-1)
+        N = x.shape[0]
+        valid = targets != -100  # F.cross_entropy's ignore_index
+        lse = torch.empty(N, dtype=torch.float32, device=x.device)
+        maxx = torch.empty(N, dtype=torch.float32, device=x.device)
+        ids = torch.empty(N, dtype=torch.long, device=x.device)
+        loss = torch.zeros((), dtype=torch.float32, device=x.device)
+        ctx.logits_dtype = x.dtype
+        for i in range(0, N, chunk):
+            logits = x[i : i + chunk] @ weight.t()
+            ctx.logits_dtype = logits.dtype
+            maxx[i : i + chunk], ids[i : i + chunk] = torch.max(logits, -1)
+            logits = logits.float()
+            lse[i : i + chunk] = torch.logsumexp(logits, -1)
+            picked = logits.gather(-1, targets[i : i + chunk].clamp(min=0).unsqueeze(-1)).squeeze(-1)
+            loss += ((lse[i : i + chunk] - picked) * valid[i : i + chunk]).sum()
+        ctx.n_valid = valid.sum().clamp(min=1)
+        ctx.chunk = chunk
+        ctx.shape = shape
+        ctx.save_for_backward(x, weight, targets, lse, maxx, ids)
+        return loss / ctx.n_valid
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, weight, targets, lse, maxx, ids = ctx.saved_tensors
+        chunk = ctx.chunk
+        N = x.shape[0]
+        # L2Wrap: to encourage the logits to be close to 0
+        factor = 1e-4 / N
+        scale = grad_output.float() / ctx.n_valid
+        dtype = ctx.logits_dtype
+        w = weight.to(dtype)
+        dx = torch.empty_like(x)
+        dw = torch.zeros(weight.shape, dtype=torch.float32, device=weight.device)
+        for i in range(0, N, chunk):
+            xc = x[i : i + chunk].to(dtype)
+            rows = torch.arange(xc.shape[0], device=x.device)
+            t = targets[i : i + chunk]
+            valid = t != -100
+            # softmax - onehot(target), over the valid tokens
+            g = torch.exp((xc @ w.t()).float() - lse[i : i + chunk, None])
+            g[rows, t.clamp(min=0)] -= 1
+            g *= valid.unsqueeze(-1) * scale
+            g[rows, ids[i : i + chunk]] += maxx[i : i + chunk] * factor
+            g = g.to(dtype)
+            dx[i : i + chunk] = g @ w
+            dw += (g.t() @ xc).float()
+        return dx.view(ctx.shape), dw.to(weight.dtype), None, None
+
+
 class RWKV(pl.LightningModule):
     def __init__(self, args):
         super().__init__()
@@ -364,9 +545,22 @@ class RWKV(pl.LightningModule):
 
         self.blocks = nn.ModuleList([Block(args, i)
                                     for i in range(args.n_layer)])
+        # --grad_cp 2: torch.utils.checkpoint on every grad_cp_every-th block (layer_id % grad_cp_every == 0),
+        # recomputing the whole block (grad_cp_policy "block") or only its ffn ("ffn") in the backward
+        cp_every = max(1, getattr(args, "grad_cp_every", 1))
+        cp_policy = getattr(args, "grad_cp_policy", "block")
+        assert cp_policy in ("block", "ffn")
+        self.cp_blocks = set()
+        for block in self.blocks:
+            if args.grad_cp == 2 and block.layer_id % cp_every == 0:
+                if cp_policy == "block":
+                    self.cp_blocks.add(block.layer_id)
+                else:
+                    block.cp_ffn = True
 
         self.ln_out = nn.LayerNorm(args.n_embd)
         self.head = nn.Linear(args.n_embd, args.vocab_size, bias=False)
+        self.tbptt_state = None  # carried between training windows with --tbptt
 
     def configure_optimizers(self):
         args = self.args
@@ -428,7 +622,7 @@ class RWKV(pl.LightningModule):
                     adamw_mode=True,
                     amsgrad=False,
                 )
-            return FusedAdam(
+            return _fused_adam(
                 optim_groups,
                 lr=self.args.lr_init,
                 betas=self.args.betas,
@@ -449,7 +643,7 @@ class RWKV(pl.LightningModule):
                     weight_decay=0,
                     amsgrad=False,
                 )
-            return FusedAdam(
+            return _fused_adam(
                 optim_groups,
                 lr=self.args.lr_init,
                 betas=self.args.betas,
@@ -468,8 +662,26 @@ class RWKV(pl.LightningModule):
             return cfg.get("offload_optimizer") or cfg.get("offload_param")
         return False
 
+    def zero_state(self, B, device=None, dtype=None):
+        """Per layer: [previous x of att (B, C), wkv state (B, H, N, N) in fp32, previous x of ffn (B, C)],
+        the layout of infer/rwkv7_prefill.py with a batch dimension."""
+        args = self.args
+        device = device or self.emb.weight.device
+        dtype = dtype or self.emb.weight.dtype
+        H, N = args.dim_att // args.head_size, args.head_size
+        state = []
+        for _ in range(args.n_layer):
+            state += [
+                torch.zeros(B, args.n_embd, device=device, dtype=dtype),
+                torch.zeros(B, H, N, N, device=device, dtype=torch.float32),
+                torch.zeros(B, args.n_embd, device=device, dtype=dtype),
+            ]
+        return state
+
     @CompileFunction
-    def forward(self, idx):
+    def forward(self, idx, state=None, return_hidden=False):
+        """Logits; with a state (see zero_state), the window continues from it and (logits, new state) is returned.
+        return_hidden: the ln_out output instead of the logits (for FusedHeadL2Loss)."""
         args = self.args
         B, T = idx.size()
         assert T <= args.ctx_len, "Cannot forward, model ctx_len is exhausted."
@@ -477,20 +689,44 @@ class RWKV(pl.LightningModule):
         x = self.emb(idx)
 
         v_first = torch.empty_like(x)
-        for block in self.blocks:
+        new_state = []
+        for i, block in enumerate(self.blocks):
+            block_args = (x, v_first) if state is None else (x, v_first, *state[i * 3 : i * 3 + 3])
             if args.grad_cp == 1:
-                x, v_first = deepspeed.checkpointing.checkpoint(
-                    block, x, v_first)
+                out = deepspeed.checkpointing.checkpoint(block, *block_args)
+            elif i in self.cp_blocks and torch.is_grad_enabled():
+                out = torch_checkpoint(block, *block_args, use_reentrant=False)
             else:
-                x, v_first = block(x, v_first)
+                out = block(*block_args)
+            x, v_first = out[:2]
+            new_state += out[2:]
 
         x = self.ln_out(x)
-        x = self.head(x)
-        return x
+        if not return_hidden:
+            x = self.head(x)
+        if state is None:
+            return x
+        return x, new_state
 
     def training_step(self, batch, batch_idx):
-        idx, targets = batch
-        logits = self(idx)
+        # --loss_chunk: head + loss in chunks (FusedHeadL2Loss), the full logits are never materialized
+        fused = self.args.loss_chunk > 0
+        if self.args.tbptt > 1:
+            # consecutive windows of the same streams (MyDataset): the state carries over, gradients do not
+            idx, targets, window = batch
+            state = self.tbptt_state
+            if state is None or state[0].shape[0] != idx.shape[0]:
+                state = self.zero_state(idx.shape[0], idx.device)
+            else:  # rows at the first window of a stream start from zero (no host sync)
+                keep = window != 0
+                state = [s * keep.view(-1, *[1] * (s.dim() - 1)).to(s.dtype) for s in state]
+            logits, state = self(idx, state, return_hidden=fused)
+            self.tbptt_state = [s.detach() for s in state]
+        else:
+            idx, targets = batch
+            logits = self(idx, return_hidden=fused)
+        if fused:
+            return FusedHeadL2Loss.apply(logits, self.head.weight, targets, self.args.loss_chunk)
         loss = F.cross_entropy(
             logits.view(-1, logits.size(-1)), targets.view(-1))
         return L2Wrap.apply(loss, logits)
@@ -505,24 +741,25 @@ class RWKV(pl.LightningModule):
             """
 ############################################################################
 #
-# Init model weight (slow for large models)...
+# Init model weight...
 #
 ############################################################################
 """
         )
         m = {}
         n_params = 0
-        for n in self.state_dict():
-            p = self.state_dict()[n]
+        lines = []
+        ortho = {}  # (shape, gain) -> names, initialized together by _orthogonal
+        device = "cuda" if self.args.accelerator.upper() == "GPU" else "cpu"
+        state_dict = self.state_dict()
+        for n, p in state_dict.items():
             shape = p.shape
 
             s0 = str(shape[0]) if len(shape) > 0 else ""
             s1 = str(shape[1]) if len(shape) > 1 else ""
             s2 = str(shape[2]) if len(shape) > 2 else ""
             s3 = str(shape[3]) if len(shape) > 3 else ""
-            print(
-                f"{s0.ljust(5)} {s1.ljust(5)} {s2.ljust(5)} {s3.ljust(5)} {n}", end=""
-            )
+            line = f"{s0.ljust(5)} {s1.ljust(5)} {s2.ljust(5)} {s3.ljust(5)} {n}"
 
             scale = 1.0
             if (
@@ -544,21 +781,19 @@ class RWKV(pl.LightningModule):
                     m[n] = (p * 0.0) + (layer_scale**0.7)
                 else:
                     m[n] = p
-                print()
+                lines.append(line)
+                continue
             elif n == "emb.weight":
                 m[n] = p
                 scale = -1e-4
                 nn.init.uniform_(m[n], a=scale, b=-scale)
-                print(f" [scale {scale}]")
             elif n == "head.weight":
-                m[n] = p
                 if self.args.vocab_size > self.args.n_embd:
                     scale = 0.5 * \
                         math.sqrt(self.args.vocab_size / self.args.n_embd)
                 else:
                     scale = 0.5
-                nn.init.orthogonal_(m[n], gain=scale)
-                print(f" [scale {scale}]")
+                ortho.setdefault((tuple(shape), scale), []).append(n)
             else:
                 assert n.endswith(".weight")  # should always be true
 
@@ -584,20 +819,21 @@ class RWKV(pl.LightningModule):
                     if kk in n:
                         scale = 0.1
 
-                print(f" [scale {scale}]")
-
-                if self.args.accelerator.upper() == "GPU":
-                    m[n] = torch.empty((shape[0], shape[1]), device="cuda")
-                else:
-                    m[n] = torch.empty((shape[0], shape[1]))
-
                 if scale == 0:
-                    nn.init.zeros_(m[n])
+                    m[n] = torch.zeros((shape[0], shape[1]))
                 elif scale < 0:
+                    m[n] = torch.empty((shape[0], shape[1]), device=device)
                     nn.init.uniform_(m[n], a=scale, b=-scale)
                 else:
-                    nn.init.orthogonal_(m[n], gain=scale)
+                    ortho.setdefault(((shape[0], shape[1]), scale), []).append(n)
+            lines.append(f"{line} [scale {scale}]")
+
+        for (shape, gain), names in ortho.items():
+            for n, q in zip(names, _orthogonal(len(names), shape, gain, device)):
+                m[n] = q
 
+        print("\n".join(lines))
+        for n in state_dict:
             m[n] = m[n].cpu()
             if os.environ["RWKV_FLOAT_MODE"] == "fp16":
                 m[n] = m[n].half()
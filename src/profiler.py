@@ -0,0 +1,90 @@
+########################################################################################################
+# torch.profiler capture window for a running training
+########################################################################################################
+#
+# train.py --profile_at 2000 --profile_warmup 2 --profile_active 3 --profile_repeat 2
+#
+# From global step profile_at, profiles `repeat` cycles of warmup + active steps on every rank, then
+# disarms (the rest of the run has no profiler overhead). Each cycle writes to proj_dir/profile/:
+#
+#   rank{R}.*.pt.trace.json         Chrome trace (chrome://tracing, ui.perfetto.dev) / TensorBoard profiler plugin
+#   rank{R}_step{S}_ops.txt         top ops by self time; with --profile_stack 1 also grouped by source line,
+#                                   which separates e.g. the LoRA matmuls, F.normalize and ln_x in RWKV_Tmix_x070
+
+import os
+
+import torch
+from torch.autograd.profiler_util import FunctionEventAvg
+from torch.profiler import ProfilerActivity, profile, schedule, tensorboard_trace_handler
+
+TOP_OPS = 40
+# renamed from self_cuda_time_total in newer torch
+DEVICE_TIME = "self_device_time_total" if hasattr(FunctionEventAvg(), "self_device_time_total") else "self_cuda_time_total"
+
+
+class StepProfiler(object):
+    def __init__(self, out_dir, rank, start, warmup=2, active=3, repeat=1, with_stack=False, profile_memory=False):
+        self.out_dir = out_dir
+        self.rank = rank
+        self.start = start
+        self.warmup, self.active, self.repeat = warmup, active, repeat
+        self.span = (warmup + active) * repeat
+        self.with_stack = with_stack
+        self.profile_memory = profile_memory
+        self.prof = None
+        self.done = False
+        self.steps = 0
+        self.step = start
+        self.use_cuda = torch.cuda.is_available()
+
+    def step_start(self, real_step):
+        """on_train_batch_start: arms the profiler when the window begins."""
+        self.step = real_step
+        if self.prof is not None or self.done or not (self.start <= real_step < self.start + self.span):
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if self.use_cuda else [])
+        extra = {}
+        if self.with_stack:
+            try:  # newer torch only keeps Python stacks in verbose mode
+                from torch._C._profiler import _ExperimentalConfig
+
+                extra["experimental_config"] = _ExperimentalConfig(verbose=True)
+            except ImportError:
+                pass
+        self.prof = profile(
+            activities=activities,
+            schedule=schedule(wait=0, warmup=self.warmup, active=self.active, repeat=self.repeat),
+            on_trace_ready=self._on_trace_ready,
+            record_shapes=True,
+            with_stack=self.with_stack,
+            profile_memory=self.profile_memory,
+            **extra,
+        )
+        self.prof.start()
+
+    def step_end(self):
+        """on_train_batch_end: advances the schedule, disarms after the last cycle."""
+        if self.prof is None:
+            return
+        self.prof.step()
+        self.steps += 1
+        if self.steps >= self.span:
+            self.close()
+
+    def close(self):
+        if self.prof is not None:
+            self.prof.stop()
+            self.prof = None
+            self.done = True
+
+    def _on_trace_ready(self, prof):
+        tensorboard_trace_handler(self.out_dir, worker_name=f"rank{self.rank}")(prof)
+        sort_by = DEVICE_TIME if self.use_cuda else "self_cpu_time_total"
+        tables = [prof.key_averages().table(sort_by=sort_by, row_limit=TOP_OPS)]
+        tables.append(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=TOP_OPS))
+        if self.with_stack:
+            tables.append(prof.key_averages(group_by_stack_n=5).table(sort_by=sort_by, row_limit=TOP_OPS))
+        with open(f"{self.out_dir}/rank{self.rank}_step{self.step}_ops.txt", "w") as f:
+            f.write(f"# rank {self.rank}, {self.active} active steps ending at global step {self.step}\n\n")
+            f.write("\n\n".join(tables))
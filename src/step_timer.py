@@ -0,0 +1,131 @@
+########################################################################################################
+# Per-step training time breakdown
+########################################################################################################
+#
+# train_callback marks the phase boundaries of every step through Lightning's hooks:
+#
+#   data        previous step end -> on_train_batch_start        (host clock, waiting for the loader)
+#   forward     on_train_batch_start -> on_before_backward       (training_step + loss all_gather)
+#   backward    on_before_backward -> on_after_backward          (incl. overlapped DDP / DeepSpeed grad reduce)
+#   optimizer   on_after_backward -> on_train_batch_end          (clipping, remaining all-reduce, optimizer step)
+#   checkpoint  time spent in my_save, charged to the step that saved (or the next one, for epoch-end saves)
+#
+# On CUDA the forward / backward / optimizer phases are measured with CUDA events, so they are GPU time
+# and not kernel launch time. Events of a step are read back one step later, when they have completed,
+# so the timer adds no synchronization. Without CUDA the host clock is used.
+
+import json
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+PHASES = ("data", "forward", "backward", "optimizer", "checkpoint")
+PERCENTILES = (50, 90, 99)
+
+
+class StepTimer(object):
+    def __init__(self, trace_file, window=100, use_cuda=None):
+        """trace_file: JSONL path, one line per step. window: steps kept for the rolling percentiles."""
+        self.use_cuda = torch.cuda.is_available() if use_cuda is None else use_cuda
+        self.window = window
+        self.history = {p: deque(maxlen=window) for p in PHASES + ("total",)}
+        self.trace = open(trace_file, "a")
+        self._marks = {}
+        self._host = {}
+        self._carry = 0.0  # checkpoint time between steps
+        self._pending = None  # previous step, waiting for its CUDA events
+        self.steps = 0
+
+    def _mark(self):
+        if self.use_cuda:
+            e = torch.cuda.Event(enable_timing=True)
+            e.record()
+            return e
+        return time.perf_counter()
+
+    def start(self, data_wait):
+        """on_train_batch_start: data_wait in seconds (0 for the first step of an epoch)."""
+        self._host = {"data": data_wait, "checkpoint": self._carry}
+        self._carry = 0.0
+        self._marks = {"start": self._mark()}
+
+    def mark(self, name):
+        """name: "backward" or "optimizer" (the phase starts), or "end" (top of on_train_batch_end)."""
+        if "start" in self._marks:
+            self._marks[name] = self._mark()
+
+    def add_checkpoint(self, seconds):
+        """my_save time. Outside a step (epoch end) it is charged to the next step."""
+        if "start" in self._marks:
+            self._host["checkpoint"] = self._host.get("checkpoint", 0.0) + seconds
+        else:
+            self._carry += seconds
+
+    def _elapsed(self, a, b):
+        if a is None or b is None:
+            return 0.0
+        if self.use_cuda:
+            b.synchronize()  # a no-op one step later
+            return a.elapsed_time(b) / 1000
+        return b - a
+
+    def _resolve(self, pending):
+        step, marks, host = pending
+        start, bwd, opt, end = (marks.get(k) for k in ("start", "backward", "optimizer", "end"))
+        bwd = bwd or end
+        opt = opt or bwd
+        row = {
+            "data": host.get("data", 0.0),
+            "forward": self._elapsed(start, bwd),
+            "backward": self._elapsed(bwd, opt),
+            "optimizer": self._elapsed(opt, end),
+            "checkpoint": host.get("checkpoint", 0.0),
+        }
+        row["total"] = sum(row.values())
+        for p, t in row.items():
+            self.history[p].append(t)
+        self.trace.write(json.dumps({"step": step, **{p: round(t * 1000, 3) for p, t in row.items()}}) + "\n")
+        self.steps += 1
+
+    def end(self, step):
+        """Bottom of on_train_batch_end, after any my_save of the step: step is the global (real) step."""
+        if "start" not in self._marks:
+            return
+        if "end" not in self._marks:
+            self.mark("end")
+        if self._pending is not None:
+            self._resolve(self._pending)
+        self._pending = (step, self._marks, self._host)
+        if not self.use_cuda:
+            self._resolve(self._pending)
+            self._pending = None
+        self._marks = {}
+
+    def flush(self):
+        if self._pending is not None:
+            self._resolve(self._pending)
+            self._pending = None
+        self.trace.flush()
+
+    def percentiles(self):
+        """{phase: (p50, p90, p99) in ms} over the last `window` steps."""
+        out = {}
+        for p, h in self.history.items():
+            if len(h) > 0:
+                out[p] = tuple(np.percentile(np.fromiter(h, float), PERCENTILES) * 1000)
+        return out
+
+    def summary_line(self, step):
+        """One train_log.txt line."""
+        parts = [f"{p} {'/'.join(f'{v:.1f}' for v in q)}" for p, q in self.percentiles().items()]
+        head = f"TIMING {step} p{'/'.join(map(str, PERCENTILES))} ms over {len(self.history['total'])} steps: "
+        return head + ", ".join(parts)
+
+    def wandb_dict(self):
+        lll = {}
+        for p, q in self.percentiles().items():
+            for pct, v in zip(PERCENTILES, q):
+                lll[f"time/{p}_p{pct}_ms"] = v
+        return lll
@@ -6,6 +6,25 @@ import pytorch_lightning as pl
 import torch
 from pytorch_lightning.utilities import rank_zero_info, rank_zero_only
 
+from .checkpoint import (
+    AsyncCheckpointer,
+    load_optim_state,
+    optim_state_path,
+    prune_checkpoints,
+    prune_step_checkpoints,
+    write_sidecar,
+)
+from .profiler import StepProfiler
+from .step_timer import StepTimer
+
+# a step that waited longer than this for its batch counts as data-bound
+DATA_WAIT_THRESHOLD = 1e-3
+
+
+def current_real_step(args, trainer):
+    """Global step over all runs: resumed runs start at epoch_begin, resume_epoch_step steps into it."""
+    return trainer.global_step + args.epoch_begin * args.epoch_steps + getattr(args, "resume_epoch_step", 0)
+
 
 def my_save(args, trainer, dd, ff):
     if "deepspeed_stage_3" in args.strategy:
@@ -18,11 +37,125 @@ class train_callback(pl.Callback):
     def __init__(self, args):
         super().__init__()
         self.args = args
+        self.timer = None  # StepTimer with --step_timing, made per rank at train start
+        self.profiler = None  # StepProfiler with --profile_at
+        self.checkpointer = None  # AsyncCheckpointer with --async_save, rank 0 only
+        self.optim_checkpointer = None  # optimizer state of this rank, with --step_save
+        if getattr(args, "async_save", 0) == 1 and "deepspeed_stage_3" not in args.strategy:
+            self.checkpointer = AsyncCheckpointer(args.proj_dir, keep_last=args.keep_last)
+            self.optim_checkpointer = AsyncCheckpointer(args.proj_dir)
+
+    def on_train_start(self, trainer, pl_module):
+        args = self.args
+        if getattr(args, "resume_optim", ""):
+            load_optim_state(trainer.optimizers[0], args.resume_optim, trainer.global_rank, trainer.world_size)
+            rank_zero_info(f"########## Optimizer state restored from {args.resume_optim} ##########")
+        if getattr(args, "step_timing", 0) > 0:
+            self.timer = StepTimer(
+                f"{args.proj_dir}/step_timing.rank{trainer.global_rank}.jsonl", window=args.step_timing
+            )
+        if getattr(args, "profile_at", -1) >= 0:
+            self.profiler = StepProfiler(
+                f"{args.proj_dir}/profile",
+                trainer.global_rank,
+                args.profile_at,
+                warmup=args.profile_warmup,
+                active=args.profile_active,
+                repeat=args.profile_repeat,
+                with_stack=args.profile_stack == 1,
+                profile_memory=args.profile_memory == 1,
+            )
+
+    def on_train_end(self, trainer, pl_module):
+        for c in (self.checkpointer, self.optim_checkpointer):
+            if c is not None:
+                c.wait()
+        if self.timer is not None:
+            self.timer.flush()
+        if self.profiler is not None:
+            self.profiler.close()
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        if self.timer is not None:
+            self.timer.mark("backward")
+
+    def on_after_backward(self, trainer, pl_module):
+        if self.timer is not None:
+            self.timer.mark("optimizer")
+
+    def save_meta(self, trainer):
+        """Sidecar of a checkpoint: where training and the sampler are."""
+        args = self.args
+        step = int(current_real_step(args, trainer))
+        real_epoch = int(args.epoch_begin + trainer.current_epoch)
+        return {
+            "global_step": step,
+            "epoch": real_epoch,
+            "epoch_step": step - real_epoch * args.epoch_steps,  # steps of `epoch` done
+            "samples": step * args.real_bsz,
+            "tokens": step * args.real_bsz * args.ctx_len,
+            "world_size": trainer.world_size,
+            "optim_state": self.saves_optim(),
+            "loss": getattr(trainer, "my_epoch_loss", None),
+            "lr": getattr(trainer, "my_lr", None),
+            "data_file": args.data_file,
+            "magic_prime": args.magic_prime,
+            "time": str(datetime.datetime.now()),
+        }
+
+    def save(self, trainer, dd, ff, wait=False):
+        """my_save, in the background with --async_save (deepspeed stage 3 saves collectively, so
+        it stays synchronous). wait=True returns once ff is on disk. Timed as the checkpoint phase."""
+        args = self.args
+        t0 = time.perf_counter()
+        if self.checkpointer is not None:
+            self.checkpointer.save(dd, ff, self.save_meta(trainer))
+            if wait:
+                self.checkpointer.wait()
+        else:
+            my_save(args, trainer, dd, ff)
+            if trainer.is_global_zero:
+                write_sidecar(ff, self.save_meta(trainer))
+                if getattr(args, "keep_last", 0) > 0:
+                    prune_checkpoints(args.proj_dir, args.keep_last)
+                prune_step_checkpoints(args.proj_dir, 2)
+        if self.timer is not None:
+            self.timer.add_checkpoint(time.perf_counter() - t0)
+
+    def saves_optim(self):
+        """Checkpoints carry the optimizer state with --step_save (DeepSpeed stage 3 keeps its own format)."""
+        return getattr(self.args, "step_save", 0) > 0 and "deepspeed_stage_3" not in self.args.strategy
+
+    def save_optim(self, trainer, ff):
+        """This rank's optimizer state next to checkpoint ff. Every rank calls it."""
+        if not self.saves_optim():
+            return
+        t0 = time.perf_counter()
+        sd = trainer.optimizers[0].state_dict()
+        if self.optim_checkpointer is not None:
+            self.optim_checkpointer.save(sd, optim_state_path(ff, trainer.global_rank))
+        else:
+            torch.save(sd, optim_state_path(ff, trainer.global_rank))
+        if self.timer is not None:
+            self.timer.add_checkpoint(time.perf_counter() - t0)
 
     def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
         args = self.args
 
-        real_step = trainer.global_step + args.epoch_begin * args.epoch_steps
+        # time since the last step ended = time the step waited for its batch
+        t_end = getattr(self, "_t_batch_end", None)
+        wait = 0.0
+        if t_end is not None:
+            wait = time.perf_counter() - t_end
+            self._data_wait_sum = getattr(self, "_data_wait_sum", 0.0) + wait
+            self._data_wait_steps = getattr(self, "_data_wait_steps", 0) + int(wait > DATA_WAIT_THRESHOLD)
+            self._data_wait_count = getattr(self, "_data_wait_count", 0) + 1
+        if self.timer is not None:
+            self.timer.start(wait)
+
+        real_step = current_real_step(args, trainer)
+        if self.profiler is not None:
+            self.profiler.step_start(int(real_step))
 
         # LR schedule
         w_step = args.warmup_steps
@@ -45,20 +178,17 @@ class train_callback(pl.Callback):
             if progress >= 1:
                 if (trainer.is_global_zero) or ("deepspeed_stage_3" in args.strategy):
                     final_path = f"{args.proj_dir}/rwkv-final.pth"
-                    my_save(
-                        args,
-                        trainer,
-                        pl_module.state_dict(),
-                        final_path,
-                    )
+                    self.save(trainer, pl_module.state_dict(), final_path, wait=True)
                     rank_zero_info(
                         f"\n✅ End of training. Model saved to: {final_path}\n"
                     )
                     import sys
 
                     sys.exit(0)
-        if trainer.global_step < w_step:
-            lr = lr * (0.01 + 0.99 * trainer.global_step / w_step)
+        # a run resumed with its optimizer state continues the schedule, others warm up again
+        w_now = real_step if getattr(args, "resume_optim", "") else trainer.global_step
+        if w_now < w_step:
+            lr = lr * (0.01 + 0.99 * w_now / w_step)
 
         wd_now = args.weight_decay
 
@@ -96,10 +226,35 @@ class train_callback(pl.Callback):
                     )
                     trainer.my_wandb = wandb
 
+    def io_log(self, trainer):
+        """Data wait of the steps and deltas of the dataset IO counters (binidx.IO_STAT_FIELDS) since the last call."""
+        lll = {}
+        count = getattr(self, "_data_wait_count", 0)
+        if count > 0:
+            lll["data/wait_ms"] = 1000 * self._data_wait_sum / count
+            lll["data/waited_steps"] = self._data_wait_steps / count
+            self._data_wait_sum, self._data_wait_steps, self._data_wait_count = 0.0, 0, 0
+        io_stats = getattr(trainer.train_dataloader.dataset.datasets, "io_stats", None)
+        if io_stats is None:
+            return lll
+        now = io_stats.clone()
+        last = getattr(self, "_io_last", torch.zeros_like(now))
+        self._io_last = now
+        reads, tokens, seconds, slow_reads, major_faults = (now - last).tolist()
+        if reads > 0:
+            lll.update({
+                "data/read_ms": 1000 * seconds / reads,
+                "data/slow_reads": slow_reads,
+                "data/major_faults": major_faults,
+            })
+        return lll
+
     def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
         args = self.args
+        if self.timer is not None:
+            self.timer.mark("end")
         token_per_step = args.ctx_len * args.real_bsz
-        real_step = trainer.global_step + args.epoch_begin * args.epoch_steps
+        real_step = current_real_step(args, trainer)
 
         if trainer.is_global_zero:  # logging
             t_now = time.time_ns()
@@ -128,6 +283,9 @@ class train_callback(pl.Callback):
                 }
                 if kt_s > 0:
                     lll["kt/s"] = kt_s
+                lll.update(self.io_log(trainer))
+                if self.timer is not None:
+                    lll.update(self.timer.wandb_dict())
                 trainer.my_wandb.log(lll, step=int(real_step))
 
         if (trainer.is_global_zero) or (
@@ -137,18 +295,33 @@ class train_callback(pl.Callback):
                 if int(real_step) == int(args.magic_prime // args.real_bsz) - 1:
                     to_save_dict = pl_module.state_dict()
                     final_path = f"{args.proj_dir}/rwkv-final.pth"
-                    my_save(
-                        args,
-                        trainer,
-                        to_save_dict,
-                        final_path,
-                    )
+                    self.save(trainer, to_save_dict, final_path, wait=True)
                     rank_zero_info(
                         f"\n✅ End of training. Model saved to: {final_path}\n"
                     )
 
+        # resumable step checkpoint: weights on rank 0, optimizer state on every rank
+        if getattr(args, "step_save", 0) > 0 and int(real_step) % args.step_save == 0:
+            step_path = f"{args.proj_dir}/rwkv-step-{int(real_step)}.pth"
+            self.save_optim(trainer, step_path)
+            if (trainer.is_global_zero) or ("deepspeed_stage_3" in args.strategy):
+                self.save(trainer, pl_module.state_dict(), step_path)
+
+        if self.timer is not None:
+            self.timer.end(int(real_step))
+            if self.timer.steps > 0 and int(real_step) % args.step_timing == 0:
+                self.timer.trace.flush()
+                if trainer.is_global_zero:
+                    trainer.my_log.write(self.timer.summary_line(int(real_step)) + "\n")
+                    trainer.my_log.flush()
+        if self.profiler is not None:
+            self.profiler.step_end()
+
+        self._t_batch_end = time.perf_counter()
+
     def on_train_epoch_start(self, trainer, pl_module):
         args = self.args
+        self._t_batch_end = None  # epoch-end saving is not data wait
         dataset = trainer.train_dataloader.dataset.datasets
         # assert "MyDataset" in str(dataset)
         dataset.global_rank = trainer.global_rank
@@ -158,12 +331,16 @@ class train_callback(pl.Callback):
     def on_train_epoch_end(self, trainer, pl_module):
         args = self.args
         to_save_dict = {}
+        save_epoch = (
+            args.epoch_save > 0 and trainer.current_epoch % args.epoch_save == 0
+        ) or (trainer.current_epoch == args.epoch_count - 1)
+        epoch_path = f"{args.proj_dir}/rwkv-{args.epoch_begin + trainer.current_epoch}.pth"
+        if save_epoch:
+            self.save_optim(trainer, epoch_path)
         if (trainer.is_global_zero) or (
             "deepspeed_stage_3" in args.strategy
         ):  # save pth
-            if (
-                args.epoch_save > 0 and trainer.current_epoch % args.epoch_save == 0
-            ) or (trainer.current_epoch == args.epoch_count - 1):
+            if save_epoch:
                 if args.data_type == "wds_img":
                     raw_dict = pl_module.state_dict()
                     for k in raw_dict:
@@ -172,12 +349,7 @@ class train_callback(pl.Callback):
                 else:
                     to_save_dict = pl_module.state_dict()
                 try:
-                    my_save(
-                        args,
-                        trainer,
-                        to_save_dict,
-                        f"{args.proj_dir}/rwkv-{args.epoch_begin + trainer.current_epoch}.pth",
-                    )
+                    self.save(trainer, to_save_dict, epoch_path)
                 except Exception as e:
                     rank_zero_info("Error\n\n", e, "\n\n")
 
@@ -197,6 +369,22 @@ class train_callback(pl.Callback):
             trainer.my_loss_sum = 0
             trainer.my_loss_count = 0
 
+        # a resumed epoch started after its first resume_epoch_step steps, the next ones are whole
+        dataset = trainer.train_dataloader.dataset.datasets
+        if getattr(dataset, "skip_samples", 0) > 0:
+            dataset.skip_samples = 0
+
+
+def resize_rows(src, dd):
+    """src linearly interpolated along dim 0 to dd rows: row i comes from position i / dd * ss of
+    the ss rows of src (the last row from pos >= ss - 1 on)."""
+    ss = src.shape[0]
+    pos = torch.arange(dd, dtype=torch.float64) / dd * ss
+    p0 = pos.floor().long().clamp(max=ss - 1)
+    ii = torch.where(pos >= ss - 1, 0.0, pos - p0).view(-1, *[1] * (src.dim() - 1))
+    src = src.float()
+    return src[p0] * (1 - ii.float()) + src[(p0 + 1).clamp(max=ss - 1)] * ii.float()
+
 
 @rank_zero_only
 def generate_init_weight(model, init_weight_name):
@@ -217,19 +405,8 @@ def generate_init_weight(model, init_weight_name):
                 try:
                     mm[k] = src.reshape(mm[k].shape)
                 except BaseException:
-                    tmp = mm[k].squeeze().clone()
                     rank_zero_info(k, src.shape, "-->", mm[k].shape)
-                    ss = src.shape[0]
-                    dd = tmp.shape[0]
-                    for i in range(dd):
-                        pos = i / dd * ss
-                        if pos >= ss - 1:
-                            tmp[i] = src[ss - 1]
-                        else:
-                            p0 = int(math.floor(pos))
-                            ii = pos - p0
-                            tmp[i] = src[p0] * (1 - ii) + src[p0 + 1] * (ii)
-                    mm[k] = tmp.reshape(mm[k].shape)
+                    mm[k] = resize_rows(src, mm[k].squeeze().shape[0]).to(mm[k].dtype).reshape(mm[k].shape)
                     sss = src.squeeze().float().cpu().numpy()
                     rank_zero_info(sss[:10], "...", sss[-10:])
                     mmm = mm[k].squeeze().float().cpu().numpy()
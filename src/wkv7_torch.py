@@ -0,0 +1,160 @@
+#################################################################
+# Pure PyTorch RWKV-7 ops, for hosts without CUDA / Triton
+#################################################################
+#
+# Drop-in replacements of cuda/wkv7_cuda.cu and the rwkvfla ops src/model.py
+# uses, built from plain tensor ops so autograd, CPU and torch.compile all work.
+#
+# Check against the step-by-step recurrence (and the CUDA kernel if present):
+#
+# python -m src.wkv7_torch
+
+import torch
+import torch.nn.functional as F
+
+CHUNK_LEN = 16
+
+
+def token_shift(x):
+    """rwkvfla token_shift: previous token minus current (zero before the first)."""
+    return F.pad(x, (0, 0, 1, -1)) - x
+
+
+def fused_addcmul_rwkv7(x, xx, x_r, x_w, x_k, x_v, x_a, x_g):
+    """rwkvfla fused_addcmul_rwkv7: x + xx * mix for each of the six mixes."""
+    return tuple(torch.addcmul(x, xx, m) for m in (x_r, x_w, x_k, x_v, x_a, x_g))
+
+
+def fused_k_rwkv7(k, a, k_a):
+    """rwkvfla fused_k_rwkv7."""
+    return k * (1 + (a - 1) * k_a)
+
+
+def wkv7_naive(q, w, k, v, a, b, state=None):
+    """Step-by-step WKV-7, exactly the loop of cuda/wkv7_cuda.cu (fp32).
+
+    Inputs are (B, T, H, N); w is the raw decay, the step decay is exp(-exp(w)).
+    Per head, with state S[i, j] (value i, key j):
+        sa = S a_t;  S = S diag(w_t) + sa b_t^T + v_t k_t^T;  y_t = S q_t
+    Returns y (B, T, H, N) and the final state (B, H, N, N).
+    """
+    B, T, H, N = q.shape
+    q, w, k, v, a, b = [x.float() for x in (q, w, k, v, a, b)]
+    w = torch.exp(-torch.exp(w))
+    S = q.new_zeros(B, H, N, N) if state is None else state.float()
+    ys = []
+    for t in range(T):
+        sa = torch.einsum("bhij,bhj->bhi", S, a[:, t])
+        S = S * w[:, t, :, None, :] + sa[..., None] * b[:, t, :, None, :] + v[:, t, :, :, None] * k[:, t, :, None, :]
+        ys.append(torch.einsum("bhij,bhj->bhi", S, q[:, t]))
+    return torch.stack(ys, 1), S
+
+
+def wkv7_chunked(q, w, k, v, a, b, state=None, chunk_len=CHUNK_LEN):
+    """Same as wkv7_naive, one chunk of chunk_len steps at a time with matmuls.
+
+    Inside a chunk, with W_t the running product of the decays, the state is
+        S_t = S_0 diag(W_t) + sum_{s<=t} (u_s b_s^T + v_s k_s^T) diag(W_t / W_s)
+    where u_t = S_{t-1} a_t depends linearly on the earlier u_s. Collecting the
+    u_t of the chunk gives a unit lower triangular system (I - A) U = rhs that
+    one triangular solve handles. Decays are >= exp(-exp(-0.5)) in the model,
+    so 1 / W_s stays small over a 16 step chunk. Any T works, the last chunk
+    may be shorter. Computes in fp32, returns y in the input dtype and the final state.
+    """
+    B, T, H, N = q.shape
+    dtype = q.dtype
+    q, w, k, v, a, b = [x.float().transpose(1, 2) for x in (q, w, k, v, a, b)]  # B, H, T, N
+    log_w = -torch.exp(w)
+    S = q.new_zeros(B, H, N, N) if state is None else state.float()
+    ys = []
+    for t0 in range(0, T, chunk_len):
+        qc, kc, vc, ac, bc, lw = [x[:, :, t0:t0 + chunk_len] for x in (q, k, v, a, b, log_w)]
+        L = qc.shape[2]
+        lw_incl = lw.cumsum(2)  # log W_t
+        lw_excl = lw_incl - lw  # log W_{t-1}
+        inv_w = torch.exp(-lw_incl)
+        a_dec = ac * torch.exp(lw_excl)
+        q_dec = qc * torch.exp(lw_incl)
+        b_inv = bc * inv_w
+        k_inv = kc * inv_w
+        strict = torch.ones(L, L, dtype=torch.bool, device=q.device).tril(-1)
+        incl = torch.ones(L, L, dtype=torch.bool, device=q.device).tril()
+
+        # u_t = S_0 (W_{t-1} a_t) + sum_{s<t} [(a_t W_{t-1}/W_s) . b_s] u_s + [(a_t W_{t-1}/W_s) . k_s] v_s
+        A = (a_dec @ b_inv.transpose(-1, -2)).masked_fill(~strict, 0)
+        Ak = (a_dec @ k_inv.transpose(-1, -2)).masked_fill(~strict, 0)
+        rhs = a_dec @ S.transpose(-1, -2) + Ak @ vc
+        eye = torch.eye(L, dtype=q.dtype, device=q.device)
+        U = torch.linalg.solve_triangular(eye - A, rhs, upper=False, unitriangular=True)
+
+        Qb = (q_dec @ b_inv.transpose(-1, -2)).masked_fill(~incl, 0)
+        Qk = (q_dec @ k_inv.transpose(-1, -2)).masked_fill(~incl, 0)
+        ys.append(q_dec @ S.transpose(-1, -2) + Qb @ U + Qk @ vc)
+
+        w_end = torch.exp(lw_incl[:, :, -1:])  # W_L, (B, H, 1, N)
+        S = S * w_end + U.transpose(-1, -2) @ (b_inv * w_end) + vc.transpose(-1, -2) @ (k_inv * w_end)
+    y = torch.cat(ys, 2).transpose(1, 2)
+    return y.to(dtype), S
+
+
+def RUN_TORCH_RWKV7g(q, w, k, v, a, b, head_size=64):
+    """Same call as model.RUN_CUDA_RWKV7g: (B, T, H*N) inputs, (B, T, H*N) output."""
+    B, T, HC = q.shape
+    q, w, k, v, a, b = [i.view(B, T, HC // head_size, head_size) for i in [q, w, k, v, a, b]]
+    return wkv7_chunked(q, w, k, v, a, b)[0].reshape(B, T, HC)
+
+
+def RUN_TORCH_RWKV7s(q, w, k, v, a, b, s0, head_size=64):
+    """Same call as model.RUN_CUDA_RWKV7s: RUN_TORCH_RWKV7g from state s0 (B, H, N, N), returns (y, final state)."""
+    B, T, HC = q.shape
+    q, w, k, v, a, b = [i.view(B, T, HC // head_size, head_size) for i in [q, w, k, v, a, b]]
+    y, sT = wkv7_chunked(q, w, k, v, a, b, state=s0)
+    return y.reshape(B, T, HC), sT
+
+
+def _random_inputs(B, T, H, N, dtype=torch.float32, device="cpu", seed=0):
+    """Inputs shaped like RWKV_Tmix_x070 produces them."""
+    g = torch.Generator(device="cpu").manual_seed(seed)
+    rand = lambda *s: torch.randn(*s, generator=g).to(device)  # noqa: E731
+    q = rand(B, T, H, N)
+    w = -F.softplus(-rand(B, T, H, N)) - 0.5
+    k = rand(B, T, H, N) * 0.3
+    v = rand(B, T, H, N)
+    kk = F.normalize(rand(B, T, H, N), dim=-1)
+    a = torch.sigmoid(rand(B, T, H, N))
+    return [x.to(dtype) for x in (q, w, k, v, -kk, kk * a)]
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    for B, T, H, N in [(2, 16, 2, 64), (1, 75, 3, 64), (2, 64, 1, 16)]:
+        inputs = [x.double().requires_grad_() for x in _random_inputs(B, T, H, N)]
+        y_ref, s_ref = wkv7_naive(*[x.float() for x in inputs])
+        y, s = wkv7_chunked(*inputs)
+        err_y = ((y - y_ref.double()).abs().max() / y_ref.abs().max()).item()
+        err_s = ((s - s_ref.double()).abs().max() / s_ref.abs().max()).item()
+
+        # gradients against the naive loop, in fp64
+        dy = torch.randn_like(y)
+        grads = torch.autograd.grad((y * dy).sum(), inputs)
+        inputs64 = [x.detach().double().requires_grad_() for x in inputs]
+        y64 = wkv7_naive(*inputs64)[0]
+        grads_ref = torch.autograd.grad((y64.double() * dy).sum(), inputs64)
+        err_g = max(((g - r).abs().max() / r.abs().max().clamp_min(1e-12)).item() for g, r in zip(grads, grads_ref))
+        print(f"B{B} T{T} H{H} N{N}: max rel err y {err_y:.2e} state {err_s:.2e} grads {err_g:.2e}")
+        assert err_y < 1e-4 and err_s < 1e-4 and err_g < 1e-4
+
+    if torch.cuda.is_available():
+        import os
+
+        os.environ.setdefault("RWKV_MY_TESTING", "x070")
+        os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+        os.environ.setdefault("RWKV_COMPILE_ON", "0")
+        os.environ.setdefault("RWKV_WKV_BACKEND", "cuda")
+        from src.model import RUN_CUDA_RWKV7g
+
+        q, w, k, v, a, b = [x.cuda().bfloat16().reshape(2, 64, -1) for x in _random_inputs(2, 64, 2, 64)]
+        y_cuda = RUN_CUDA_RWKV7g(q, w, k, v, a, b).float()
+        y_torch = RUN_TORCH_RWKV7g(*[x.float() for x in (q, w, k, v, a, b)])
+        print(f"CUDA kernel vs torch: max abs err {(y_cuda - y_torch).abs().max().item():.2e} (bf16)")
+    print("wkv7_torch ok")
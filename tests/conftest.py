@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# src.model reads these at import time; the torch WKV backend runs on any device
+os.environ.setdefault("RWKV_MY_TESTING", "x070")
+os.environ.setdefault("RWKV_HEAD_SIZE", "64")
+os.environ.setdefault("RWKV_COMPILE_ON", "0")
+os.environ.setdefault("RWKV_FLOAT_MODE", "fp32")
+os.environ.setdefault("RWKV_WKV_BACKEND", "torch")
+
+# the data scripts import each other as top-level modules, as when run from data/
+for path in (ROOT, os.path.join(ROOT, 'data'), os.path.join(ROOT, 'data', 'katago_data')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
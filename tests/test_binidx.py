@@ -0,0 +1,149 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from src import binidx
+from src.binidx import DocMetadata, DocMetadataBuilder, MMapIndexedDataset, MMapIndexedDatasetBuilder, ShardedIndexedDataset, WindowIndex
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("shards")
+    paths = []
+    for s, n in enumerate((100, 50)):
+        path = str(tmp / f"s{s}")
+        builder = MMapIndexedDatasetBuilder(f"{path}.bin")
+        builder.add_item(np.arange(n, dtype=np.uint16) + 1000 * s)
+        builder.end_document()
+        builder.finalize(f"{path}.idx")
+        paths.append(path)
+    return ShardedIndexedDataset(paths)
+
+
+def test_sharded_get_across_shards(sharded):
+    full = np.concatenate([np.arange(100), np.arange(50) + 1000])
+    assert (sharded.get(0, 0) == full).all()
+    assert (sharded.get(0, 95, 10) == full[95:105]).all()
+    assert (sharded.get(0, 145, 5) == full[145:]).all()
+    assert sharded.get(0, 150, 0).size == 0
+
+
+@pytest.mark.parametrize("offset,length", [(150, 1), (149, 2), (-1, 1), (200, None)])
+def test_sharded_get_out_of_range(sharded, offset, length):
+    with pytest.raises(IndexError):
+        sharded.get(0, offset, length)
+
+
+def test_sharded_pickles_paths_not_tokens(sharded):
+    dataset = ShardedIndexedDataset(sharded.paths)
+    n_windows = dataset.align_windows(8)
+    data = pickle.dumps(dataset)
+    assert dataset.get(0, 0, 100).tobytes() not in data  # every process maps the shards itself
+    copy = pickle.loads(data)
+    assert copy.paths == dataset.paths and (copy.weights == dataset.weights).all()
+    assert (copy.read_windows([0, 95, 140], 10) == dataset.read_windows([0, 95, 140], 10)).all()
+    windows = np.arange(n_windows)
+    assert [x.tolist() for x in copy.locate_windows(windows)] == [x.tolist() for x in dataset.locate_windows(windows)]
+
+
+@pytest.mark.parametrize("encoding", ["raw", "packed", "zlib", "lzma"])
+def test_encodings_round_trip(tmp_path, encoding):
+    rng = np.random.default_rng(0)
+    items = [rng.integers(0, 370, size=n).astype(np.uint16) for n in (1, 63, 64, 200, 0, 517)]
+    path = str(tmp_path / encoding)
+    builder = MMapIndexedDatasetBuilder(f"{path}.bin", encoding=encoding, chunk_tokens=64)
+    for item in items:
+        builder.add_item(item)
+        builder.end_document()
+    builder.finalize(f"{path}.idx")
+
+    dataset = MMapIndexedDataset(path)
+    tokens = np.concatenate(items)
+    assert dataset.num_tokens == tokens.size and dataset._index.encoding == encoding
+    for i, item in enumerate(items):
+        assert (dataset.get(i) == item).all()
+    assert all((a == b).all() for a, b in zip(dataset[1:4], items[1:4]))
+    assert (dataset.get(3, 60, 10) == items[3][60:70]).all()
+    # windows over chunk boundaries (64, 128, ...) and running past the end of item 0
+    offsets = [0, 60, 120, 250, tokens.size - 17]
+    windows = dataset.read_windows(offsets, 17)
+    assert (windows == np.stack([tokens[o:o + 17] for o in offsets])).all()
+
+
+def test_doc_aligned_windows(tmp_path, monkeypatch):
+    ctx_len = 16
+    doc_lengths = np.random.default_rng(1).integers(1, 3 * ctx_len, size=80)
+    path = str(tmp_path / "docs")
+    builder = MMapIndexedDatasetBuilder(f"{path}.bin")
+    for n in doc_lengths.tolist():
+        builder.add_item(np.zeros(n, dtype=np.uint16))
+        builder.end_document()
+    builder.finalize(f"{path}.idx")
+    dataset = MMapIndexedDataset(path)
+
+    windows = WindowIndex.load_or_build(path, dataset, ctx_len)
+    starts, lengths = windows.starts.tolist(), windows.lengths.tolist()
+    assert windows.ctx_len == ctx_len and max(lengths) <= ctx_len + 1
+    doc_starts = np.concatenate([[0], np.cumsum(doc_lengths)]).tolist()
+    covered = np.zeros(doc_starts[-1], dtype=bool)
+    for s, n in zip(starts, lengths):
+        covered[s:s + n] = True
+        for d0, d1 in zip(doc_starts[:-1], doc_starts[1:]):
+            inside = max(0, min(s + n, d1) - max(s, d0))
+            if d1 - d0 <= ctx_len + 1:
+                assert inside in (0, d1 - d0)  # short documents are never split
+            elif inside:
+                assert (s - d0) % ctx_len == 0  # long ones only on cuts every ctx_len tokens
+    assert covered.all()
+
+    # the sidecar is reused until the .idx is newer
+    win_path = binidx.window_index_file_path(path, ctx_len)
+    mtime = os.stat(win_path).st_mtime_ns
+
+    def fail(*args):
+        raise AssertionError("window index rebuilt")
+
+    monkeypatch.setattr(binidx, "doc_aligned_windows", fail)
+    again = WindowIndex.load_or_build(path, dataset, ctx_len)
+    assert os.stat(win_path).st_mtime_ns == mtime and again.starts.tolist() == starts
+    os.utime(f"{path}.idx", ns=(mtime + 10**9, mtime + 10**9))
+    with pytest.raises(AssertionError):
+        WindowIndex.load_or_build(path, dataset, ctx_len)
+
+
+@pytest.fixture(scope="module")
+def meta(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("meta") / "x.meta")
+    builder = DocMetadataBuilder(path)
+    rng = np.random.default_rng(0)
+    rows = [(int(rng.integers(1, 200)), i // 50, ["katago", "pro"][i % 2], int(rng.integers(-1, 2)),
+             int(rng.integers(-1, 2))) for i in range(1000)]
+    for row in rows:
+        builder.add(*row)
+    builder.finalize()
+    columns = {name: np.array([row[i] for row in rows]) for i, name in enumerate(("move", "game", "source", "player", "winner"))}
+    return DocMetadata(path), columns
+
+
+def test_select_expressions(meta):
+    m, c = meta
+    move, winner, player, source = c["move"], c["winner"], c["player"], c["source"]
+    cases = {
+        "(move <= 60) & (winner == player)": (move <= 60) & (winner == player),
+        "source_in('katago') and move > 20": (source == "katago") & (move > 20),
+        "not 10 < move <= 60 or ~(winner == -1)": ~((10 < move) & (move <= 60)) | (winner != -1),
+        "move % 2 == 0 and game // 5 != 3": (move % 2 == 0) & (c["game"] // 5 != 3),
+        "source_in('nope')": np.zeros(len(move), dtype=bool),
+    }
+    for expr, expected in cases.items():
+        assert (m.select(expr) == expected).all(), expr
+    assert (m.select(lambda meta: meta["player"] == 0) == (player == 0)).all()
+
+
+@pytest.mark.parametrize("expr", ["__import__('os').system('true')", "np.ones(3)", "move.__class__", "[x for x in ()]",
+                                  "source_in(move)", "'a' == 'a'", "move ** 99", "lambda: 1", "move <"])
+def test_select_rejects_anything_else(meta, expr):
+    with pytest.raises(ValueError):
+        meta[0].select(expr)
@@ -0,0 +1,12 @@
+import json
+
+from clean_tail import remove_text_after_last_space, tail_result
+
+
+def test_clean_tail_keeps_result(tmp_path):
+    src, dst = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    src.write_text(json.dumps({"text": "PdDp QqDd W+R"}) + "\n" + json.dumps({"text": "PdDp Qq"}) + "\n")
+    remove_text_after_last_space(str(src), str(dst))
+    assert [json.loads(line) for line in dst.read_text().splitlines()] == [
+        {"text": "PdDp QqDd", "result": "W+R"}, {"text": "PdDp"}]
+    assert tail_result("PdDp B+3") == "B+3" and tail_result("PdDp QqDd") is None
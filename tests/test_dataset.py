@@ -0,0 +1,165 @@
+import math
+import types
+
+import numpy as np
+import pytest
+import torch
+
+from src.binidx import MMapIndexedDatasetBuilder
+from src.dataset import IGNORE_INDEX, SFT_LENGTH_MULTIPLE, MyDataset, TokenizedSFTDataset
+from src.magic_prime import largest_magic_prime
+
+CTX_LEN = 16
+SHARD_TOKENS = 20000
+
+
+@pytest.fixture(scope="module")
+def shards(tmp_path_factory):
+    """Two raw shards whose tokens are their global position mod 50000, one document each."""
+    tmp = tmp_path_factory.mktemp("binidx")
+    paths = []
+    for s in range(2):
+        path = str(tmp / f"shard{s}")
+        builder = MMapIndexedDatasetBuilder(f"{path}.bin")
+        builder.add_item(((np.arange(SHARD_TOKENS) + s * SHARD_TOKENS) % 50000).astype(np.uint16))
+        builder.end_document()
+        builder.finalize(f"{path}.idx")
+        paths.append(path)
+    return ",".join(paths)
+
+
+def make_dataset(data_file, micro_bsz=4, tbptt=0, epoch=0, rank=0, world_size=1):
+    n_windows = 2 * SHARD_TOKENS // CTX_LEN
+    args = types.SimpleNamespace(
+        vocab_size=50000, data_file=data_file, data_weights="", data_access="normal", data_align="none",
+        data_filter="", data_prefetch=0, data_prefetch_factor=2, epoch_steps=40320 // micro_bsz, real_bsz=micro_bsz,
+        micro_bsz=micro_bsz, train_stage=2, ctx_len=CTX_LEN, magic_prime=largest_magic_prime(n_windows), tbptt=tbptt,
+    )
+    dataset = MyDataset(args)
+    dataset.real_epoch, dataset.global_rank, dataset.world_size = epoch, rank, world_size
+    return dataset
+
+
+def baseline_slot(dataset, idx):
+    """The per-sample formula of the original MyDataset.__getitem__, in Python ints."""
+    magic_prime = dataset.args.magic_prime
+    ii = 1 + dataset.real_epoch * dataset.samples_per_epoch + (idx * dataset.world_size) + dataset.global_rank
+    factor = int(magic_prime * (math.sqrt(5) - 1) / 2)
+    return (factor * ii * ii * ii) % magic_prime
+
+
+@pytest.mark.parametrize("epoch,rank,world_size", [(0, 0, 1), (3, 1, 4), (117, 7, 8)])
+def test_slots_match_baseline(shards, epoch, rank, world_size):
+    dataset = make_dataset(shards, epoch=epoch, rank=rank, world_size=world_size)
+    indices = np.arange(0, 40320, 7)
+    expected = [baseline_slot(dataset, int(i)) for i in indices]
+    assert dataset._slots(indices).tolist() == expected
+    assert int(dataset._slots(int(indices[5]))) == expected[5]
+
+
+def test_slots_large_magic_prime(shards):
+    # products of residues above 2**31 overflow int64, _slots falls back to Python ints
+    dataset = make_dataset(shards, epoch=2)
+    dataset.args.magic_prime = largest_magic_prime(2**40)
+    indices = np.arange(100)
+    assert dataset._slots(indices).tolist() == [baseline_slot(dataset, int(i)) for i in indices]
+
+
+def test_getitems_matches_getitem(shards):
+    dataset = make_dataset(shards)
+    indices = list(range(8, 12))
+    x, y = dataset.__getitems__(indices)
+    for r, i in enumerate(indices):
+        xi, yi = dataset[i]
+        assert (x[r] == xi).all() and (y[r] == yi).all()
+        assert int(xi[0]) == baseline_slot(dataset, i) * CTX_LEN % 50000
+
+
+@pytest.mark.parametrize("tbptt", [2, 3])
+def test_tbptt_windows_follow_each_other(shards, tbptt):
+    micro_bsz = 4
+    dataset = make_dataset(shards, micro_bsz=micro_bsz, tbptt=tbptt, epoch=1)
+    for step in range(0, 5 * tbptt, tbptt):  # first step of each stream
+        batches = [dataset.__getitems__(list(range((step + w) * micro_bsz, (step + w + 1) * micro_bsz)))
+                   for w in range(tbptt)]
+        first = np.minimum(dataset._slots(np.arange(step * micro_bsz, (step + 1) * micro_bsz)), dataset.n_windows - tbptt)
+        for w, (x, y, window) in enumerate(batches):
+            assert window.tolist() == [w] * micro_bsz
+            assert (x[:, 0].numpy() == (first + w) * CTX_LEN % 50000).all()
+            if w:
+                # window w starts where window w - 1 ended in the token stream
+                assert (x[:, 0] == batches[w - 1][1][:, -1]).all()
+
+
+def test_tbptt_windows_stay_in_range(shards):
+    dataset = make_dataset(shards, tbptt=4)
+    slots = dataset._window_slots(np.arange(40320))
+    assert slots.min() >= 0 and slots.max() < dataset.n_windows
+
+
+SFT_CTX_LEN = 64
+
+
+@pytest.fixture(scope="module")
+def sft_data(tmp_path_factory):
+    """60 samples whose tokens are 100 * sample + position, with one or two loss spans each."""
+    path = str(tmp_path_factory.mktemp("sft") / "sft")
+    rng = np.random.default_rng(0)
+    builder = MMapIndexedDatasetBuilder(f"{path}.bin")
+    mask_builder = MMapIndexedDatasetBuilder(f"{path}.mask.bin", dtype=np.int32)
+    spans = []
+    for i in range(60):
+        n = int(rng.integers(3, 90))  # some longer than ctx_len + 1
+        cut = int(rng.integers(1, n))
+        spans.append([(cut, n)] if i % 2 else [(1, cut), (min(cut + 1, n), n)])
+        builder.add_item((100 * i + np.arange(n)).astype(np.uint16))
+        builder.end_document()
+        mask_builder.add_item(np.array(spans[-1], dtype=np.int32).reshape(-1))
+        mask_builder.end_document()
+    builder.finalize(f"{path}.idx")
+    mask_builder.finalize(f"{path}.mask.idx")
+    return path, spans
+
+
+def make_sft_dataset(data_file, sft_batching, micro_bsz=4, world_size=1):
+    args = types.SimpleNamespace(data_file=data_file, vocab_size=10000, ctx_len=SFT_CTX_LEN, sft_batching=sft_batching,
+                                 micro_bsz=micro_bsz, real_bsz=micro_bsz * world_size)
+    dataset = TokenizedSFTDataset(args)
+    dataset.world_size = world_size
+    return dataset
+
+
+@pytest.mark.parametrize("sft_batching", ["pack", "bucket"])
+def test_sft_batches(sft_data, sft_batching):
+    path, spans = sft_data
+    dataset = make_sft_dataset(path, sft_batching)
+    sizes = np.minimum(dataset.data.sizes, SFT_CTX_LEN + 1)
+    assert all(sizes[row].sum() <= SFT_CTX_LEN + 1 for row in dataset.rows)
+    assert sorted(i for row in dataset.rows for i in row) == list(range(60))
+
+    targets = set()
+    for b in range(len(dataset) // 4):
+        x, y = dataset.__getitems__(list(range(4 * b, 4 * b + 4)))
+        T = x.shape[1]
+        assert T <= SFT_CTX_LEN and (T % SFT_LENGTH_MULTIPLE == 0 or T == SFT_CTX_LEN)
+        for j in torch.nonzero(y != IGNORE_INDEX).tolist():
+            i, pos = divmod(int(y[tuple(j)]), 100)
+            assert any(start <= pos < end for start, end in spans[i])  # only span tokens are targets
+            assert int(x[tuple(j)]) == 100 * i + pos - 1  # ... of the token before them
+            targets.add((i, pos))
+    rows = dataset.rows[: dataset.n_batches * 4]
+    expected = {(i, pos) for row in rows for i in row for start, end in spans[i]
+                for pos in range(start, min(end, SFT_CTX_LEN + 1))}
+    assert targets == expected
+
+
+def test_sft_ranks_split_the_batches(sft_data):
+    path, _ = sft_data
+    seen = []
+    for rank in range(2):
+        dataset = make_sft_dataset(path, "pack", world_size=2)
+        dataset.global_rank, dataset.real_epoch = rank, 3
+        assert len(dataset) == dataset.n_batches // 2 * 4
+        seen.append([tuple(map(tuple, dataset._batch(b))) for b in range(len(dataset) // 4)])
+    assert not set(seen[0]) & set(seen[1])
+    assert len(set(seen[0] + seen[1])) == 2 * (dataset.n_batches // 2)
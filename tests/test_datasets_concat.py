@@ -0,0 +1,45 @@
+import collections
+import json
+import random
+
+import pytest
+
+from datasets_concat import estimate_buckets, external_shuffle, iter_records_from_jsonl
+
+
+def lines(n):
+    return [f"{i}\n" for i in range(n)]
+
+
+@pytest.mark.parametrize("n_buckets,max_open", [(1, None), (7, None), (50, 4), (9, 2)])
+def test_external_shuffle_is_a_permutation(tmp_path, n_buckets, max_open):
+    out = list(external_shuffle(iter(lines(3000)), n_buckets, random.Random(0), str(tmp_path), max_open))
+    assert sorted(out) == sorted(lines(3000)) and out != lines(3000)
+    assert list(tmp_path.iterdir()) == []  # bucket files are removed
+    again = list(external_shuffle(iter(lines(3000)), n_buckets, random.Random(0), str(tmp_path), max_open))
+    assert again == out  # same seed, same order
+
+
+@pytest.mark.parametrize("n_buckets,max_open", [(3, None), (4, 2)])
+def test_external_shuffle_is_uniform(tmp_path, n_buckets, max_open):
+    # every order of 4 lines equally likely, also through the two-level split
+    counts = collections.Counter()
+    for seed in range(2400):
+        out = external_shuffle(iter(lines(4)), n_buckets, random.Random(seed), str(tmp_path), max_open)
+        counts["".join(out)] += 1
+    assert len(counts) == 24
+    assert all(50 < c < 150 for c in counts.values())  # 100 expected, 5 sigma
+
+
+def test_estimate_buckets_is_not_clamped(tmp_path):
+    path = tmp_path / "a.jsonl"
+    path.write_text("x" * 10 * 2**20)
+    n_buckets, total_bytes = estimate_buckets([str(path)], 1)
+    assert total_bytes == 10 * 2**20 and n_buckets >= 10
+
+
+def test_concat_keeps_result_and_source(tmp_path):
+    path = tmp_path / "kata.jsonl"
+    path.write_text(json.dumps({"text": "PdDp", "result": "B+R", "extra": 1}) + "\n")
+    record, = iter_records_from_jsonl(str(path), ["text", "result", "source"])
+    assert record == {"text": "PdDp", "result": "B+R", "source": "kata"}
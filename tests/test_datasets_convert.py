@@ -0,0 +1,8 @@
+from datasets_convert import iter_numbered_positions, iter_position_texts
+
+
+def test_move_numbers_count_passes():
+    numbered = list(iter_numbered_positions("PdDp TtQq DdX"))
+    assert [move for move, _ in numbered] == [1, 2, 4, 5]  # the pass at move 3 has no position
+    assert [text for _, text in numbered] == list(iter_position_texts("PdDp TtQq DdX"))
+    assert numbered[2][1].endswith("\nWhiteQq")
@@ -0,0 +1,17 @@
+import pytest
+
+from datasets_dedup import BloomFilter
+
+
+def test_bloom_filter_reopens_without_losing_keys(tmp_path):
+    path = str(tmp_path / "keys.bloom")
+    bloom = BloomFilter(path, n_bits=1 << 12)
+    keys = [bytes([i]) * 16 for i in range(50)]  # bytes(16) puts all hashes in one byte
+    assert not any(bloom.add(k) for k in keys)
+    bloom.close()
+    del bloom
+    bloom = BloomFilter(path, n_bits=1 << 12)
+    assert all(bloom.add(k) for k in keys)
+    with pytest.raises(ValueError):
+        BloomFilter(path, n_bits=1 << 13)
+    assert (tmp_path / "keys.bloom").stat().st_size == (1 << 12) // 8
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from src.magic_prime import is_prime, largest_magic_prime
+
+
+def test_is_prime_matches_sieve():
+    sieve = np.ones(100000, dtype=bool)
+    sieve[:2] = False
+    for p in range(2, 317):
+        if sieve[p]:
+            sieve[p * p::p] = False
+    assert [is_prime(n) for n in range(100000)] == sieve.tolist()
+    # Carmichael numbers and strong pseudoprimes to the first bases
+    assert not any(is_prime(n) for n in (561, 41041, 3215031751, 3825123056546413051, 2**61 + 1))
+    assert is_prime(2**31 - 1) and is_prime(2**61 - 1)
+
+
+@pytest.mark.parametrize("slots", [40320, 99991, 2**31 - 5, 2**31 + 11, 3 * 10**10, 2**40, 2**62 + 17])
+def test_largest_magic_prime(slots):
+    p = largest_magic_prime(slots)
+    assert is_prime(p) and p % 3 == 2
+    assert 0.9 < p / slots <= 1
+    # no larger candidate was skipped
+    assert not any(is_prime(n) for n in range(p + 3, slots + 1, 3))
+
+
+def test_largest_magic_prime_small():
+    for upper in range(200):
+        expected = max([n for n in range(2, upper + 1) if n % 3 == 2 and all(n % d for d in range(2, n))], default=0)
+        assert largest_magic_prime(upper) == expected
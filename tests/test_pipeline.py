@@ -0,0 +1,8 @@
+import pipeline
+
+
+def test_shuffle_round_trips_records(tmp_path):
+    records = [{"text": "PdDp", "source": "s", "kind": "moves", "AB": ["Pd"], "i": i} for i in range(500)]
+    out = list(pipeline.shuffle(iter(records), 5, 0, str(tmp_path)))
+    assert sorted(out, key=lambda rec: rec["i"]) == records and out != records
+    assert list(tmp_path.iterdir()) == []  # bucket files are removed
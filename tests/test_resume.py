@@ -0,0 +1,77 @@
+import types
+
+import numpy as np
+import pytest
+import torch
+
+from src.binidx import MMapIndexedDatasetBuilder
+from src.checkpoint import list_checkpoints, write_sidecar
+from src.dataset import MyDataset
+from src.magic_prime import largest_magic_prime
+from src.trainer import current_real_step, train_callback
+
+CTX_LEN = 16
+MICRO_BSZ = 4
+EPOCH_STEPS = 40320 // MICRO_BSZ
+
+
+@pytest.fixture(scope="module")
+def data_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("resume") / "data")
+    builder = MMapIndexedDatasetBuilder(f"{path}.bin")
+    builder.add_item((np.arange(50000) % 30000).astype(np.uint16))
+    builder.end_document()
+    builder.finalize(f"{path}.idx")
+    return path
+
+
+def make_args(tmp_path, data_file):
+    return types.SimpleNamespace(
+        vocab_size=30000, data_file=data_file, data_weights="", data_access="normal", data_align="none",
+        data_filter="", data_prefetch=0, data_prefetch_factor=2, epoch_steps=EPOCH_STEPS, real_bsz=MICRO_BSZ,
+        micro_bsz=MICRO_BSZ, train_stage=2, ctx_len=CTX_LEN, magic_prime=largest_magic_prime(50000 // CTX_LEN - 1),
+        tbptt=0, proj_dir=str(tmp_path), epoch_begin=0, resume_epoch_step=0, epoch_save=0, epoch_count=10,
+        strategy="auto", data_type="binidx",
+    )
+
+
+def test_resume_from_latest_step_checkpoint(tmp_path, data_file):
+    for name in ("rwkv-init", "rwkv-0", f"rwkv-step-{EPOCH_STEPS + 7}", f"rwkv-step-{EPOCH_STEPS + 9}"):
+        torch.save({}, f"{tmp_path}/{name}.pth")
+    write_sidecar(f"{tmp_path}/rwkv-step-{EPOCH_STEPS + 7}.pth", {"global_step": EPOCH_STEPS + 7})
+    # rwkv-step-{EPOCH_STEPS + 9} has no sidecar yet: still being written, not a resume point
+
+    # the stage 2 resume of train.py
+    args = make_args(tmp_path, data_file)
+    max_step, args.load_model = list_checkpoints(args.proj_dir, args.epoch_steps)[-1]
+    args.epoch_begin, args.resume_epoch_step = divmod(max_step, args.epoch_steps)
+    assert args.load_model.endswith(f"rwkv-step-{EPOCH_STEPS + 7}.pth")
+    assert (args.epoch_begin, args.resume_epoch_step) == (1, 7)
+
+    dataset = MyDataset(args)
+    whole = MyDataset(args)
+    dataset.skip_samples = args.resume_epoch_step * args.micro_bsz
+    callback = train_callback(args)
+    loader = types.SimpleNamespace(dataset=types.SimpleNamespace(datasets=dataset))
+    trainer = types.SimpleNamespace(current_epoch=0, global_step=0, global_rank=0, world_size=1, is_global_zero=False,
+                                    train_dataloader=loader)
+    assert current_real_step(args, trainer) == EPOCH_STEPS + 7
+
+    # the resumed epoch starts at its 8th step
+    callback.on_train_epoch_start(trainer, None)
+    whole.real_epoch = 1
+    assert dataset.real_epoch == 1 and len(dataset) == len(whole) - 7 * MICRO_BSZ
+    for step in range(3):
+        x, y = dataset.__getitems__(list(range(step * MICRO_BSZ, (step + 1) * MICRO_BSZ)))
+        x_ref, y_ref = whole.__getitems__(list(range((step + 7) * MICRO_BSZ, (step + 8) * MICRO_BSZ)))
+        assert (x == x_ref).all() and (y == y_ref).all()
+
+    # ... and the next one is whole again
+    callback.on_train_epoch_end(trainer, None)
+    trainer.current_epoch, trainer.global_step = 1, EPOCH_STEPS - 7
+    callback.on_train_epoch_start(trainer, None)
+    whole.real_epoch = 2
+    assert dataset.skip_samples == 0 and dataset.real_epoch == 2 and len(dataset) == len(whole)
+    assert current_real_step(args, trainer) == 2 * EPOCH_STEPS
+    x, _ = dataset.__getitems__(list(range(MICRO_BSZ)))
+    assert (x == whole.__getitems__(list(range(MICRO_BSZ)))[0]).all()
@@ -0,0 +1,69 @@
+import io
+import random
+import re
+
+import pytest
+
+import sgf_parser
+from sgf_parser import PASS, game_to_record, game_to_text, iter_games, parse_sgf
+
+COORDS = "abcdefghijklmnopqrs"
+
+EDGE_CASES = [
+    "(;FF[4]SZ[19]AB[dd][pp]AW[dp:eq];B[pd];W[];B[tt];W[qq])",  # setup, pass as B[] and as tt
+    "(;SZ[9]KM[6.5];B[ee](;W[cc];B[gg])(;W[gg]))",  # variations: only the main line is kept
+    "junk (;GM[1]C[a \\] b]RE[W+R];B[aa];W[bb])\n  ( ; SZ [13] ; B [dd] ; W [ee] )",
+    "(;PB[x]PW[y]HA[2];W[pd]C[hi];B[dd])",
+    "(;SZ[25];B[tt];W[aa])",
+]
+
+
+def plain_game(rng):
+    n = rng.randint(1, 40)
+    head = f"(;FF[4]GM[1]SZ[19]KM[7.5]PB[a b]RE[{rng.choice('BW')}+R]"
+    return head + "".join(f";{'BW'[i % 2]}[{rng.choice(COORDS)}{rng.choice(COORDS)}]" for i in range(n)) + ")\n"
+
+
+def dump(games):
+    return [(g.size, g.komi, g.handicap, g.result, g.setup_black, g.setup_white, list(g.iter_moves())) for g in games]
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(3)
+    return ("".join(plain_game(rng) for _ in range(100)) + "\n".join(EDGE_CASES)
+            + "".join(plain_game(rng) for _ in range(30)) + "(;SZ[19];B[pd];W[dp]")  # cut off at the end
+
+
+@pytest.mark.parametrize("chunk_size", [None, 7, 100, 4096])
+def test_fast_path_matches_token_path(corpus, chunk_size, monkeypatch):
+    def parse():
+        if chunk_size is None:
+            return dump(parse_sgf(corpus))
+        return dump(iter_games(io.StringIO(corpus), chunk_size=chunk_size))
+
+    fast = parse()
+    monkeypatch.setattr(sgf_parser, "_GAME_RE", re.compile(r"(?!)"))  # never matches: tokens only
+    assert fast == parse()
+    assert len(fast) == 100 + 6 + 30 + 1  # the junk case holds two games
+
+
+def test_chunked_stream_matches_whole_text(corpus):
+    whole = dump(parse_sgf(corpus))
+    for chunk_size in (1, 13, 1 << 20):
+        assert dump(iter_games(io.StringIO(corpus), chunk_size=chunk_size)) == whole
+
+
+def test_game_properties():
+    game, = parse_sgf("(;FF[4]SZ[19]KM[6.5]HA[2]RE[B+3.5]AB[dd][pp]AW[dp:eq];W[qd];B[];W[tt];B[qq])")
+    assert (game.size, game.komi, game.handicap, game.result) == (19, 6.5, 2, "B+3.5")
+    assert game.setup_white == ["dp", "dq", "ep", "eq"]
+    assert list(game.iter_moves()) == [("W", "qd"), ("B", PASS), ("W", PASS), ("B", "qq")]
+    # white first and passes become "Tt", keeping (black, white) pairs
+    assert game_to_text(game) == "TtQd TtTt QqX"
+    assert game_to_record(game)["AB"] == ["Dd", "Pp"]
+
+
+def test_main_line_of_variations():
+    game, = parse_sgf("(;SZ[9];B[ee](;W[cc];B[gg](;W[aa])(;W[bb]))(;W[gg]))")
+    assert [m for _, m in game.iter_moves()] == ["ee", "cc", "gg", "aa"]
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+from src.wkv7_torch import RUN_TORCH_RWKV7s, _random_inputs, wkv7_chunked, wkv7_naive
+
+
+def rel_err(a, b):
+    return ((a - b).abs().max() / b.abs().max().clamp_min(1e-12)).item()
+
+
+@pytest.mark.parametrize("B,T,H,N", [(2, 16, 2, 64), (1, 75, 3, 64), (2, 64, 1, 16)])
+def test_wkv7_chunked_matches_naive(B, T, H, N):
+    inputs = [x.double().requires_grad_() for x in _random_inputs(B, T, H, N)]
+    y_ref, s_ref = wkv7_naive(*inputs)
+    y, s = wkv7_chunked(*inputs)
+    assert rel_err(y, y_ref) < 1e-6 and rel_err(s, s_ref) < 1e-6
+    dy = torch.randn_like(y)
+    grads = torch.autograd.grad((y * dy).sum(), inputs)
+    grads_ref = torch.autograd.grad((y_ref * dy).sum(), inputs)
+    assert max(rel_err(g, r) for g, r in zip(grads, grads_ref)) < 1e-6
+
+
+def test_wkv7_state_carries_over_windows():
+    B, T, H, N = 2, 96, 2, 64
+    q, w, k, v, a, b = [x.double().reshape(B, T, H * N) for x in _random_inputs(B, T, H, N)]
+    s0 = torch.randn(B, H, N, N, dtype=torch.float64) * 0.1
+    y_full, s_full = RUN_TORCH_RWKV7s(q, w, k, v, a, b, s0)
+    s, ys = s0, []
+    for t0, t1 in ((0, 16), (16, 33), (33, 96)):
+        y, s = RUN_TORCH_RWKV7s(*[x[:, t0:t1] for x in (q, w, k, v, a, b)], s)
+        ys.append(y)
+    assert rel_err(torch.cat(ys, 1), y_full) < 1e-6 and rel_err(s, s_full) < 1e-6
@@ -25,6 +25,8 @@ if __name__ == "__main__":
     parser.add_argument("--random_seed", default="-1", type=int)
 
     parser.add_argument("--data_file", default="", type=str)
+    # binidx shards: --data_file "a,b" or "shards/*", one sampling weight per shard (default all 1)
+    parser.add_argument("--data_weights", default="", type=str)
     parser.add_argument("--data_type", default="utf-8", type=str)
     # vocab_size = 0 means auto (for char-level LM and .txt data)
     parser.add_argument("--vocab_size", default=0, type=int)
@@ -56,8 +58,11 @@ if __name__ == "__main__":
     parser.add_argument("--beta1", default=0.9, type=float)
     parser.add_argument("--beta2", default=0.99, type=float)
     parser.add_argument("--adam_eps", default=1e-18, type=float)
-    # gradient checkpt: saves VRAM, but slower
+    # gradient checkpt: saves VRAM, but slower. 1 = deepspeed, every block; 2 = torch.utils.checkpoint on every
+    # grad_cp_every-th block, the whole block or only its ffn (grad_cp_policy block / ffn)
     parser.add_argument("--grad_cp", default=0, type=int)
+    parser.add_argument("--grad_cp_every", default=1, type=int)
+    parser.add_argument("--grad_cp_policy", default="block", type=str)
     parser.add_argument("--weight_decay", default=0, type=float)  # try 0.1
     # reduce it to 0.7 / 0.5 / 0.3 / 0.2 for problematic samples
     parser.add_argument("--grad_clip", default=1.0, type=float)
@@ -73,6 +78,44 @@ if __name__ == "__main__":
     parser.add_argument("--my_testing", default="x070", type=str)
     parser.add_argument("--my_exit_tokens", default=0, type=int)
     parser.add_argument("--compile", default=1, type=int)
+    parser.add_argument("--wkv_backend", default="auto", type=str)  # auto / cuda / torch
+    # binidx readahead hint (random / sequential / normal) and windows to page in ahead of the sampler
+    parser.add_argument("--data_access", default="random", type=str)
+    parser.add_argument("--data_prefetch", default=0, type=int)
+    # persistent DataLoader workers and batches each of them keeps ready
+    parser.add_argument("--data_workers", default=1, type=int)
+    parser.add_argument("--data_prefetch_factor", default=2, type=int)
+    # none = windows on a fixed ctx_len grid, doc = whole positions packed into ctx_len (.win sidecar)
+    parser.add_argument("--data_align", default="none", type=str)
+    # only sample positions matching a predicate over the .meta sidecar, e.g. "(move <= 60) & (winner == player)"
+    parser.add_argument("--data_filter", default="", type=str)
+    # tokenized SFT data (data/make_sft_data.py): bucket = batches of similar length, pack = several samples per row
+    parser.add_argument("--sft_batching", default="bucket", type=str)
+    # truncated BPTT: each micro-batch row walks tbptt consecutive ctx_len windows of the data stream, one per
+    # step, and every window starts from the detached final WKV / token-shift state of the previous one (0 = off;
+    # needs --data_align none, no --data_filter and data weights of 1)
+    parser.add_argument("--tbptt", default=0, type=int)
+    # compute head + cross-entropy + L2Wrap this many tokens at a time, without the full (B, T, vocab) logits
+    # and L2Wrap's dense gradient (one extra head matmul in the backward; 0 = off, not with deepspeed stage 3)
+    parser.add_argument("--loss_chunk", default=0, type=int)
+    # split each step into data / forward / backward / optimizer / checkpoint time: rolling percentiles over
+    # this many steps to train_log.txt and wandb, every step to proj_dir/step_timing.rank{N}.jsonl (0 = off)
+    parser.add_argument("--step_timing", default=0, type=int)
+    # torch.profiler from global step profile_at (-1 = off): repeat x (warmup + active) steps, then disarmed.
+    # Chrome / TensorBoard traces and top-ops tables per rank go to proj_dir/profile (src/profiler.py)
+    parser.add_argument("--profile_at", default=-1, type=int)
+    parser.add_argument("--profile_warmup", default=2, type=int)
+    parser.add_argument("--profile_active", default=3, type=int)
+    parser.add_argument("--profile_repeat", default=1, type=int)
+    parser.add_argument("--profile_stack", default=0, type=int)  # 1 = record Python stacks, tables by source line
+    parser.add_argument("--profile_memory", default=0, type=int)
+    # write checkpoints from pinned CPU copies in a background thread (not with deepspeed stage 3),
+    # and keep only the newest keep_last rwkv-N.pth (0 = all)
+    parser.add_argument("--async_save", default=1, type=int)
+    parser.add_argument("--keep_last", default=0, type=int)
+    # also save rwkv-step-{global step}.pth every step_save steps (the newest 2 are kept), and the optimizer
+    # state of every rank with each checkpoint: stage >= 2 runs then resume exactly at the next sample
+    parser.add_argument("--step_save", default=0, type=int)
 
     parser = Trainer.add_argparse_args(parser)
     args = parser.parse_args()
@@ -121,6 +164,10 @@ if __name__ == "__main__":
     os.environ["RWKV_MY_TESTING"] = args.my_testing
     os.environ["RWKV_CTXLEN"] = str(args.ctx_len)
     os.environ["RWKV_HEAD_SIZE"] = str(args.head_size)
+    # auto: the CUDA kernel when there is a GPU, else the pure PyTorch ops (src/wkv7_torch.py)
+    if args.wkv_backend == "auto" and args.accelerator == "cpu":
+        args.wkv_backend = "torch"
+    os.environ["RWKV_WKV_BACKEND"] = args.wkv_backend
     if args.dim_att <= 0:
         args.dim_att = args.n_embd
     if args.dim_ffn <= 0:
@@ -133,32 +180,33 @@ if __name__ == "__main__":
     if not os.path.exists(args.proj_dir):
         os.makedirs(args.proj_dir)
 
+    if args.magic_prime <= 0 and args.data_type != "sft":  # MyDataset reads a binidx
+        from src.magic_prime import compute_magic_prime
+
+        args.magic_prime, data_size = compute_magic_prime(
+            args.data_file, args.ctx_len, args.data_weights, args.data_align, args.data_filter
+        )
+        rank_zero_info(f"########## magic_prime = {args.magic_prime} (from {data_size} tokens) ##########")
+
     args.epoch_count = args.magic_prime // 40320
     args.epoch_steps = 40320 // args.real_bsz
     assert args.epoch_steps * args.real_bsz == 40320
 
+    args.resume_epoch_step = 0  # steps of epoch_begin already trained
+    args.resume_optim = ""  # checkpoint whose optimizer states to restore
     if args.train_stage >= 2:  # find latest saved model
-        list_p = []
-        for p in os.listdir(args.proj_dir):
-            if p.startswith("rwkv") and p.endswith(".pth"):
-                p = ((p.split("-"))[1].split("."))[0]
-                if p != "final":
-                    if p == "init":
-                        p = -1
-                    else:
-                        p = int(p)
-                    list_p += [p]
-        list_p.sort()
-        max_p = list_p[-1]
+        from src.checkpoint import list_checkpoints, resume_optim_state
+
+        # rwkv-init (step 0), rwkv-N (end of epoch N) and rwkv-step-S (--step_save), by global step
+        list_p = list_checkpoints(args.proj_dir, args.epoch_steps)
+        max_step, args.load_model = list_p[-1]
         if len(list_p) > 1:
             args.my_pile_prev_p = list_p[-2]  # in case max_p is corrupted
-        if max_p == -1:
-            args.load_model = f"{args.proj_dir}/rwkv-init.pth"
-        else:
-            args.load_model = f"{args.proj_dir}/rwkv-{max_p}.pth"
-            if args.warmup_steps < 0:
-                args.warmup_steps = 10
-        args.epoch_begin = max_p + 1
+        if max_step > 0 and args.warmup_steps < 0:
+            args.warmup_steps = 10
+        args.epoch_begin, args.resume_epoch_step = divmod(max_step, args.epoch_steps)
+        if resume_optim_state(args.load_model, int(args.num_nodes) * int(args.devices)):
+            args.resume_optim = args.load_model
 
     samples_per_epoch = args.epoch_steps * args.real_bsz
     tokens_per_epoch = samples_per_epoch * args.ctx_len
@@ -224,6 +272,7 @@ if __name__ == "__main__":
     if "deepspeed_stage_3" in args.strategy:
         os.environ["RWKV_JIT_ON"] = "0"  # somehow incompatible
         os.environ["RWKV_COMPILE_ON"] = "0"  # somehow incompatible
+        args.loss_chunk = 0  # reads the partitioned head weight outside of its module
     else:
         os.environ["RWKV_JIT_ON"] = "1"
 
@@ -245,17 +294,30 @@ if __name__ == "__main__":
 
     ########################################################################################################
 
-    from src.dataset import MyDataset, SFTDataset
+    from src.dataset import MyDataset, SFTDataset, TokenizedSFTDataset, collate_batch
     from src.trainer import generate_init_weight, train_callback
 
-    if args.data_type == "sft":
+    if args.data_type == "sft" and os.path.exists(args.data_file + ".idx"):
+        # tokenized by data/make_sft_data.py, batched by length
+        assert args.tbptt <= 1, "--tbptt needs a binidx data stream"
+        train_data = TokenizedSFTDataset(args)
+        print("start SFT Training🎉")
+    elif args.data_type == "sft":
+        assert args.tbptt <= 1, "--tbptt needs a binidx data stream"
         max_length = args.ctx_len
         tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
         train_data = SFTDataset(args.data_file, tokenizer, max_length+1)
         print("start SFT Training🎉")
     else:
+        if args.tbptt > 1:
+            # the windows of a stream must follow each other in the token stream
+            assert args.data_align == "none" and not args.data_filter, "--tbptt needs --data_align none, no --data_filter"
+            assert all(float(w) == 1 for w in args.data_weights.split(",") if w.strip()), "--tbptt needs data weights of 1"
         train_data = MyDataset(args)
         args.vocab_size = train_data.vocab_size
+        if args.tbptt > 1:
+            rank_zero_info(f"########## tbptt: {args.tbptt} consecutive windows per stream, "
+                           f"{args.tbptt * args.ctx_len} tokens of state ##########")
         print("start Pre-Training🎉")
 
     from src.model import RWKV
@@ -280,12 +342,9 @@ if __name__ == "__main__":
     except BaseException:
         rank_zero_info(f"Bad checkpoint {args.load_model}")
         if args.train_stage >= 2:  # try again using another checkpoint
-            max_p = args.my_pile_prev_p
-            if max_p == -1:
-                args.load_model = f"{args.proj_dir}/rwkv-init.pth"
-            else:
-                args.load_model = f"{args.proj_dir}/rwkv-{max_p}.pth"
-            args.epoch_begin = max_p + 1
+            max_step, args.load_model = args.my_pile_prev_p
+            args.epoch_begin, args.resume_epoch_step = divmod(max_step, args.epoch_steps)
+            args.resume_optim = args.load_model if resume_optim_state(args.load_model, int(args.num_nodes) * int(args.devices)) else ""
             rank_zero_info(f"Trying {args.load_model}")
             load_dict = torch.load(args.load_model, map_location="cpu")
 
@@ -296,6 +355,17 @@ if __name__ == "__main__":
                 load_dict[k] = model.state_dict()[k]
     model.load_state_dict(load_dict)
 
+    if args.resume_epoch_step > 0:
+        # mid-epoch resume: the first epoch starts at the next sample, the loader length is
+        # re-read every epoch so the following ones are whole again
+        rank_zero_info(
+            f"########## Resuming epoch {args.epoch_begin} at step {args.resume_epoch_step}"
+            f"{' with optimizer state' if args.resume_optim else ''} ##########"
+        )
+        if hasattr(train_data, "skip_samples"):
+            train_data.skip_samples = args.resume_epoch_step * args.micro_bsz
+        args.reload_dataloaders_every_n_epochs = 1
+
     trainer = Trainer.from_argparse_args(
         args,
         callbacks=[train_callback(args)],
@@ -318,15 +388,21 @@ if __name__ == "__main__":
             args.ds_bucket_mb * 1000 * 1000
         )
 
-    # must set shuffle=False, persistent_workers=False (because worker is in another thread)
+    # must set shuffle=False. Workers can be persistent: MyDataset keeps the epoch / rank
+    # set by train_callback in shared memory, so they see every new epoch
+    loader_kwargs = {}
+    if args.data_workers > 0:
+        loader_kwargs = dict(persistent_workers=True, prefetch_factor=args.data_prefetch_factor)
     data_loader = DataLoader(
         train_data,
         shuffle=False,
         pin_memory=True,
         batch_size=args.micro_bsz,
-        num_workers=1,
-        persistent_workers=False,
+        num_workers=args.data_workers,
         drop_last=True,
+        # MyDataset / TokenizedSFTDataset.__getitems__ return whole micro-batches
+        collate_fn=collate_batch if hasattr(train_data, "__getitems__") else None,
+        **loader_kwargs,
     )
 
     trainer.fit(model, data_loader)